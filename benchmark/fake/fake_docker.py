@@ -0,0 +1,1013 @@
+#!/usr/bin/env python
+"""
+Simulated docker-machine and docker commands
+
+This script stands in for the docker-machine command on the host and for
+the docker command on the (simulated) nodes. Which one it is depends on
+the name it is called by. All state (hosts, Swarm nodes, services,
+networks, images) is stored in a JSON file in the directory pointed to
+by $FAKE_DOCKER_STATE. Hosts whose names start with a different host
+prefix are part of different Swarms.
+
+docker-machine ssh <node> <command> runs command using sh, with the
+directory containing this script prepended to $PATH and $FAKE_NODE set to
+the name of the node. Remote docker commands end up in this script
+again.
+
+Latencies can be configured using these environment variables (seconds):
+
+FAKE_DOCKER_MACHINE_LATENCY     Every docker-machine invocation
+FAKE_DOCKER_SSH_LATENCY         Every new SSH session
+FAKE_DOCKER_CREATE_LATENCY      Every docker-machine create
+FAKE_DOCKER_LATENCY             Every (remote) docker invocation
+FAKE_DOCKER_DOWN_LATENCY        Delay before a stopped node is noticed to
+                                be down by the Swarm managers
+
+If $MACHINE_STORAGE_PATH is set, docker-machine create writes a host
+configuration to it, like the real docker-machine does. Commands can
+then also be run on nodes using ssh, which is simulated as well. A
+connection to a node is only set up (and FAKE_DOCKER_SSH_LATENCY only
+paid) when no master connection to it exists yet (ControlMaster).
+
+VBoxManage supports just enough (savestate, snapshot, clonevm, modifyvm
+--natpf1) to pause hosts and to create hosts as linked clones.
+
+Each invocation is appended to calls.log in the state directory.
+"""
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import time
+import uuid
+
+
+state_directory = os.environ["FAKE_DOCKER_STATE"]
+state_pathname = os.path.join(state_directory, "state.json")
+lock_pathname = os.path.join(state_directory, "state.lock")
+log_pathname = os.path.join(state_directory, "calls.log")
+
+
+def latency(
+        name):
+    return float(os.environ.get(name, "0"))
+
+
+def log_call(
+        program,
+        arguments):
+    with open(log_pathname, "a") as file:
+        file.write("{}\n".format(json.dumps([program] + arguments)))
+
+
+def empty_swarm_state():
+    return {
+        "nodes": {},
+        "tokens": {},
+        "services": {},
+        "networks": {
+            "bridge": {"Driver": "bridge", "Scope": "local"},
+            "host": {"Driver": "host", "Scope": "local"},
+            "none": {"Driver": "null", "Scope": "local"},
+        },
+    }
+
+
+def empty_state():
+    return {
+        "hosts": {},
+        "swarms": {},
+        "images": {},
+        "nr_hosts_created": 0,
+    }
+
+
+@contextlib.contextmanager
+def state(
+        write=True):
+    with open(lock_pathname, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+        try:
+            if os.path.exists(state_pathname):
+                with open(state_pathname) as file:
+                    data = json.load(file)
+            else:
+                data = empty_state()
+
+            # On a node, the state of the Swarm of the node is merged in.
+            # Hosts with different host prefixes are part of different
+            # Swarms.
+            view = dict(data)
+
+            if "FAKE_NODE" in os.environ:
+                prefix = os.environ["FAKE_NODE"].split("-")[0]
+                view.update(data["swarms"].setdefault(prefix,
+                    empty_swarm_state()))
+
+            yield view
+
+            for key, value in view.items():
+                if key in data:
+                    data[key] = value
+                else:
+                    data["swarms"][prefix][key] = value
+
+            if write:
+                with open(state_pathname + ".tmp", "w") as file:
+                    json.dump(data, file)
+                os.rename(state_pathname + ".tmp", state_pathname)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def fail(
+        message):
+    sys.stderr.write("{}\n".format(message))
+    sys.exit(1)
+
+
+def render(
+        template,
+        record):
+    """
+    Render a (very small subset of a) Go template
+    """
+
+    def value(
+            match):
+        expression = match.group(1).strip()
+
+        if expression == "json .":
+            return json.dumps(record, sort_keys=True)
+
+        assert expression.startswith("."), expression
+        result = record
+
+        for name in expression[1:].split("."):
+            result = result[name]
+
+        return str(result)
+
+    return re.sub(r"{{(.*?)}}", value, template).replace("\\t", "\t")
+
+
+def option_value(
+        arguments,
+        name,
+        default=None):
+    """
+    Remove option name from arguments and return its value
+    """
+    for i, argument in enumerate(arguments):
+        if argument == name:
+            value = arguments[i + 1]
+            del arguments[i:i + 2]
+            return value
+        elif argument.startswith(name + "="):
+            del arguments[i]
+            return argument[len(name) + 1:]
+
+    return default
+
+
+def option_values(
+        arguments,
+        name):
+    result = []
+    value = option_value(arguments, name)
+
+    while value is not None:
+        result.append(value)
+        value = option_value(arguments, name)
+
+    return result
+
+
+def flag(
+        arguments,
+        *names):
+    result = False
+
+    for name in names:
+        while name in arguments:
+            arguments.remove(name)
+            result = True
+
+    return result
+
+
+def update_node_states(
+        data):
+    # Nodes on stopped hosts are noticed to be down after a while.
+    now = time.time()
+
+    for hostname, node in data["nodes"].items():
+        host = data["hosts"].get(hostname, {"state": "Removed"})
+
+        if host["state"] != "Running" and node["status"] == "ready" and \
+                now >= host.get("stopped_at", 0) + \
+                    latency("FAKE_DOCKER_DOWN_LATENCY"):
+            node["status"] = "down"
+
+
+# docker-machine ---------------------------------------------------------------
+
+
+def machine_ls(
+        arguments):
+    quiet = flag(arguments, "--quiet", "-q")
+    format = option_value(arguments, "--format", option_value(arguments,
+        "-f"))
+    filters = option_values(arguments, "--filter")
+
+    with state(write=False) as data:
+        hosts = data["hosts"]
+
+    lines = []
+
+    for name in sorted(hosts):
+        host = hosts[name]
+        record = {
+            "Name": name,
+            "State": host["state"],
+            "DriverName": host["driver"],
+            "URL": "tcp://{}:2376".format(host["ip"]) if
+                host["state"] == "Running" else "",
+        }
+
+        if any(filter == "state={}".format(host["state"]) for filter in
+                filters) or not filters:
+            if format:
+                lines.append(render(format, record))
+            elif quiet:
+                lines.append(name)
+            else:
+                lines.append("{}\t{}\t{}".format(name, host["driver"],
+                    host["state"]))
+
+    if not quiet and not format:
+        lines.insert(0, "NAME\tDRIVER\tSTATE")
+
+    sys.stdout.write("".join("{}\n".format(line) for line in lines))
+
+
+def machine_create(
+        arguments):
+    name = arguments[-1]
+    driver = option_value(arguments, "--driver", "virtualbox")
+    time.sleep(latency("FAKE_DOCKER_CREATE_LATENCY"))
+
+    with state() as data:
+        if name in data["hosts"]:
+            fail("Host already exists: \"{}\"".format(name))
+
+        data["nr_hosts_created"] += 1
+        idx = data["nr_hosts_created"]
+        host = data["hosts"][name] = {
+            "state": "Running",
+            "driver": driver,
+            "ip": "192.168.{}.{}".format(99 + idx // 250, 1 + idx % 250),
+            "ssh_port": 40000 + idx,
+            "options": arguments[:-1],
+        }
+        data["images"][name] = []
+
+    if "MACHINE_STORAGE_PATH" in os.environ:
+        directory = os.path.join(os.environ["MACHINE_STORAGE_PATH"],
+            "machines", name)
+        os.makedirs(directory)
+
+        with open(os.path.join(directory, "config.json"), "w") as file:
+            json.dump({
+                    "Name": name,
+                    "DriverName": driver,
+                    "Driver": {
+                        "MachineName": name,
+                        "IPAddress": host["ip"],
+                        "SSHUser": "docker",
+                        "SSHPort": host["ssh_port"] if driver ==
+                            "virtualbox" else 22,
+                        "SSHKeyPath": os.path.join(directory, "id_rsa"),
+                    },
+                }, file)
+
+    sys.stdout.write("Docker is up and running!\n")
+
+
+def update_configuration(
+        name,
+        host):
+    # Like docker-machine, record the IP address of a host when it starts.
+    if "MACHINE_STORAGE_PATH" in os.environ:
+        pathname = os.path.join(os.environ["MACHINE_STORAGE_PATH"],
+            "machines", name, "config.json")
+
+        if os.path.exists(pathname):
+            with open(pathname) as file:
+                configuration = json.load(file)
+
+            configuration["Driver"]["IPAddress"] = host["ip"]
+
+            with open(pathname, "w") as file:
+                json.dump(configuration, file)
+
+
+def set_host_state(
+        names,
+        from_states,
+        to_state):
+    with state() as data:
+        for name in names:
+            if name not in data["hosts"]:
+                fail("Host does not exist: \"{}\"".format(name))
+
+            host = data["hosts"][name]
+
+            if host["state"] in from_states:
+                host["state"] = to_state
+
+                if to_state != "Running":
+                    host["stopped_at"] = time.time()
+                else:
+                    update_configuration(name, host)
+
+    for name in names:
+        sys.stdout.write("{} \"{}\"...\n".format(to_state, name))
+
+
+def machine_rm(
+        arguments):
+    flag(arguments, "-f", "-y", "--force")
+
+    with state() as data:
+        for name in arguments:
+            if name not in data["hosts"]:
+                fail("Host does not exist: \"{}\"".format(name))
+
+            del data["hosts"][name]
+            data["images"].pop(name, None)
+
+            if "MACHINE_STORAGE_PATH" in os.environ:
+                shutil.rmtree(os.path.join(os.environ["MACHINE_STORAGE_PATH"],
+                    "machines", name), ignore_errors=True)
+
+    for name in arguments:
+        sys.stdout.write("Successfully removed {}\n".format(name))
+
+
+def machine_ip(
+        arguments):
+    with state(write=False) as data:
+        for name in arguments:
+            sys.stdout.write("{}\n".format(data["hosts"][name]["ip"]))
+
+
+def run_on_node(
+        name,
+        command):
+    environment = dict(os.environ)
+    environment["FAKE_NODE"] = name
+    environment["PATH"] = "{}:{}".format(
+        os.path.dirname(os.path.abspath(__file__)), os.environ["PATH"])
+
+    sys.exit(subprocess.call(["sh", "-c", command], env=environment))
+
+
+def machine_ssh(
+        arguments):
+    name = arguments[0]
+
+    with state(write=False) as data:
+        if name not in data["hosts"]:
+            fail("Host does not exist: \"{}\"".format(name))
+        if data["hosts"][name]["state"] != "Running":
+            fail("Error: {} is not running".format(name))
+
+    time.sleep(latency("FAKE_DOCKER_SSH_LATENCY"))
+    run_on_node(name, " ".join(arguments[1:]))
+
+
+def docker_machine(
+        arguments):
+    time.sleep(latency("FAKE_DOCKER_MACHINE_LATENCY"))
+    command = arguments.pop(0)
+
+    if command == "ls":
+        machine_ls(arguments)
+    elif command == "create":
+        machine_create(arguments)
+    elif command == "stop":
+        set_host_state(arguments, ["Running", "Saved"], "Stopped")
+    elif command == "start":
+        set_host_state(arguments, ["Stopped", "Saved"], "Running")
+    elif command == "rm":
+        machine_rm(arguments)
+    elif command == "ip":
+        machine_ip(arguments)
+    elif command == "ssh":
+        machine_ssh(arguments)
+    elif command in ["provision", "regenerate-certs"]:
+        pass
+    else:
+        fail("docker-machine: unsupported command: {}".format(command))
+
+
+# VBoxManage -------------------------------------------------------------------
+
+
+def vbox_clonevm(
+        arguments):
+    snapshot = option_value(arguments, "--snapshot")
+    name = option_value(arguments, "--name")
+    option_value(arguments, "--options")
+    option_value(arguments, "--basefolder")
+    flag(arguments, "--register")
+    source = arguments[0]
+
+    with state() as data:
+        if source not in data["hosts"]:
+            fail("VBoxManage: Could not find a registered machine named "
+                "'{}'".format(source))
+        if snapshot not in data["hosts"][source].get("snapshots", []):
+            fail("VBoxManage: Could not find a snapshot named '{}'".format(
+                snapshot))
+        if name in data["hosts"]:
+            fail("VBoxManage: Machine '{}' already exists".format(name))
+
+        data["nr_hosts_created"] += 1
+        idx = data["nr_hosts_created"]
+        data["hosts"][name] = {
+            "state": "Stopped",
+            "driver": "virtualbox",
+            "ip": "192.168.{}.{}".format(99 + idx // 250, 1 + idx % 250),
+            "ssh_port": None,
+            "options": data["hosts"][source]["options"],
+            "stopped_at": time.time(),
+        }
+        data["images"][name] = list(data["images"].get(source, []))
+
+
+def vbox_modifyvm(
+        arguments):
+    name = arguments.pop(0)
+    rule = option_value(arguments, "--natpf1")
+
+    with state() as data:
+        host = data["hosts"][name]
+
+        if rule == "delete" and arguments == ["ssh"]:
+            host["ssh_port"] = None
+        elif rule is not None and rule.startswith("ssh,"):
+            host["ssh_port"] = int(rule.split(",")[3])
+        else:
+            fail("VBoxManage: unsupported modifyvm arguments")
+
+
+def vboxmanage(
+        arguments):
+    command = arguments.pop(0)
+
+    if command == "controlvm" and arguments[1] == "savestate":
+        set_host_state([arguments[0]], ["Running"], "Saved")
+    elif command == "snapshot" and arguments[1] == "take":
+        with state() as data:
+            data["hosts"][arguments[0]].setdefault("snapshots", []).append(
+                arguments[2])
+    elif command == "clonevm":
+        vbox_clonevm(arguments)
+    elif command == "modifyvm":
+        vbox_modifyvm(arguments)
+    else:
+        fail("VBoxManage: unsupported command: {}".format(command))
+
+
+# ssh --------------------------------------------------------------------------
+
+
+def ssh(
+        arguments):
+    options = {}
+    control_command = option_value(arguments, "-O")
+    port = int(option_value(arguments, "-p", "22"))
+    option_value(arguments, "-i")
+
+    for value in option_values(arguments, "-o"):
+        key, value = value.split("=", 1)
+        options[key] = value
+
+    user, ip_address = arguments.pop(0).split("@")
+    command = " ".join(arguments)
+
+    with state(write=False) as data:
+        names = [name for name, host in data["hosts"].items() if
+            (ip_address == "127.0.0.1" and host["ssh_port"] == port) or
+            (ip_address == host["ip"])]
+
+        if not names or data["hosts"][names[0]]["state"] != "Running":
+            fail("ssh: connect to host {} port {}: Connection refused".format(
+                ip_address, port))
+
+    # Control sockets are simulated by regular files.
+    control_path = options.get("ControlPath")
+
+    if control_path is not None:
+        control_path = control_path.replace("%C", "{}-{}-{}".format(user,
+            ip_address, port))
+
+    if control_command is not None:
+        if control_path is None or not os.path.exists(control_path):
+            fail("Control socket connect({}): No such file or directory"
+                .format(control_path))
+
+        assert control_command == "exit", control_command
+        os.remove(control_path)
+        sys.exit(0)
+
+    if control_path is None or not os.path.exists(control_path):
+        time.sleep(latency("FAKE_DOCKER_SSH_LATENCY"))
+
+        if control_path is not None and \
+                options.get("ControlMaster") in ["auto", "yes"]:
+            open(control_path, "w").close()
+
+    run_on_node(names[0], command)
+
+
+# docker -----------------------------------------------------------------------
+
+
+def this_node():
+    return os.environ["FAKE_NODE"]
+
+
+def node_record(
+        hostname,
+        node):
+    return {
+        "ID": node["id"],
+        "Hostname": hostname,
+        "Status": node["status"].capitalize(),
+        "Availability": "Active",
+        "ManagerStatus": node.get("manager_status", ""),
+        "EngineVersion": "17.06.0-ce",
+        "Self": hostname == os.environ.get("FAKE_NODE"),
+        "TLSStatus": "Ready",
+    }
+
+
+def assert_manager(
+        data):
+    node = data["nodes"].get(this_node())
+
+    if node is None or node["role"] != "manager":
+        fail("Error response from daemon: This node is not a swarm manager.")
+
+
+def docker_node(
+        arguments):
+    command = arguments.pop(0)
+    format = option_value(arguments, "--format", option_value(arguments,
+        "-f"))
+
+    with state() as data:
+        assert_manager(data)
+        update_node_states(data)
+        nodes = data["nodes"]
+
+        if command == "ls":
+            records = [node_record(hostname, nodes[hostname]) for hostname in
+                sorted(nodes)]
+
+            if format:
+                for record in records:
+                    sys.stdout.write("{}\n".format(render(format, record)))
+            else:
+                sys.stdout.write("ID\tHOSTNAME\tSTATUS\tAVAILABILITY\t"
+                    "MANAGER STATUS\n")
+                for record in records:
+                    sys.stdout.write("{ID}\t{Hostname}\t{Status}\t"
+                        "{Availability}\t{ManagerStatus}\n".format(**record))
+        elif command == "inspect":
+            for hostname in arguments:
+                if hostname not in nodes:
+                    fail("Error: No such node: {}".format(hostname))
+
+                record = {"Status": {"State": nodes[hostname]["status"]},
+                    "Description": {"Hostname": hostname}}
+                sys.stdout.write("{}\n".format(render(format, record) if
+                    format else json.dumps(record)))
+        elif command == "rm":
+            flag(arguments, "--force", "-f")
+            status = 0
+
+            for hostname in arguments:
+                if hostname not in nodes:
+                    sys.stderr.write("Error: No such node: {}\n".format(
+                        hostname))
+                    status = 1
+                elif nodes[hostname]["status"] != "down":
+                    sys.stderr.write("Error response from daemon: node {} "
+                        "is not down and can't be removed\n".format(hostname))
+                    status = 1
+                else:
+                    del nodes[hostname]
+                    sys.stdout.write("{}\n".format(hostname))
+
+            if status:
+                sys.exit(status)
+        elif command == "demote":
+            for hostname in arguments:
+                nodes[hostname]["role"] = "worker"
+                sys.stdout.write("Manager {} demoted in the swarm.\n".format(
+                    hostname))
+        elif command == "update":
+            pass
+        else:
+            fail("docker node: unsupported command: {}".format(command))
+
+
+def docker_swarm(
+        arguments):
+    command = arguments.pop(0)
+    hostname = this_node()
+
+    with state() as data:
+        nodes = data["nodes"]
+
+        if command == "init":
+            if nodes:
+                fail("Error response from daemon: This node is already part "
+                    "of a swarm.")
+
+            nodes[hostname] = {"id": uuid.uuid4().hex[:25], "role": "manager",
+                "status": "ready", "manager_status": "Leader"}
+            data["tokens"] = {
+                "manager": "SWMTKN-1-manager-{}".format(uuid.uuid4().hex),
+                "worker": "SWMTKN-1-worker-{}".format(uuid.uuid4().hex),
+            }
+            data["networks"]["ingress"] = {"Driver": "overlay",
+                "Scope": "swarm"}
+            sys.stdout.write("Swarm initialized\n")
+        elif command == "join-token":
+            assert_manager(data)
+            flag(arguments, "--quiet", "-q")
+            rotate = flag(arguments, "--rotate")
+            role = arguments[0]
+
+            if rotate:
+                data["tokens"][role] = "SWMTKN-1-{}-{}".format(role,
+                    uuid.uuid4().hex)
+
+            sys.stdout.write("{}\n".format(data["tokens"][role]))
+        elif command == "join":
+            token = option_value(arguments, "--token")
+            role = [role for role in data["tokens"] if
+                data["tokens"][role] == token]
+
+            if not role:
+                fail("Error response from daemon: invalid join token")
+
+            if hostname in nodes and nodes[hostname]["status"] == "ready":
+                fail("Error response from daemon: This node is already part "
+                    "of a swarm.")
+
+            nodes[hostname] = {"id": uuid.uuid4().hex[:25], "role": role[0],
+                "status": "ready", "manager_status": "Reachable" if
+                    role[0] == "manager" else ""}
+            sys.stdout.write("This node joined a swarm as a {}.\n".format(
+                role[0]))
+        elif command == "leave":
+            force = flag(arguments, "--force", "-f")
+
+            if hostname not in nodes:
+                fail("Error response from daemon: This node is not part of "
+                    "a swarm")
+
+            if nodes[hostname]["role"] == "manager" and not force:
+                fail("Error response from daemon: You are attempting to "
+                    "leave the swarm on a node that is participating as a "
+                    "manager.")
+
+            nodes[hostname]["status"] = "down"
+
+            # The last manager leaving destroys the Swarm.
+            if not any(node["role"] == "manager" and node["status"] ==
+                    "ready" for node in nodes.values()):
+                nodes.clear()
+                data["services"].clear()
+
+            sys.stdout.write("Node left the swarm.\n")
+        else:
+            fail("docker swarm: unsupported command: {}".format(command))
+
+
+def task_records(
+        data,
+        name):
+    service = data["services"][name]
+    managers = sorted(hostname for hostname, node in data["nodes"].items() if
+        node["status"] == "ready" and all(constraint in [
+            "node.hostname=={}".format(hostname),
+            "node.role=={}".format(node["role"])] for constraint in
+                service.get("constraints", []))) or ["-"]
+    return [{
+            "ID": "{}{}".format(service["id"][:8], idx),
+            "Name": "{}.{}".format(name, idx),
+            "Image": service["image"],
+            "Node": managers[(idx - 1) % len(managers)],
+            "DesiredState": "Running",
+            "CurrentState": "Running 2 minutes ago",
+            "Error": "",
+            "Ports": "",
+        } for idx in range(1, service["replicas"] + 1)]
+
+
+def docker_service(
+        arguments):
+    command = arguments.pop(0)
+    format = option_value(arguments, "--format", option_value(arguments,
+        "-f"))
+    quiet = flag(arguments, "--quiet", "-q")
+    flag(arguments, "--detach", "-d", "--no-trunc")
+
+    with state() as data:
+        assert_manager(data)
+        services = data["services"]
+        status = 0
+
+        if command == "ls":
+            records = [{
+                    "ID": services[name]["id"],
+                    "Name": name,
+                    "Mode": "replicated",
+                    "Replicas": "{0}/{0}".format(services[name]["replicas"]),
+                    "Image": services[name]["image"],
+                    "Ports": "",
+                } for name in sorted(services)]
+
+            if quiet:
+                for record in records:
+                    sys.stdout.write("{}\n".format(record["ID"]))
+            elif format:
+                for record in records:
+                    sys.stdout.write("{}\n".format(render(format, record)))
+            else:
+                sys.stdout.write("ID\tNAME\tMODE\tREPLICAS\tIMAGE\tPORTS\n")
+                for record in records:
+                    sys.stdout.write("{ID}\t{Name}\t{Mode}\t{Replicas}\t"
+                        "{Image}\t{Ports}\n".format(**record))
+        elif command == "ps":
+            filters = option_values(arguments, "--filter")
+            names = []
+
+            for name in arguments:
+                name = ([n for n in services if services[n]["id"] == name] or
+                    [name])[0]
+
+                if name not in services:
+                    sys.stderr.write("no such service: {}\n".format(name))
+                    status = 1
+                else:
+                    names.append(name)
+
+            if not status:
+                records = [record for name in names for record in
+                    task_records(data, name) if all(filter ==
+                        "desired-state={}".format(
+                            record["DesiredState"].lower()) for filter in
+                        filters)]
+
+                if format:
+                    for record in records:
+                        sys.stdout.write("{}\n".format(render(format,
+                            record)))
+                else:
+                    sys.stdout.write("ID\tNAME\tIMAGE\tNODE\tDESIRED STATE\t"
+                        "CURRENT STATE\tERROR\tPORTS\n")
+                    for record in records:
+                        sys.stdout.write("{ID}\t{Name}\t{Image}\t{Node}\t"
+                            "{DesiredState}\t{CurrentState}\t{Error}\t"
+                            "{Ports}\n".format(**record))
+        elif command == "create":
+            name = option_value(arguments, "--name")
+            replicas = int(option_value(arguments, "--replicas", "1"))
+            constraints = option_values(arguments, "--constraint")
+            for option in ["--publish", "-p", "--env", "-e",
+                    "--network", "--mode", "--mount"]:
+                option_values(arguments, option)
+            image = arguments[0]
+            name = name or "service{}".format(len(services) + 1)
+
+            if name in services:
+                fail("Error response from daemon: rpc error: name conflicts "
+                    "with an existing object")
+
+            services[name] = {"id": uuid.uuid4().hex[:12], "image": image,
+                "replicas": replicas, "constraints": constraints}
+            sys.stdout.write("{}\n".format(services[name]["id"]))
+        elif command == "rm":
+            for name in arguments:
+                if name not in services:
+                    sys.stderr.write("Error: No such service: {}\n".format(
+                        name))
+                    status = 1
+                else:
+                    del services[name]
+                    sys.stdout.write("{}\n".format(name))
+        elif command == "scale":
+            for argument in arguments:
+                name, replicas = argument.split("=")
+
+                if name not in services:
+                    sys.stderr.write("{}: Error: No such service: {}\n".format(
+                        name, name))
+                    status = 1
+                else:
+                    services[name]["replicas"] = int(replicas)
+                    sys.stdout.write("{} scaled to {}\n".format(name,
+                        replicas))
+        elif command == "update":
+            image = option_value(arguments, "--image")
+            name = arguments[0]
+
+            if name not in services:
+                sys.stderr.write("Error: No such service: {}\n".format(name))
+                status = 1
+            else:
+                if image:
+                    services[name]["image"] = image
+                sys.stdout.write("{}\n".format(name))
+        else:
+            fail("docker service: unsupported command: {}".format(command))
+
+    sys.exit(status)
+
+
+def docker_network(
+        arguments):
+    command = arguments.pop(0)
+    format = option_value(arguments, "--format", option_value(arguments,
+        "-f"))
+
+    with state() as data:
+        networks = data["networks"]
+
+        if command == "ls":
+            records = [{
+                    "ID": name[:12],
+                    "Name": name,
+                    "Driver": networks[name]["Driver"],
+                    "Scope": networks[name]["Scope"],
+                } for name in sorted(networks)]
+
+            if format:
+                for record in records:
+                    sys.stdout.write("{}\n".format(render(format, record)))
+            else:
+                sys.stdout.write("NETWORK ID\tNAME\tDRIVER\tSCOPE\n")
+                for record in records:
+                    sys.stdout.write("{ID}\t{Name}\t{Driver}\t{Scope}\n"
+                        .format(**record))
+        elif command == "create":
+            driver = option_value(arguments, "--driver", "bridge")
+            networks[arguments[0]] = {"Driver": driver, "Scope": "swarm" if
+                driver == "overlay" else "local"}
+            sys.stdout.write("{}\n".format(uuid.uuid4().hex))
+        else:
+            fail("docker network: unsupported command: {}".format(command))
+
+
+def docker_image(
+        arguments):
+    command = arguments.pop(0)
+    format = option_value(arguments, "--format", option_value(arguments,
+        "-f"))
+    hostname = this_node()
+
+    with state() as data:
+        images = data["images"].setdefault(hostname, [])
+
+        if command == "inspect":
+            for name in arguments:
+                if name not in images:
+                    fail("Error: No such image: {}".format(name))
+
+                record = {"Id": "sha256:{}".format(
+                    hashlib.sha256(name.encode()).hexdigest())}
+                sys.stdout.write("{}\n".format(render(format, record) if
+                    format else json.dumps(record)))
+        elif command == "pull":
+            images.extend(name for name in arguments if name not in images)
+            sys.stdout.write("Status: Downloaded newer image\n")
+        else:
+            fail("docker image: unsupported command: {}".format(command))
+
+
+def docker_save(
+        arguments):
+    hostname = this_node()
+
+    with state(write=False) as data:
+        images = data["images"].get(hostname, [])
+
+        for name in arguments:
+            if name not in images:
+                fail("Error: No such image: {}".format(name))
+
+    sys.stdout.write(json.dumps(arguments))
+
+
+def docker_load(
+        arguments):
+    hostname = this_node()
+    names = json.loads(sys.stdin.read())
+
+    with state() as data:
+        images = data["images"].setdefault(hostname, [])
+        images.extend(name for name in names if name not in images)
+
+    for name in names:
+        sys.stdout.write("Loaded image: {}\n".format(name))
+
+
+def ip(
+        arguments):
+    if [argument for argument in arguments if not argument.startswith("-")][
+            :2] != ["route", "get"]:
+        fail("ip: unsupported command: {}".format(" ".join(arguments)))
+
+    with state(write=False) as data:
+        address = data["hosts"][this_node()]["ip"]
+
+    sys.stdout.write("{} via 192.168.99.1 dev eth0 src {} uid 0 \\    "
+        "cache \n".format(arguments[-1], address))
+
+
+def docker_info(
+        arguments):
+    format = option_value(arguments, "--format", option_value(arguments,
+        "-f"))
+
+    with state(write=False) as data:
+        node = data["nodes"].get(this_node())
+        record = {"Swarm": {"LocalNodeState": "active" if node is not None
+            and node["status"] == "ready" else "inactive"}}
+
+    sys.stdout.write("{}\n".format(render(format, record) if format else
+        json.dumps(record)))
+
+
+def docker(
+        arguments):
+    time.sleep(latency("FAKE_DOCKER_LATENCY"))
+    command = arguments.pop(0)
+
+    if command == "node":
+        docker_node(arguments)
+    elif command == "swarm":
+        docker_swarm(arguments)
+    elif command == "service":
+        docker_service(arguments)
+    elif command == "network":
+        docker_network(arguments)
+    elif command == "image":
+        docker_image(arguments)
+    elif command == "pull":
+        docker_image(["pull"] + arguments)
+    elif command == "save":
+        docker_save(arguments)
+    elif command == "load":
+        docker_load(arguments)
+    elif command == "info":
+        docker_info(arguments)
+    else:
+        fail("docker: unsupported command: {}".format(command))
+
+
+def main():
+    program = os.path.basename(sys.argv[0])
+    arguments = sys.argv[1:]
+    log_call(program, arguments)
+
+    if program == "docker-machine":
+        docker_machine(arguments)
+    elif program == "ssh":
+        ssh(arguments)
+    elif program == "docker":
+        docker(arguments)
+    elif program == "VBoxManage":
+        vboxmanage(arguments)
+    elif program == "ip":
+        ip(arguments)
+    else:
+        fail("{}: unsupported program".format(program))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+import os
+import statistics
+import subprocess
+import sys
+import time
+import docopt
+from run import benchmark_directory, fake_environment, quiet, swarm_fabfile
+
+
+doc_string = """\
+Measure the cold start time of the command line scripts
+
+Usage:
+    {command} [--repeat=<n>] [--budget=<ms>] [--top=<n>]
+    {command} (-h | --help)
+
+options:
+    -h --help           Show this screen
+    --repeat=<n>        Number of times to run each command [default: 5]
+    --budget=<ms>       Maximum time spent importing modules per command,
+                        in milliseconds [default: 100]
+    --top=<n>           Number of slowest top-level imports to print
+                        [default: 5]
+
+Each command is run using python -X importtime, against a small Swarm
+created in a simulated environment (see run.py). Per command, the median
+time spent importing modules and the median wall time are reported,
+together with the slowest top-level imports.
+
+This script fails if the import time of a command exceeds the budget, or
+if a command imports any of the modules docker_base used to depend on
+(Fabric, Paramiko, asyncio).
+""".format(
+    command=os.path.basename(sys.argv[0]))
+
+
+root_directory = os.path.dirname(benchmark_directory)
+script_directory = os.path.join(root_directory, "script")
+
+
+# Commands whose cold start is pinned, relative to script_directory.
+commands = [
+    ["manage_swarm.py", "virtualbox", "b", "status"],
+    ["manage_services.py", "virtualbox", "b", "status"],
+]
+
+
+# Modules that must not be imported by these commands. Nothing in
+# docker_base needs them anymore.
+forbidden_modules = ["fabric", "paramiko", "cryptography", "asyncio"]
+
+
+def parse_import_times(
+        output):
+    """
+    Return the imports listed in the output of python -X importtime
+
+    Per import, the name of the module, the time spent importing it
+    (excluding and including its own imports, in microseconds) and its
+    depth in the tree of imports are returned.
+    """
+
+    imports = []
+
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+
+        self_time, cumulative_time, name = line[len("import time:"):].split(
+            "|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        imports.append((name.strip(), int(self_time), int(cumulative_time),
+            depth))
+
+    return imports
+
+
+def measure(
+        command):
+    """
+    Run command once and return its import time and wall time, in
+    milliseconds, and the imports listed by python -X importtime
+    """
+
+    environment = dict(os.environ)
+    environment["PYTHONPATH"] = os.path.join(root_directory, "source")
+    arguments = [sys.executable, "-X", "importtime",
+        os.path.join(script_directory, command[0])] + command[1:]
+
+    start_time = time.time()
+    process = subprocess.run(arguments, env=environment,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        universal_newlines=True)
+    wall_time = (time.time() - start_time) * 1e3
+
+    if process.returncode != 0:
+        raise RuntimeError("failed to execute command:\n{}\n{}".format(
+            " ".join(command), process.stderr))
+
+    imports = parse_import_times(process.stderr)
+    import_time = sum(cumulative_time for _, _, cumulative_time, depth in
+        imports if depth == 0) / 1e3
+
+    return import_time, wall_time, imports
+
+
+def benchmark_command(
+        command,
+        nr_repeats):
+    """
+    Run command nr_repeats times, after a warm-up run which also fills
+    the bytecode cache, and return the median import and wall times and
+    the imports of the last run
+    """
+
+    measure(command)
+    results = [measure(command) for _ in range(nr_repeats)]
+
+    return {
+        "import_time": statistics.median(result[0] for result in results),
+        "wall_time": statistics.median(result[1] for result in results),
+        "imports": results[-1][2],
+    }
+
+
+def check_result(
+        result,
+        budget):
+    """
+    Return the reasons the result of a command is not acceptable
+    """
+
+    problems = []
+
+    if result["import_time"] > budget:
+        problems.append("import time {:.1f} ms exceeds budget of {} ms".format(
+            result["import_time"], budget))
+
+    names = set(name for name, _, _, _ in result["imports"])
+
+    for module in forbidden_modules:
+        if module in names:
+            problems.append("imports {}".format(module))
+
+    return problems
+
+
+def print_result(
+        command,
+        result,
+        nr_top):
+    top_level = sorted([(cumulative_time, name) for name, _, cumulative_time,
+        depth in result["imports"] if depth == 0], reverse=True)[:nr_top]
+    lines = ["--- {} ---".format(" ".join(command)),
+        "import time: {:.1f} ms, wall time: {:.1f} ms, {} modules".format(
+            result["import_time"], result["wall_time"],
+            len(result["imports"]))]
+    lines += ["    {:>8.1f} ms  {}".format(cumulative_time / 1e3, name) for
+        cumulative_time, name in top_level]
+
+    sys.stdout.write("{}\n\n".format("\n".join(lines)))
+
+
+if __name__ == "__main__":
+    arguments = docopt.docopt(doc_string)
+    nr_repeats = int(arguments["--repeat"])
+    budget = float(arguments["--budget"])
+    nr_top = int(arguments["--top"])
+    status = 0
+
+    with fake_environment():
+        with quiet():
+            swarm_fabfile.create("virtualbox", "b", 1, 1)
+
+            with swarm_fabfile.Swarm("virtualbox", "b") as swarm:
+                swarm.run_on_manager("docker service create --detach --name "
+                    "service1 nginx", capture=True)
+
+        for command in commands:
+            result = benchmark_command(command, nr_repeats)
+            print_result(command, result, nr_top)
+
+            for problem in check_result(result, budget):
+                sys.stderr.write("{}: {}\n".format(" ".join(command),
+                    problem))
+                status = 1
+
+    sys.exit(status)
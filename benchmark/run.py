@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+import contextlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import docopt
+
+
+benchmark_directory = os.path.dirname(os.path.abspath(__file__))
+fake_directory = os.path.join(benchmark_directory, "fake")
+sys.path.insert(0, os.path.join(os.path.dirname(benchmark_directory),
+    "source"))
+
+from docker_base import profiling, swarm_fabfile
+
+
+doc_string = """\
+Measure the orchestration overhead of docker_base.swarm_fabfile
+
+Usage:
+    {command} [--sizes=<sizes>] [--parallel=<n>] [--services=<n>]
+        [--json=<path>]
+    {command} (-h | --help)
+
+options:
+    -h --help           Show this screen
+    --sizes=<sizes>     Comma-separated list of numbers of nodes to create
+                        Swarms of [default: 1,10,100,500]
+    --parallel=<n>      Maximum number of nodes to operate on concurrently
+                        [default: 32]
+    --services=<n>      Number of services to create before querying the
+                        status of services [default: 10]
+    --json=<path>       Also write the results to path, as JSON
+
+A simulated docker-machine, docker and ssh are put in front of $PATH (see
+fake/fake_docker.py). No VMs are created. The latencies of the simulated
+commands can be configured using the FAKE_DOCKER_*_LATENCY environment
+variables. Per operation, the wall time, the number of subprocesses started
+by Swarm and the number of SSH sessions are reported.
+""".format(
+    command=os.path.basename(sys.argv[0]))
+
+
+# Operations to benchmark, in the order they are performed on a Swarm.
+operations = [
+    "create",
+    "status_of_services",
+    "execute_command",
+    "stop",
+    "start",
+]
+
+
+@contextlib.contextmanager
+def fake_environment():
+    """
+    Point the environment to a fresh fake state store
+
+    The home directory is redirected as well. The stores of Swarms and
+    the socket of the daemon are located in it.
+    """
+
+    state_directory = tempfile.mkdtemp(prefix="docker_base-benchmark-")
+    saved_environment = dict(os.environ)
+    os.environ["FAKE_DOCKER_STATE"] = state_directory
+    os.environ["HOME"] = state_directory
+    os.environ["MACHINE_STORAGE_PATH"] = os.path.join(state_directory,
+        "machine")
+    os.environ["PATH"] = "{}:{}".format(fake_directory, os.environ["PATH"])
+
+    try:
+        yield state_directory
+    finally:
+        os.environ.clear()
+        os.environ.update(saved_environment)
+        shutil.rmtree(state_directory, ignore_errors=True)
+
+
+@contextlib.contextmanager
+def quiet():
+    """
+    Discard output written to standard output, including the output of
+    subprocesses
+    """
+
+    sys.stdout.flush()
+    saved_stdout = os.dup(1)
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+
+    try:
+        yield
+    finally:
+        sys.stdout.flush()
+        os.dup2(saved_stdout, 1)
+        os.close(saved_stdout)
+        os.close(devnull)
+
+
+def calls(
+        state_directory):
+    """
+    Return the invocations of simulated commands logged until now
+    """
+
+    pathname = os.path.join(state_directory, "calls.log")
+
+    if not os.path.exists(pathname):
+        return []
+
+    with open(pathname) as file:
+        return [json.loads(line) for line in file]
+
+
+def is_ssh_session(
+        call):
+    return (call[0] == "ssh" and "-O" not in call) or \
+        call[:2] == ["docker-machine", "ssh"]
+
+
+def measure(
+        state_directory,
+        function,
+        *arguments):
+    """
+    Call function and return its wall time, the number of subprocesses
+    it started and the number of SSH sessions these opened
+    """
+
+    nr_calls = len(calls(state_directory))
+    profiler = profiling.start()
+    start_time = time.time()
+
+    try:
+        with quiet():
+            function(*arguments)
+    finally:
+        wall_time = time.time() - start_time
+        profiling.stop()
+
+    new_calls = calls(state_directory)[nr_calls:]
+
+    return {
+        "wall_time": wall_time,
+        "nr_commands": len(profiler.commands),
+        "nr_ssh_sessions": len([call for call in new_calls if
+            is_ssh_session(call)]),
+    }
+
+
+def benchmark_swarm(
+        nr_nodes,
+        nr_parallel,
+        nr_services):
+    """
+    Create a Swarm of nr_nodes nodes and perform the benchmarked
+    operations on it
+    """
+
+    driver = "virtualbox"
+    host_prefix = "b"
+    nr_managers = min(3, nr_nodes)
+    nr_workers = nr_nodes - nr_managers
+    results = {}
+
+    with fake_environment() as state_directory:
+        results["create"] = measure(state_directory, swarm_fabfile.create,
+            driver, host_prefix, nr_managers, nr_workers, nr_parallel)
+
+        with quiet(), swarm_fabfile.Swarm(driver, host_prefix) as swarm:
+            for idx in range(1, nr_services + 1):
+                swarm.run_on_manager(
+                    "docker service create --detach --name service{} "
+                    "--replicas 2 nginx".format(idx), capture=True)
+
+        results["status_of_services"] = measure(state_directory,
+            swarm_fabfile.status_of_services, driver, host_prefix, [])
+        results["execute_command"] = measure(state_directory,
+            swarm_fabfile.execute_command, driver, host_prefix, "true", [],
+            nr_parallel)
+        results["stop"] = measure(state_directory, swarm_fabfile.stop_nodes,
+            driver, host_prefix, [], nr_parallel)
+        results["start"] = measure(state_directory,
+            swarm_fabfile.start_nodes, driver, host_prefix, [], nr_parallel)
+
+    return results
+
+
+def print_results(
+        results):
+    lines = ["{:>6}  {:<20}  {:>10}  {:>8}  {:>6}".format(
+        "NODES", "OPERATION", "WALL (s)", "COMMANDS", "SSH")]
+
+    for nr_nodes, results_ in results:
+        for operation in operations:
+            result = results_[operation]
+            lines.append("{:>6}  {:<20}  {:>10.3f}  {:>8}  {:>6}".format(
+                nr_nodes, operation, result["wall_time"],
+                result["nr_commands"], result["nr_ssh_sessions"]))
+
+    sys.stdout.write("{}\n".format("\n".join(lines)))
+
+
+if __name__ == "__main__":
+    arguments = docopt.docopt(doc_string)
+    sizes = [int(size) for size in arguments["--sizes"].split(",")]
+    nr_parallel = int(arguments["--parallel"])
+    nr_services = int(arguments["--services"])
+    results = []
+
+    for nr_nodes in sizes:
+        sys.stderr.write("benchmarking Swarm of {} nodes...\n".format(
+            nr_nodes))
+        results.append((nr_nodes, benchmark_swarm(nr_nodes, nr_parallel,
+            nr_services)))
+
+    print_results(results)
+
+    if arguments["--json"]:
+        with open(arguments["--json"], "w") as file:
+            json.dump([{"nr_nodes": nr_nodes, "results": results_} for
+                nr_nodes, results_ in results], file, indent=4)
@@ -9,13 +9,21 @@ doc_string = """\
 Execute command on Docker Swarm nodes
 
 usage:
-    {command} <driver> <host_prefix> <nodes> <command> [<arguments>...]
+    {command} [--parallel=<n>] [--profile=<path>] <driver> <host_prefix>
+        <nodes> <command> [<arguments>...]
     {command} (-h | --help)
 
 options:
-    -h --help   Show this screen
-    --version   Show version
-    nodes       Comma-separated list of nodes
+    -h --help           Show this screen
+    --version           Show version
+    --parallel=<n>      Maximum number of nodes to execute the command on
+                        concurrently [default: 1]
+    --profile=<path>    Print a summary of the time spent per operation and
+                        write a Chrome trace of all commands to path
+    nodes               Comma-separated list of nodes
+    host_prefix         Comma-separated list of host prefixes, to execute
+                        the command on the nodes of multiple Swarms at the
+                        same time
 """.format(
         command = os.path.basename(sys.argv[0]))
 
@@ -25,21 +33,36 @@ def execute_on_nodes(
         host_prefix,
         nodes,
         command,
-        arguments):
+        arguments,
+        nr_parallel):
 
     docker_base.swarm.execute_on_nodes(driver, host_prefix,
-        nodes, command, arguments)
+        nodes, command, arguments, nr_parallel)
 
 
 if __name__ == "__main__":
     arguments = docopt.docopt(doc_string, version="0.0.0", options_first=True)
+    profile_pathname = arguments["--profile"]
+
+    if profile_pathname:
+        # Imported here. Commands that are not profiled don't pay for
+        # importing it.
+        import docker_base.profiling
+
+        docker_base.profiling.start()
+
     nodes = arguments["<nodes>"].split(",")
     command = arguments["<command>"]
     arguments_ = arguments["<arguments>"]
+    nr_parallel = arguments["--parallel"]
+    assert int(nr_parallel) >= 1, nr_parallel
 
     status = docker_base.call_subcommand(execute_on_nodes,
         arguments["<driver>"],
         arguments["<host_prefix>"],
-        nodes, command, arguments_)
+        nodes, command, arguments_, nr_parallel)
+
+    if profile_pathname:
+        docker_base.profiling.write_report(profile_pathname)
 
     sys.exit(status)
@@ -9,16 +9,21 @@ doc_string = """\
 Manage Docker services
 
 usage:
-    {command} <driver> <host_prefix> <command> [<arguments>...]
+    {command} [--profile=<path>] <driver> <host_prefix> <command>
+        [<arguments>...]
     {command} (-h | --help)
 
 options:
-    -h --help   Show this screen
-    --version   Show version
+    -h --help           Show this screen
+    --version           Show version
+    --profile=<path>    Print a summary of the time spent per operation and
+                        write a Chrome trace of all commands to path
 
 Commands:
     remove      Remove one or more created services
+    scale       Scale one or more created services
     status      Print information about services that have been created
+    update      Update the image of one or more created services
 
 See '{command} help <command>' for more information on a specific
 command.
@@ -30,12 +35,16 @@ remove_service_doc_string = """\
 Remove one or more created Docker services
 
 usage:
-    remove <services>...
+    remove [--regex] <services>...
     remove (-h | --help)
 
 options:
     -h --help       Show this screen
-    <services>...   Names of services to remove
+    --regex         Services are selected by regular expressions instead
+                    of by glob patterns
+    <services>...   Names of, or patterns selecting, services to remove
+
+All services are removed using a single call to a manager
 """
 
 
@@ -44,21 +53,88 @@ def remove_services(
         global_arguments):
     arguments = docopt.docopt(remove_service_doc_string, argv=command_arguments)
     services = arguments["<services>"]
+    regex = arguments["--regex"]
     results = docker_base.swarm.remove_services(
         global_arguments["<driver>"],
         global_arguments["<host_prefix>"],
-        services)
+        services, regex)
+
+
+scale_service_doc_string = """\
+Scale one or more created Docker services
+
+usage:
+    scale [--regex] <nr_replicas> <services>...
+    scale (-h | --help)
+
+options:
+    -h --help       Show this screen
+    --regex         Services are selected by regular expressions instead
+                    of by glob patterns
+    <nr_replicas>   Number of replicas per service
+    <services>...   Names of, or patterns selecting, services to scale
+
+All services are scaled using a single call to a manager
+"""
+
+
+def scale_services(
+        command_arguments,
+        global_arguments):
+    arguments = docopt.docopt(scale_service_doc_string, argv=command_arguments)
+    services = arguments["<services>"]
+    nr_replicas = arguments["<nr_replicas>"]
+    regex = arguments["--regex"]
+    assert int(nr_replicas) >= 0, nr_replicas
+    results = docker_base.swarm.scale_services(
+        global_arguments["<driver>"],
+        global_arguments["<host_prefix>"],
+        services, nr_replicas, regex)
+
+
+update_service_doc_string = """\
+Update the image of one or more created Docker services
+
+usage:
+    update [--regex] --image=<image> <services>...
+    update (-h | --help)
+
+options:
+    -h --help       Show this screen
+    --regex         Services are selected by regular expressions instead
+                    of by glob patterns
+    --image=<image> Image to run
+    <services>...   Names of, or patterns selecting, services to update
+
+All services are updated using a single call to a manager
+"""
+
+
+def update_services(
+        command_arguments,
+        global_arguments):
+    arguments = docopt.docopt(update_service_doc_string,
+        argv=command_arguments)
+    services = arguments["<services>"]
+    image = arguments["--image"]
+    regex = arguments["--regex"]
+    results = docker_base.swarm.update_service_images(
+        global_arguments["<driver>"],
+        global_arguments["<host_prefix>"],
+        services, image, regex)
 
 
 status_doc_string = """\
 Show status of Docker services
 
 usage:
-    status [<services>...]
+    status [--json] [<services>...]
     status (-h | --help)
 
 options:
     -h --help       Show this screen
+    --json          Print information about services and their tasks as
+                    JSON
     <services>...   Names of services to inspect
 
 If no services are passed, all services are inspected
@@ -70,14 +146,24 @@ def status_of_services(
         global_arguments):
     arguments = docopt.docopt(status_doc_string, argv=command_arguments)
     services = arguments["<services>"]
+    as_json = arguments["--json"]
     results = docker_base.swarm.status_of_services(
         global_arguments["<driver>"],
         global_arguments["<host_prefix>"],
-        services)
+        services, as_json)
 
 
 if __name__ == "__main__":
     arguments = docopt.docopt(doc_string, version="0.0.0", options_first=True)
+    profile_pathname = arguments.pop("--profile")
+
+    if profile_pathname:
+        # Imported here. Commands that are not profiled don't pay for
+        # importing it.
+        import docker_base.profiling
+
+        docker_base.profiling.start()
+
     command = arguments.pop("<command>")
     command_arguments = arguments.pop("<arguments>")
     if command_arguments is None:
@@ -86,6 +172,13 @@ if __name__ == "__main__":
     functions = {
         "status": status_of_services,
         "remove": remove_services,
+        "scale": scale_services,
+        "update": update_services,
     }
     status = docker_base.call_subcommand(functions[command],
         command_arguments, global_arguments)
+
+    if profile_pathname:
+        docker_base.profiling.write_report(profile_pathname)
+
+    sys.exit(status)
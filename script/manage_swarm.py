@@ -9,12 +9,15 @@ doc_string = """\
 Manage a Docker Swarm
 
 usage:
-    {command} <driver> <host_prefix> <command> [<arguments>...]
+    {command} [--profile=<path>] <driver> <host_prefix> <command>
+        [<arguments>...]
     {command} (-h | --help)
 
 options:
-    -h --help   Show this screen
-    --version   Show version
+    -h --help           Show this screen
+    --version           Show version
+    --profile=<path>    Print a summary of the time spent per operation and
+                        write a Chrome trace of all commands to path
 
 Commands:
     create      Create new Swarm and start it
@@ -27,10 +30,20 @@ Commands:
     remove      Remove Swarm nodes that are running or have been stopped
     network     Manage Swarm networks
     execute     Execture a command on nodes
+    apply       Converge the Swarm to a number of managers and workers
+    pool        Manage the pool of spare hosts
+    images      Manage images on Swarm nodes
+    inventory   Manage the record of the hosts in the Swarm
+    serve       Perform operations of other commands, keeping Swarms warm
 
 See '{command} help <command>' for more information on a specific
 command.
 
+The status and execute commands accept a comma-separated list of host
+prefixes, to operate on multiple Swarms at the same time. The hosts of
+all Swarms are listed once, and the output is grouped per Swarm:
+    $ {command} virtualbox t,a,p status
+
 Once a Swarm is started, use the folowing command to direct your Docker
 client to it (replace manager by the hostname of a Swarm manager):
     $ eval $(docker-machine env <manager>)
@@ -42,16 +55,36 @@ create_doc_string = """\
 Create a Docker Swarm
 
 usage:
-    create <nr_managers> <nr_workers>
+    create [--parallel=<n>] [--template] [--registry-mirror]
+        [--upstream=<url>] <nr_managers> <nr_workers>
     create (-h | --help)
 
 options:
-    -h --help       Show this screen
+    -h --help           Show this screen
+    --parallel=<n>      Maximum number of hosts to create concurrently
+                        [default: 1]
+    --template          Create hosts as linked clones of a template host
+                        (virtualbox only)
+    --registry-mirror   Run a pull-through registry cache on the first
+                        manager and configure all other hosts to use it
+    --upstream=<url>    URL of the registry to mirror
+                        [default: https://registry-1.docker.io]
 
 arguments:
     nr_managers     Number of managers in the Swarm
     nr_workers      Number of workers in the Swarm
 
+With --registry-mirror, each image is downloaded from the upstream
+registry once, instead of once per node. To try this out without using
+the Docker Hub, run a registry locally and pass its URL as upstream:
+
+$ docker run -d -p 5001:5000 registry:2
+
+With --template, a template host named <host_prefix>-template is created
+and stopped the first time. All other hosts are created as VirtualBox
+linked clones of it, which takes seconds instead of minutes. Don't remove
+the template host as long as clones of it exist.
+
 If creation of the Swarm fails (This machine has been allocated an IP
 address, but Docker Machine could not reach it successfully), this
 command may help:
@@ -66,23 +99,30 @@ def create_swarm(
     arguments = docopt.docopt(create_doc_string, argv=command_arguments)
     nr_managers = arguments["<nr_managers>"]
     nr_workers = arguments["<nr_workers>"]
+    nr_parallel = arguments["--parallel"]
+    use_template = arguments["--template"]
+    registry_mirror = arguments["--upstream"] if \
+        arguments["--registry-mirror"] else None
     assert int(nr_managers) >= 1, nr_managers
     assert int(nr_workers) >= 0, nr_workers
+    assert int(nr_parallel) >= 1, nr_parallel
     results = docker_base.swarm.create(
         global_arguments["<driver>"],
         global_arguments["<host_prefix>"],
-        nr_managers, nr_workers)
+        nr_managers, nr_workers, nr_parallel, use_template, registry_mirror)
 
 
 start_nodes_doc_string = """\
 Start one or more Docker Swarm nodes
 
 usage:
-    start [<nodes>...]
+    start [--parallel=<n>] [<nodes>...]
     start (-h | --help)
 
 options:
     -h --help       Show this screen
+    --parallel=<n>  Maximum number of nodes to start concurrently
+                    [default: 1]
     <nodes>...      Names of nodes to start
 
 If no nodes are passed, the whole Swarm is started
@@ -94,21 +134,24 @@ def start_nodes(
         global_arguments):
     arguments = docopt.docopt(start_nodes_doc_string, argv=command_arguments)
     nodes = arguments["<nodes>"]
+    nr_parallel = arguments["--parallel"]
+    assert int(nr_parallel) >= 1, nr_parallel
     results = docker_base.swarm.start_nodes(
         global_arguments["<driver>"],
         global_arguments["<host_prefix>"],
-        nodes)
+        nodes, nr_parallel)
 
 
 status_doc_string = """\
 Show status of a Docker Swarm
 
 usage:
-    status
+    status [--json]
     status (-h | --help)
 
 options:
     -h --help       Show this screen
+    --json          Print information about nodes and networks as JSON
 """
 
 
@@ -116,20 +159,24 @@ def status_of_swarm(
         command_arguments,
         global_arguments):
     arguments = docopt.docopt(status_doc_string, argv=command_arguments)
+    as_json = arguments["--json"]
     results = docker_base.swarm.status_of_swarm(
         global_arguments["<driver>"],
-        global_arguments["<host_prefix>"])
+        global_arguments["<host_prefix>"],
+        as_json)
 
 
 stop_nodes_doc_string = """\
 Stop one or more Docker Swarm nodes
 
 usage:
-    stop [<nodes>...]
+    stop [--parallel=<n>] [<nodes>...]
     stop (-h | --help)
 
 options:
     -h --help       Show this screen
+    --parallel=<n>  Maximum number of nodes to stop concurrently
+                    [default: 1]
     <nodes>...      Names of nodes to stop
 
 If no nodes are passed, the whole Swarm is stopped
@@ -141,10 +188,12 @@ def stop_nodes(
         global_arguments):
     arguments = docopt.docopt(stop_nodes_doc_string, argv=command_arguments)
     nodes = arguments["<nodes>"]
+    nr_parallel = arguments["--parallel"]
+    assert int(nr_parallel) >= 1, nr_parallel
     results = docker_base.swarm.stop_nodes(
         global_arguments["<driver>"],
         global_arguments["<host_prefix>"],
-        nodes)
+        nodes, nr_parallel)
 
 
 pause_nodes_doc_string = """\
@@ -177,11 +226,13 @@ resume_nodes_doc_string = """\
 Resume one or more paused Docker Swarm nodes
 
 usage:
-    resume [<nodes>...]
+    resume [--parallel=<n>] [<nodes>...]
     resume (-h | --help)
 
 options:
     -h --help       Show this screen
+    --parallel=<n>  Maximum number of nodes to resume concurrently
+                    [default: 1]
     <nodes>...      Names of nodes to resume
 
 If no nodes are passed, the whole Swarm is resumed
@@ -193,23 +244,42 @@ def resume_nodes(
         global_arguments):
     arguments = docopt.docopt(resume_nodes_doc_string, argv=command_arguments)
     nodes = arguments["<nodes>"]
+    nr_parallel = arguments["--parallel"]
+    assert int(nr_parallel) >= 1, nr_parallel
     results = docker_base.swarm.resume_nodes(
         global_arguments["<driver>"],
         global_arguments["<host_prefix>"],
-        nodes)
+        nodes, nr_parallel)
 
 
 add_nodes_doc_string = """\
 Add one or more Docker Swarm nodes
 
 usage:
-    add (--manager | --worker) <nr_nodes>
+    add [--parallel=<n>] [--template] [--prefetch=<image>...]
+        [--registry-mirror] [--upstream=<url>] (--manager | --worker)
+        <nr_nodes>
     add (-h | --help)
 
 options:
-    -h --help       Show this screen
-    --manager       Add manager nodes
-    --worker        Add worker nodes
+    -h --help           Show this screen
+    --manager           Add manager nodes
+    --worker            Add worker nodes
+    --parallel=<n>      Maximum number of hosts to create concurrently
+                        [default: 1]
+    --template          Create hosts as linked clones of a template host
+                        (virtualbox only)
+    --prefetch=<image>  Copy image to the new nodes once all of them have
+                        joined the Swarm (see 'images prefetch'). Can be
+                        repeated.
+    --registry-mirror   Configure the new hosts to use the registry mirror
+                        in the Swarm (see 'create'), deploying it if needed
+    --upstream=<url>    URL of the registry to mirror
+                        [default: https://registry-1.docker.io]
+
+Workers are taken from the pool of spare hosts first, if any (see
+'pool'). Only the remaining workers are created. Afterwards, the pool is
+refilled in the background.
 """
 
 
@@ -220,28 +290,36 @@ def add_nodes(
     manager_node = arguments["--manager"]
     worker_node = arguments["--worker"]
     nr_nodes = arguments["<nr_nodes>"]
+    nr_parallel = arguments["--parallel"]
+    use_template = arguments["--template"]
+    images = arguments["--prefetch"]
+    registry_mirror = arguments["--upstream"] if \
+        arguments["--registry-mirror"] else None
+    assert int(nr_parallel) >= 1, nr_parallel
 
     if manager_node:
         results = docker_base.swarm.add_manager_nodes(
             global_arguments["<driver>"],
             global_arguments["<host_prefix>"],
-            nr_nodes)
+            nr_nodes, nr_parallel, use_template, images, registry_mirror)
     elif worker_node:
         results = docker_base.swarm.add_worker_nodes(
             global_arguments["<driver>"],
             global_arguments["<host_prefix>"],
-            nr_nodes)
+            nr_nodes, nr_parallel, use_template, images, registry_mirror)
 
 
 remove_nodes_doc_string = """\
 Remove one or more Docker Swarm nodes
 
 usage:
-    remove [<nodes>...]
+    remove [--parallel=<n>] [<nodes>...]
     remove (-h | --help)
 
 options:
     -h --help       Show this screen
+    --parallel=<n>  Maximum number of nodes to remove concurrently
+                    [default: 1]
     <nodes>...      Names of nodes to remove
 
 If no nodes are passed, the whole Swarm is removed
@@ -254,10 +332,12 @@ def remove_nodes(
     arguments = docopt.docopt(remove_nodes_doc_string,
         argv=command_arguments)
     nodes = arguments["<nodes>"]
+    nr_parallel = arguments["--parallel"]
+    assert int(nr_parallel) >= 1, nr_parallel
     results = docker_base.swarm.remove_nodes(
         global_arguments["<driver>"],
         global_arguments["<host_prefix>"],
-        nodes)
+        nodes, nr_parallel)
 
 
 create_network_doc_string = """\
@@ -323,15 +403,28 @@ execute_command_doc_string = """\
 Execute command on one or more Docker Swarm nodes
 
 usage:
-    execute <command> [<nodes>...]
+    execute [--parallel=<n>] [--spool=<dir>] <command> [<nodes>...]
     execute (-h | --help)
 
 options:
     -h --help       Show this screen
+    --parallel=<n>  Maximum number of nodes to execute the command on
+                    concurrently [default: 1]
+    --spool=<dir>   Write the output of each node to <dir>/<node>.log
     <command>       Command to execute
     <nodes>...      Names of nodes to execute command on
 
 If no nodes are passed, the command is executed on all nodes
+
+If the command is executed on more than one node concurrently, each line
+of output is prefixed by the name of the node and a summary of exit codes
+is printed at the end. This command fails if the command failed on any
+node.
+
+With --spool, output is not printed, except for the last part of the
+output of nodes on which the command failed, and a summary of exit codes
+is printed at the end. Use this for commands with a lot of output, like
+docker logs.
 """
 
 
@@ -342,14 +435,390 @@ def execute_command(
         argv=command_arguments)
     command = arguments["<command>"]
     nodes = arguments["<nodes>"]
+    nr_parallel = arguments["--parallel"]
+    spool_directory = arguments["--spool"]
+    assert int(nr_parallel) >= 1, nr_parallel
     results = docker_base.swarm.execute_command(
         global_arguments["<driver>"],
         global_arguments["<host_prefix>"],
-        command, nodes)
+        command, nodes, nr_parallel, spool_directory)
+
+
+apply_doc_string = """\
+Converge a Docker Swarm to a number of running managers and workers
+
+usage:
+    apply [--parallel=<n>] [--remove] [--dry-run] <nr_managers> <nr_workers>
+    apply (-h | --help)
+
+options:
+    -h --help       Show this screen
+    --parallel=<n>  Maximum number of nodes to operate on concurrently
+                    [default: 1]
+    --remove        Remove surplus nodes, instead of only stopping them
+    --dry-run       Only print the plan
+
+arguments:
+    nr_managers     Number of running managers in the Swarm
+    nr_workers      Number of running workers in the Swarm
+
+Paused and stopped nodes are resumed and started, and workers are taken
+from the pool of spare hosts, before new nodes are created. Surplus nodes
+with the highest indices are stopped. If no Swarm exists, it is created.
+Applying the same numbers again does nothing.
+"""
+
+
+def apply(
+        command_arguments,
+        global_arguments):
+    arguments = docopt.docopt(apply_doc_string, argv=command_arguments)
+    nr_managers = arguments["<nr_managers>"]
+    nr_workers = arguments["<nr_workers>"]
+    remove = arguments["--remove"]
+    dry_run = arguments["--dry-run"]
+    nr_parallel = arguments["--parallel"]
+    assert int(nr_managers) >= 1, nr_managers
+    assert int(nr_workers) >= 0, nr_workers
+    assert int(nr_parallel) >= 1, nr_parallel
+    results = docker_base.swarm.reconcile(
+        global_arguments["<driver>"],
+        global_arguments["<host_prefix>"],
+        nr_managers, nr_workers, remove, dry_run, nr_parallel)
+
+
+fill_pool_doc_string = """\
+Create spare hosts until the pool contains a number of hosts
+
+usage:
+    fill [--parallel=<n>] [--template] [--registry-mirror]
+        [--upstream=<url>] <nr_spares>
+    fill (-h | --help)
+
+options:
+    -h --help           Show this screen
+    --parallel=<n>      Maximum number of hosts to create concurrently
+                        [default: 1]
+    --template          Create hosts as linked clones of a template host
+                        (virtualbox only)
+    --registry-mirror   Configure the spare hosts to use the registry
+                        mirror in the Swarm (see 'create'), deploying it if
+                        needed
+    --upstream=<url>    URL of the registry to mirror
+                        [default: https://registry-1.docker.io]
+
+arguments:
+    nr_spares           Number of spare hosts in the pool
+
+Refilling the pool in the background after adding workers uses the same
+registry mirror as the new workers.
+"""
+
+
+def fill_pool(
+        command_arguments,
+        global_arguments):
+    arguments = docopt.docopt(fill_pool_doc_string, argv=command_arguments)
+    nr_spares = arguments["<nr_spares>"]
+    nr_parallel = arguments["--parallel"]
+    use_template = arguments["--template"]
+    registry_mirror = arguments["--upstream"] if \
+        arguments["--registry-mirror"] else None
+    assert int(nr_spares) >= 0, nr_spares
+    assert int(nr_parallel) >= 1, nr_parallel
+    results = docker_base.swarm.fill_pool(
+        global_arguments["<driver>"],
+        global_arguments["<host_prefix>"],
+        nr_spares, nr_parallel, use_template, registry_mirror)
+
+
+status_of_pool_doc_string = """\
+Show the hosts in the pool of spare hosts
+
+usage:
+    status
+    status (-h | --help)
+
+options:
+    -h --help       Show this screen
+"""
+
+
+def status_of_pool(
+        command_arguments,
+        global_arguments):
+    arguments = docopt.docopt(status_of_pool_doc_string,
+        argv=command_arguments)
+    results = docker_base.swarm.status_of_pool(
+        global_arguments["<driver>"],
+        global_arguments["<host_prefix>"])
+
+
+drain_pool_doc_string = """\
+Remove all hosts from the pool of spare hosts
+
+usage:
+    drain [--parallel=<n>]
+    drain (-h | --help)
+
+options:
+    -h --help       Show this screen
+    --parallel=<n>  Maximum number of hosts to remove concurrently
+                    [default: 1]
+"""
+
+
+def drain_pool(
+        command_arguments,
+        global_arguments):
+    arguments = docopt.docopt(drain_pool_doc_string, argv=command_arguments)
+    nr_parallel = arguments["--parallel"]
+    assert int(nr_parallel) >= 1, nr_parallel
+    results = docker_base.swarm.drain_pool(
+        global_arguments["<driver>"],
+        global_arguments["<host_prefix>"],
+        nr_parallel)
+
+
+manage_pool_doc_string = """\
+Manage the pool of spare hosts
+
+usage:
+    pool <command> [<arguments>...]
+    pool (-h | --help)
+
+options:
+    -h --help       Show this screen
+
+Commands:
+    fill        Create spare hosts
+    status      Show spare hosts
+    drain       Remove all spare hosts
+
+Spare hosts are provisioned and stopped hosts, named
+<host_prefix>-spare<idx>, that are not part of the Swarm. Adding workers
+takes hosts from the pool first. A spare host keeps its name once it is a
+worker.
+"""
+
+
+def manage_pool(
+        command_arguments,
+        global_arguments):
+    arguments = docopt.docopt(manage_pool_doc_string,
+        argv=command_arguments, options_first=True)
+    command = arguments.pop("<command>")
+    command_arguments = arguments.pop("<arguments>")
+    if command_arguments is None:
+        command_arguments = {}
+
+    # Otherwise merge with global_arguments.
+    assert "--help" in arguments and len(arguments) == 1, arguments
+
+    functions = {
+        "fill": fill_pool,
+        "status": status_of_pool,
+        "drain": drain_pool,
+    }
+
+    # Errors are reported by the caller, which sets the exit status.
+    functions[command](command_arguments, global_arguments)
+
+
+prefetch_images_doc_string = """\
+Make sure images are present on Docker Swarm nodes
+
+usage:
+    prefetch [--parallel=<n>] [--node=<node>...] <images>...
+    prefetch (-h | --help)
+
+options:
+    -h --help       Show this screen
+    --parallel=<n>  Maximum number of nodes to copy images to concurrently
+                    [default: 1]
+    --node=<node>   Name of node to copy images to. Can be repeated.
+    <images>...     Names of images
+
+If no nodes are passed, images are copied to all running nodes.
+
+Each image is pulled on a manager, to find out which image its name
+currently refers to, and stored in a local cache (~/.docker_base/images),
+by image ID. It is then copied to the nodes that lack it, or have an older
+image by the same name, using docker save | docker load, from the local
+cache and from the nodes that already have it. The number of nodes having
+the image doubles in each round. Images that cannot be pulled are taken
+from a node that has them.
+"""
+
+
+def prefetch_images(
+        command_arguments,
+        global_arguments):
+    arguments = docopt.docopt(prefetch_images_doc_string,
+        argv=command_arguments)
+    images = arguments["<images>"]
+    nodes = arguments["--node"]
+    nr_parallel = arguments["--parallel"]
+    assert int(nr_parallel) >= 1, nr_parallel
+    results = docker_base.swarm.prefetch_images(
+        global_arguments["<driver>"],
+        global_arguments["<host_prefix>"],
+        images, nodes, nr_parallel)
+
+
+manage_images_doc_string = """\
+Manage images on the Docker Swarm nodes
+
+usage:
+    images <command> [<arguments>...]
+    images (-h | --help)
+
+options:
+    -h --help       Show this screen
+
+Commands:
+    prefetch    Copy images to nodes
+"""
+
+
+def manage_images(
+        command_arguments,
+        global_arguments):
+    arguments = docopt.docopt(manage_images_doc_string,
+        argv=command_arguments, options_first=True)
+    command = arguments.pop("<command>")
+    command_arguments = arguments.pop("<arguments>")
+    if command_arguments is None:
+        command_arguments = {}
+
+    # Otherwise merge with global_arguments.
+    assert "--help" in arguments and len(arguments) == 1, arguments
+
+    functions = {
+        "prefetch": prefetch_images,
+    }
+
+    # Errors are reported by the caller, which sets the exit status.
+    functions[command](command_arguments, global_arguments)
+
+
+refresh_inventory_doc_string = """\
+Record the current state of the hosts in the Swarm
+
+usage:
+    refresh [--parallel=<n>]
+    refresh (-h | --help)
+
+options:
+    -h --help       Show this screen
+    --parallel=<n>  Maximum number of hosts to look up the address of
+                    concurrently [default: 1]
+"""
+
+
+def refresh_inventory(
+        command_arguments,
+        global_arguments):
+    arguments = docopt.docopt(refresh_inventory_doc_string,
+        argv=command_arguments)
+    nr_parallel = arguments["--parallel"]
+    assert int(nr_parallel) >= 1, nr_parallel
+    results = docker_base.swarm.refresh_inventory(
+        global_arguments["<driver>"],
+        global_arguments["<host_prefix>"],
+        nr_parallel)
+
+
+manage_inventory_doc_string = """\
+Manage the record of the hosts in a Docker Swarm
+
+usage:
+    inventory <command> [<arguments>...]
+    inventory (-h | --help)
+
+options:
+    -h --help       Show this screen
+
+Commands:
+    refresh     Forget everything recorded and record the current state
+
+What is known about the hosts in a Swarm is recorded in
+~/.docker_base/<host_prefix>.db, and shared by all commands: the hosts,
+their roles and states, the LAN IP addresses of running hosts and the
+join tokens. Commands look information up there first. The hosts and
+their states are recorded for a minute, addresses and join tokens for
+an hour. Changes made by these commands are recorded immediately.
+Refresh the record after changing hosts by other means, like using
+docker-machine directly.
+"""
+
+
+def manage_inventory(
+        command_arguments,
+        global_arguments):
+    arguments = docopt.docopt(manage_inventory_doc_string,
+        argv=command_arguments, options_first=True)
+    command = arguments.pop("<command>")
+    command_arguments = arguments.pop("<arguments>")
+    if command_arguments is None:
+        command_arguments = {}
+
+    # Otherwise merge with global_arguments.
+    assert "--help" in arguments and len(arguments) == 1, arguments
+
+    functions = {
+        "refresh": refresh_inventory,
+    }
+
+    # Errors are reported by the caller, which sets the exit status.
+    functions[command](command_arguments, global_arguments)
+
+
+serve_doc_string = """\
+Perform operations on behalf of other commands, keeping Swarms warm
+
+usage:
+    serve
+    serve (-h | --help)
+
+options:
+    -h --help       Show this screen
+
+The daemon listens on the Unix domain socket ~/.docker_base/daemon.sock,
+until interrupted. While it runs, these commands have the daemon perform
+their operation: the status, execute, start and stop commands of this
+script, the status and remove commands of manage_services.py and
+execute_on_nodes.py. Only commands for a single Swarm are passed on.
+
+Per Swarm, the daemon keeps its SSH connections open and its join
+credentials cached. The Swarms with the host prefixes passed in
+(comma-separated) are warmed up before the daemon starts listening.
+Other Swarms are set up when first used. The output of commands executed
+by the daemon directly, like docker-machine stop, is printed by the
+daemon.
+"""
+
+
+def serve(
+        command_arguments,
+        global_arguments):
+    arguments = docopt.docopt(serve_doc_string, argv=command_arguments)
+    results = docker_base.swarm.serve(
+        global_arguments["<driver>"],
+        global_arguments["<host_prefix>"])
 
 
 if __name__ == "__main__":
     arguments = docopt.docopt(doc_string, version="0.0.0", options_first=True)
+    profile_pathname = arguments.pop("--profile")
+
+    if profile_pathname:
+        # Imported here. Commands that are not profiled don't pay for
+        # importing it.
+        import docker_base.profiling
+
+        docker_base.profiling.start()
+
     command = arguments.pop("<command>")
     command_arguments = arguments.pop("<arguments>")
     if command_arguments is None:
@@ -365,9 +834,17 @@ if __name__ == "__main__":
         "add": add_nodes,
         "remove": remove_nodes,
         "network": manage_network,
-        "execute": execute_command
+        "execute": execute_command,
+        "apply": apply,
+        "pool": manage_pool,
+        "images": manage_images,
+        "inventory": manage_inventory,
+        "serve": serve,
     }
     status = docker_base.call_subcommand(functions[command],
         command_arguments, global_arguments)
 
+    if profile_pathname:
+        docker_base.profiling.write_report(profile_pathname)
+
     sys.exit(status)
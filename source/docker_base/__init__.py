@@ -1,5 +1,4 @@
 import sys
-import traceback
 
 
 def print_error_message(
@@ -24,6 +23,9 @@ def call_subcommand(
     except RuntimeError as exception:
         print_error_message(str(exception))
     except:
+        # Imported here, importing it takes relatively long.
+        import traceback
+
         lines = traceback.format_exc().splitlines()
         print_error_message(lines[-3])
         print_error_message(lines[-2])
@@ -0,0 +1,80 @@
+import collections
+import os
+
+
+def truncated(
+        text,
+        nr_omitted):
+    """
+    Return text, preceded by a note about the number of characters
+    omitted before it, if any
+    """
+
+    if nr_omitted > 0:
+        text = "[{} characters omitted]\n{}".format(nr_omitted, text)
+
+    return text
+
+
+def tail(
+        text,
+        size):
+    """
+    Return the last size characters of text
+    """
+
+    text_ = text[max(0, len(text) - size):] if size > 0 else ""
+
+    return truncated(text_, len(text) - len(text_))
+
+
+def read_tail(
+        file,
+        size):
+    """
+    Return the last size bytes of a file opened in binary mode, decoded
+    """
+
+    length = os.fstat(file.fileno()).st_size
+    file.seek(max(0, length - size))
+
+    return truncated(file.read().decode(errors="replace"), length - size)
+
+
+class Tail(object):
+    """
+    Last part of a stream of text written to it
+
+    At most size characters, plus the remainder of the oldest chunk
+    written, are kept in memory. Text written before that is only
+    counted.
+    """
+
+    def __init__(self,
+            size):
+        self.size = size
+
+        # Number of characters written in total.
+        self.nr_characters = 0
+
+        # Chunks kept, and their total length.
+        self._chunks = collections.deque()
+        self._length = 0
+
+
+    def write(self,
+            text):
+        self.nr_characters += len(text)
+        self._chunks.append(text)
+        self._length += len(text)
+
+        while self._chunks and \
+                self._length - len(self._chunks[0]) >= self.size:
+            self._length -= len(self._chunks.popleft())
+
+
+    def text(self):
+        text = "".join(self._chunks)[max(0, self._length - self.size):] if \
+            self.size > 0 else ""
+
+        return truncated(text, self.nr_characters - len(text))
@@ -0,0 +1,169 @@
+import json
+import os
+import subprocess
+import threading
+
+
+def machine_storage_path():
+    return os.environ.get("MACHINE_STORAGE_PATH",
+        os.path.join(os.path.expanduser("~"), ".docker", "machine"))
+
+
+def machine_directory(
+        hostname):
+    return os.path.join(machine_storage_path(), "machines", hostname)
+
+
+def machine_configuration(
+        hostname):
+    """
+    Return the Docker Machine configuration of a host, or None if it
+    cannot be read
+    """
+    pathname = os.path.join(machine_directory(hostname), "config.json")
+
+    try:
+        with open(pathname) as file:
+            return json.load(file)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+class ConnectionPool(object):
+    """
+    Pool of multiplexed SSH connections to Docker Machine hosts
+
+    Per host, a single OpenSSH master connection is opened the first
+    time a command is run on it. All subsequent commands run over this
+    connection, without the overhead of starting docker-machine and of
+    performing an SSH handshake.
+
+    Connection details are read from the Docker Machine configuration of
+    each host. If these are not available, commands are run using
+    docker-machine ssh.
+    """
+
+    ssh_options = [
+        "-o", "BatchMode=yes",
+        "-o", "PasswordAuthentication=no",
+        "-o", "StrictHostKeyChecking=no",
+        "-o", "UserKnownHostsFile=/dev/null",
+        "-o", "LogLevel=quiet",
+        "-o", "ConnectionAttempts=3",
+        "-o", "ConnectTimeout=10",
+        "-o", "IdentitiesOnly=yes",
+        "-o", "ControlMaster=auto",
+        # Master connections close by themselves once idle for some time,
+        # in case close() is never called.
+        "-o", "ControlPersist=60",
+    ]
+
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+        # Directory containing the control sockets. Created on first use.
+        self._directory = None
+
+        # Per hostname, the ssh arguments to use to connect to it, or None
+        # if docker-machine ssh must be used instead.
+        self._destinations = {}
+
+
+    def _destination(self,
+            hostname):
+
+        with self._lock:
+            if hostname not in self._destinations:
+                self._destinations[hostname] = self._read_destination(
+                    hostname)
+
+            return self._destinations[hostname]
+
+
+    def _read_destination(self,
+            hostname):
+        configuration = machine_configuration(hostname)
+
+        if configuration is None:
+            return None
+
+        driver = configuration.get("Driver", {})
+        ip_address = driver.get("IPAddress")
+        user = driver.get("SSHUser")
+
+        if not ip_address or not user:
+            return None
+
+        if configuration.get("DriverName") == "virtualbox":
+            # SSH port is forwarded from the host to the VM.
+            ip_address = "127.0.0.1"
+
+        port = driver.get("SSHPort") or 22
+        key_pathname = driver.get("SSHKeyPath") or os.path.join(
+            machine_directory(hostname), "id_rsa")
+
+        if self._directory is None:
+            # Imported here, importing it takes relatively long.
+            import tempfile
+
+            self._directory = tempfile.mkdtemp(prefix="docker_base-ssh-")
+
+        return [
+            "-o", "ControlPath={}".format(
+                os.path.join(self._directory, "%C")),
+            "-i", key_pathname,
+            "-p", str(port),
+            "{}@{}".format(user, ip_address),
+        ]
+
+
+    def command(self,
+            hostname,
+            command):
+        """
+        Return the command line for running command on a host
+
+        The command is executed by the shell on the host.
+        """
+        destination = self._destination(hostname)
+
+        if destination is None:
+            return ["docker-machine", "ssh", hostname, command]
+
+        return ["ssh"] + self.ssh_options + destination + [command]
+
+
+    def close(self,
+            hostname=None):
+        """
+        Close the connection to a host, or to all hosts if no hostname
+        is passed
+
+        Call this when a host is stopped or removed. Connection details
+        are read again when the host is used again.
+        """
+
+        with self._lock:
+            if hostname is None:
+                hostnames = list(self._destinations)
+            else:
+                hostnames = [hostname] if hostname in self._destinations \
+                    else []
+
+            for hostname in hostnames:
+                destination = self._destinations.pop(hostname)
+
+                if destination is not None:
+                    # This fails if no master connection is running, which
+                    # is fine.
+                    with open(os.devnull, "w") as devnull:
+                        subprocess.call(["ssh", "-O", "exit"] + destination,
+                            stdout=devnull, stderr=devnull)
+
+            if not self._destinations and self._directory is not None:
+                # Imported here, importing it takes relatively long.
+                import shutil
+
+                shutil.rmtree(self._directory, ignore_errors=True)
+                self._directory = None
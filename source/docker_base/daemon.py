@@ -0,0 +1,329 @@
+import json
+import os
+import sys
+import threading
+
+
+# Commands import this module to find out whether a daemon is running.
+# Modules only needed to talk to, or to run, a daemon are imported when
+# needed.
+
+
+def socket_pathname():
+    return os.path.join(os.path.expanduser("~"), ".docker_base",
+        "daemon.sock")
+
+
+def send_message(
+        connection,
+        message):
+    connection.sendall("{}\n".format(json.dumps(message)).encode())
+
+
+class ClientOutput(object):
+    """
+    Stream sending text written to it to a client
+    """
+
+    def __init__(self,
+            connection):
+        self.connection = connection
+
+        # Operations write output from multiple threads. Messages must not
+        # be interleaved.
+        self._lock = threading.Lock()
+
+
+    def write(self,
+            text):
+        with self._lock:
+            send_message(self.connection, {"output": text})
+
+
+    def flush(self):
+        pass
+
+
+class Daemon(object):
+    """
+    Server performing operations on Swarms on behalf of commands
+
+    Commands connect to a Unix domain socket and send a request: a JSON
+    object with the driver and host prefix of the Swarm, the name of the
+    operation and its arguments, on a single line. The daemon replies
+    with JSON objects, one per line: {"output": text} for each piece of
+    output of the operation, followed by either {"status": 0} or
+    {"error": message}.
+
+    Per driver and host prefix, a single Swarm instance is kept and
+    reused by all requests. Its SSH connections stay open and its join
+    credentials stay cached. Its inventory and addresses are read from
+    the store again for each request, which also holds changes made by
+    other processes. Requests for the same Swarm are performed one after
+    the other, requests for different Swarms at the same time.
+    """
+
+    # Operations that can be requested, by name: name of the Swarm method
+    # performing it and the names of the arguments to pass to it.
+    operations = {
+        "status": ("status", ["as_json"]),
+        "execute": ("execute_command",
+            ["command", "nodes", "spool_directory"]),
+        "stop": ("stop", ["nodes"]),
+        "start": ("start", ["nodes"]),
+        "status_of_services": ("status_of_services",
+            ["services", "as_json"]),
+        "remove_services": ("remove_services", ["services", "regex"]),
+    }
+
+
+    def __init__(self,
+            pathname):
+        self.pathname = pathname
+
+        # Per driver and host prefix, the Swarm and the lock serializing
+        # operations on it.
+        self._swarms = {}
+        self._lock = threading.Lock()
+
+        # Listening socket. See listen().
+        self._server = None
+
+
+    def swarm(self,
+            driver,
+            host_prefix):
+        from .swarm_fabfile import Swarm
+
+        with self._lock:
+            if (driver, host_prefix) not in self._swarms:
+                self._swarms[(driver, host_prefix)] = (
+                    Swarm(driver, host_prefix), threading.Lock())
+
+            return self._swarms[(driver, host_prefix)]
+
+
+    def close(self):
+        with self._lock:
+            for swarm, _ in self._swarms.values():
+                swarm.close()
+
+            self._swarms = {}
+
+
+    def warm_up(self,
+            driver,
+            host_prefix):
+        """
+        Obtain the inventory, addresses and join credentials of a Swarm,
+        and connect to its managers
+        """
+
+        swarm, lock = self.swarm(driver, host_prefix)
+
+        with lock:
+            swarm.addresses()
+
+            for hostname in swarm.manager_hostnames(state="Running"):
+                swarm.run_on_node(hostname, "true", capture=True)
+
+            if swarm.manager_hostnames(state="Running"):
+                swarm.manager_join_info()
+                swarm.worker_join_info()
+
+
+    def perform(self,
+            connection,
+            request):
+        if request.get("operation") not in self.operations:
+            raise RuntimeError("Unsupported operation: {}".format(
+                request.get("operation")))
+
+        name, argument_names = self.operations[request["operation"]]
+        arguments = request["arguments"]
+        swarm, lock = self.swarm(request["driver"], request["host_prefix"])
+
+        with lock:
+            swarm.forget_inventory()
+            swarm.nr_parallel = int(arguments.get("nr_parallel", 1))
+            swarm.output = ClientOutput(connection)
+
+            try:
+                getattr(swarm, name)(*[arguments[argument_name] for
+                    argument_name in argument_names])
+            finally:
+                swarm.output = None
+
+
+    def handle(self,
+            connection):
+        try:
+            with connection.makefile("r", encoding="utf-8") as file:
+                request = json.loads(file.readline())
+
+            try:
+                self.perform(connection, request)
+            except RuntimeError as exception:
+                send_message(connection, {"error": str(exception)})
+            except Exception as exception:
+                send_message(connection, {"error": "{}: {}".format(
+                    type(exception).__name__, exception)})
+            else:
+                send_message(connection, {"status": 0})
+        except (OSError, ValueError):
+            # The client went away, or sent garbage.
+            pass
+        finally:
+            connection.close()
+
+
+    def listen(self):
+        """
+        Start listening on the socket
+
+        Connections are accepted once serve() is called.
+        """
+
+        import socket
+
+        connection = request_socket(self.pathname)
+
+        if connection is not None:
+            connection.close()
+            raise RuntimeError("A daemon is already listening on {}".format(
+                self.pathname))
+
+        if os.path.exists(self.pathname):
+            os.remove(self.pathname)
+
+        os.makedirs(os.path.dirname(self.pathname), exist_ok=True)
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+        # Only the current user may connect.
+        umask = os.umask(0o077)
+
+        try:
+            self._server.bind(self.pathname)
+        finally:
+            os.umask(umask)
+
+        self._server.listen(16)
+
+
+    def serve(self):
+        """
+        Accept connections until interrupted or terminated
+        """
+
+        import signal
+
+        # Let SIGTERM clean up like Ctrl-C does.
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+        sys.stdout.write("listening on {}\n".format(self.pathname))
+        sys.stdout.flush()
+
+        try:
+            while True:
+                connection, _ = self._server.accept()
+                threading.Thread(target=self.handle, args=(connection,),
+                    daemon=True).start()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.shutdown()
+
+
+    def shutdown(self):
+        """
+        Stop listening and close the Swarms
+        """
+
+        self._server.close()
+        os.remove(self.pathname)
+        self.close()
+
+
+def request_socket(
+        pathname):
+    """
+    Return a socket connected to the daemon, or None if no daemon is
+    listening on pathname
+    """
+
+    if not os.path.exists(pathname):
+        return None
+
+    import socket
+
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    try:
+        connection.connect(pathname)
+    except OSError:
+        # Left behind by a daemon that is no longer running.
+        connection.close()
+        return None
+
+    return connection
+
+
+def request(
+        driver,
+        host_prefix,
+        operation,
+        **arguments):
+    """
+    Have the daemon perform an operation, if it is running
+
+    Output of the operation is written to standard output. Returns
+    whether the daemon performed the operation. This function fails if
+    the operation failed.
+    """
+
+    connection = request_socket(socket_pathname())
+
+    if connection is None:
+        return False
+
+    try:
+        send_message(connection, {"driver": driver,
+            "host_prefix": host_prefix, "operation": operation,
+            "arguments": arguments})
+
+        with connection.makefile("r", encoding="utf-8") as file:
+            for line in file:
+                message = json.loads(line)
+
+                if "output" in message:
+                    sys.stdout.write(message["output"])
+                    sys.stdout.flush()
+                elif "error" in message:
+                    raise RuntimeError(message["error"])
+                else:
+                    return True
+    finally:
+        connection.close()
+
+    raise RuntimeError("The daemon closed the connection before finishing "
+        "the operation...")
+
+
+def serve(
+        driver,
+        host_prefixes):
+    """
+    Warm up the Swarms with the host prefixes passed in and serve
+    requests until interrupted
+    """
+
+    daemon = Daemon(socket_pathname())
+    daemon.listen()
+
+    try:
+        for host_prefix in host_prefixes:
+            daemon.warm_up(driver, host_prefix)
+    except:
+        daemon.shutdown()
+        raise
+
+    daemon.serve()
@@ -0,0 +1,141 @@
+import collections
+import io
+import json
+import sys
+from . import parallel
+from .swarm_fabfile import Swarm
+
+
+# Operations on multiple Swarms at the same time. Per Swarm, the
+# operation runs in a thread of its own, and writes its output to a
+# buffer of its own. The output is printed grouped by Swarm afterwards.
+
+
+def host_prefixes(
+        host_prefix):
+    """
+    Return the host prefixes in a comma-separated list of host prefixes
+    """
+    return [prefix.strip() for prefix in host_prefix.split(",") if
+        prefix.strip()]
+
+
+def load_inventories(
+        swarms):
+    """
+    Make sure the inventories of the Swarms are cached, using a single
+    call to docker-machine for all Swarms whose inventory is not in their
+    store
+    """
+
+    swarms = [swarm for swarm in swarms if not swarm.load_stored_inventory()]
+
+    if swarms:
+        output = swarms[0].local(Swarm.inventory_command, capture=True)
+
+        for swarm in swarms:
+            swarm.set_inventory_listing(output)
+
+
+def print_grouped(
+        outputs):
+    for prefix, output in outputs.items():
+        sys.stdout.write("=== {} ===\n{}".format(prefix, output))
+
+    sys.stdout.flush()
+
+
+def run_on_swarms(
+        driver,
+        host_prefix,
+        nr_parallel,
+        operation,
+        *arguments):
+    """
+    Run an operation on multiple Swarms at the same time
+
+    host_prefix is a comma-separated list of host prefixes, one per
+    Swarm. operation is the name of a Swarm method. Per Swarm, at most
+    nr_parallel nodes are operated on at the same time. The output written
+    per Swarm is collected and returned, by host prefix, in the order of
+    the prefixes. This function fails if the operation failed on any of
+    the Swarms, after printing the output grouped by Swarm.
+    """
+
+    prefixes = host_prefixes(host_prefix)
+    swarms = [Swarm(driver, prefix, nr_parallel) for prefix in prefixes]
+    errors = {}
+
+    for swarm in swarms:
+        swarm.output = io.StringIO()
+
+    def run_operation(
+            swarm):
+        try:
+            getattr(swarm, operation)(*arguments)
+        except RuntimeError as exception:
+            errors[swarm.host_prefix] = str(exception)
+
+    try:
+        load_inventories(swarms)
+
+        for _ in parallel.map_unordered(run_operation, swarms, len(swarms)):
+            pass
+    finally:
+        for swarm in swarms:
+            swarm.close()
+
+    outputs = collections.OrderedDict((swarm.host_prefix,
+        swarm.output.getvalue()) for swarm in swarms)
+
+    if errors:
+        print_grouped(outputs)
+
+        raise RuntimeError("Failed on {} of {} Swarms:\n{}".format(
+            len(errors), len(swarms), "\n".join("{}: {}".format(prefix,
+                errors[prefix]) for prefix in prefixes if prefix in errors)))
+
+    return outputs
+
+
+def status_of_swarms(
+        driver,
+        host_prefix,
+        as_json=False):
+    """
+    Print the status of multiple Swarms
+
+    host_prefix is a comma-separated list of host prefixes. The status
+    of the Swarms is obtained at the same time, and printed grouped by
+    Swarm. In JSON, the status of each Swarm is keyed by its prefix.
+    """
+
+    outputs = run_on_swarms(driver, host_prefix, 1, "status", as_json)
+
+    if as_json:
+        sys.stdout.write("{}\n".format(json.dumps(dict(
+            (prefix, json.loads(output)) for prefix, output in
+                outputs.items()), indent=4, sort_keys=True)))
+    else:
+        print_grouped(outputs)
+
+
+def execute_on_swarms(
+        driver,
+        host_prefix,
+        command,
+        nodes,
+        nr_parallel=1,
+        spool_directory=None):
+    """
+    Execute command on the nodes of multiple Swarms at the same time
+
+    host_prefix is a comma-separated list of host prefixes. nodes are
+    selected in each of the Swarms. The output is printed grouped by
+    Swarm. If a spool_directory is passed, the output of the nodes of
+    all Swarms is written to it instead.
+    """
+
+    outputs = run_on_swarms(driver, host_prefix, nr_parallel,
+        "execute_command", command, nodes, spool_directory)
+    print_grouped(outputs)
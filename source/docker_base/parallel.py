@@ -0,0 +1,78 @@
+import concurrent.futures
+
+
+def _map(
+        function,
+        arguments,
+        nr_workers,
+        ordered):
+
+    arguments = list(arguments)
+
+    if not arguments:
+        return
+
+    nr_workers = max(1, min(int(nr_workers), len(arguments)))
+
+    with concurrent.futures.ThreadPoolExecutor(nr_workers) as executor:
+        futures = [executor.submit(function, argument) for argument in
+            arguments]
+        argument_by_future = dict(zip(futures, arguments))
+
+        if not ordered:
+            futures = concurrent.futures.as_completed(futures)
+
+        try:
+            for future in futures:
+                yield argument_by_future[future], future.result()
+        except:
+            # Don't start calls that are still pending. Calls that are
+            # already running are waited for when leaving the executor's
+            # context.
+            for future in argument_by_future:
+                future.cancel()
+            raise
+
+
+def map_ordered(
+        function,
+        arguments,
+        nr_workers):
+    """
+    Call function for each argument, using at most nr_workers threads
+
+    Yields (argument, result) tuples in the order of the arguments passed
+    in. An exception raised by one of the calls is re-raised when its
+    result is reached. Pending calls are cancelled in that case.
+    """
+    return _map(function, arguments, nr_workers, ordered=True)
+
+
+def map_unordered(
+        function,
+        arguments,
+        nr_workers):
+    """
+    Call function for each argument, using at most nr_workers threads
+
+    Yields (argument, result) tuples as soon as each call finishes. An
+    exception raised by one of the calls is re-raised as soon as it is
+    noticed. Pending calls are cancelled in that case.
+    """
+    return _map(function, arguments, nr_workers, ordered=False)
+
+
+def run_phases(
+        function,
+        phases,
+        nr_workers):
+    """
+    Call function for each argument in each phase
+
+    Phases are processed one after the other. Within a phase, at most
+    nr_workers calls run at the same time. The next phase starts once
+    all calls in the current phase have finished.
+    """
+    for arguments in phases:
+        for _ in map_unordered(function, arguments, nr_workers):
+            pass
@@ -0,0 +1,269 @@
+import collections
+import functools
+import json
+import sys
+import threading
+import time
+
+
+class Profiler(object):
+    """
+    Record of the commands executed and the operations performed
+
+    Commands are subprocesses, possibly executing a command on a node.
+    Per command, its node, wall time, exit code and number of bytes of
+    output are recorded. Operations are calls of Swarm methods decorated
+    by operation(). Each command is attributed to the innermost operation
+    active in the thread executing it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.start_time = time.time()
+
+        # Per command: name of operation, node, command line, start time,
+        # duration, exit code, number of bytes of output, thread id.
+        self.commands = []
+
+        # Per operation: name, node, start time, duration, thread id.
+        self.operations = []
+
+
+    def _operation_stack(self):
+        if not hasattr(self._local, "operations"):
+            self._local.operations = []
+
+        return self._local.operations
+
+
+    def current_operation(self):
+        stack = self._operation_stack()
+
+        return stack[-1] if stack else None
+
+
+    def record_command(self,
+            command,
+            node,
+            start_time,
+            duration,
+            exit_code,
+            nr_bytes):
+        operation = self.current_operation()
+
+        if node is None and operation is not None:
+            node = operation[1]
+
+        with self._lock:
+            self.commands.append((
+                operation[0] if operation is not None else None,
+                node, command, start_time, duration, exit_code, nr_bytes,
+                threading.current_thread().ident))
+
+
+    def enter_operation(self,
+            name,
+            node):
+        self._operation_stack().append((name, node, time.time()))
+
+
+    def leave_operation(self):
+        name, node, start_time = self._operation_stack().pop()
+
+        with self._lock:
+            self.operations.append((name, node, start_time,
+                time.time() - start_time, threading.current_thread().ident))
+
+
+    def summary(self):
+        """
+        Return a table summarizing the recorded commands and operations
+        per operation
+        """
+
+        # Per operation name: number of calls, wall time, number of
+        # commands, time spent in commands, bytes of output.
+        totals = collections.OrderedDict()
+
+        def totals_of(
+                name):
+            return totals.setdefault(name, [0, 0.0, 0, 0.0, 0])
+
+        with self._lock:
+            for name, _, _, duration, _ in self.operations:
+                totals_of(name)[0] += 1
+                totals_of(name)[1] += duration
+
+            for name, _, _, _, duration, _, nr_bytes, _ in self.commands:
+                totals_ = totals_of(name or "-")
+                totals_[2] += 1
+                totals_[3] += duration
+                totals_[4] += nr_bytes or 0
+
+            nr_commands = len(self.commands)
+            nr_remote_commands = len([command for command in self.commands
+                if command[1] is not None])
+
+        names = sorted(totals, key=lambda name: totals[name][1],
+            reverse=True)
+        width = max([len("OPERATION")] + [len(name) for name in names])
+        lines = ["{}  {:>6}  {:>10}  {:>8}  {:>10}  {:>10}".format(
+            "OPERATION".ljust(width), "CALLS", "WALL (s)", "COMMANDS",
+            "CMD (s)", "BYTES")]
+
+        for name in names:
+            calls, wall_time, commands, command_time, nr_bytes = totals[name]
+            lines.append(
+                "{}  {:>6}  {:>10.3f}  {:>8}  {:>10.3f}  {:>10}".format(
+                    name.ljust(width), calls, wall_time, commands,
+                    command_time, nr_bytes))
+
+        lines.append("")
+        lines.append("{} commands, {} of which for a node, in {:.3f} s".format(
+            nr_commands, nr_remote_commands, time.time() - self.start_time))
+
+        return "\n".join(lines)
+
+
+    def chrome_trace(self):
+        """
+        Return the recorded commands and operations in the Chrome trace
+        event format (load in chrome://tracing or Perfetto)
+        """
+
+        events = []
+
+        def microseconds(
+                seconds):
+            return int(round(seconds * 1e6))
+
+        with self._lock:
+            for name, node, start_time, duration, thread_id in \
+                    self.operations:
+                events.append({
+                    "name": name,
+                    "cat": "operation",
+                    "ph": "X",
+                    "ts": microseconds(start_time - self.start_time),
+                    "dur": microseconds(duration),
+                    "pid": 1,
+                    "tid": thread_id,
+                    "args": {"node": node},
+                })
+
+            for operation, node, command, start_time, duration, exit_code, \
+                    nr_bytes, thread_id in self.commands:
+                events.append({
+                    "name": command.split()[0] if command else "",
+                    "cat": "command",
+                    "ph": "X",
+                    "ts": microseconds(start_time - self.start_time),
+                    "dur": microseconds(duration),
+                    "pid": 1,
+                    "tid": thread_id,
+                    "args": {
+                        "operation": operation,
+                        "node": node,
+                        "command": command,
+                        "exit_code": exit_code,
+                        "nr_bytes": nr_bytes,
+                    },
+                })
+
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+# Profiler used by the current process, if any.
+_profiler = None
+
+
+def start():
+    global _profiler
+    _profiler = Profiler()
+
+    return _profiler
+
+
+def stop():
+    global _profiler
+    profiler, _profiler = _profiler, None
+
+    return profiler
+
+
+def profiler():
+    return _profiler
+
+
+def record_command(
+        command,
+        node,
+        start_time,
+        duration,
+        exit_code,
+        nr_bytes):
+    if _profiler is not None:
+        _profiler.record_command(command, node, start_time, duration,
+            exit_code, nr_bytes)
+
+
+# Names of the parameters of operations that hold the name of the node
+# the operation is performed on.
+node_parameter_names = ["node", "hostname", "manager_hostname"]
+
+
+def operation(
+        function):
+    """
+    Decorator for Swarm methods to profile as an operation
+
+    If the first parameter of the method (after self) is named after a
+    node (see node_parameter_names), the operation is attributed to the
+    node passed in.
+    """
+
+    code = function.__code__
+    node_parameter_name = code.co_varnames[1] if code.co_argcount > 1 and \
+        code.co_varnames[1] in node_parameter_names else None
+
+    @functools.wraps(function)
+    def wrapper(
+            self,
+            *arguments,
+            **keyword_arguments):
+        profiler = _profiler
+
+        if profiler is None:
+            return function(self, *arguments, **keyword_arguments)
+
+        node = None
+
+        if node_parameter_name is not None:
+            node = arguments[0] if arguments else \
+                keyword_arguments.get(node_parameter_name)
+
+        profiler.enter_operation(function.__name__, node)
+
+        try:
+            return function(self, *arguments, **keyword_arguments)
+        finally:
+            profiler.leave_operation()
+
+    return wrapper
+
+
+def write_report(
+        pathname):
+    """
+    Stop profiling, print a summary to standard error and write a Chrome
+    trace to pathname
+    """
+
+    profiler = stop()
+
+    if profiler is not None:
+        sys.stderr.write("--- profile ---\n{}\n".format(profiler.summary()))
+
+        with open(pathname, "w") as file:
+            json.dump(profiler.chrome_trace(), file)
@@ -0,0 +1,98 @@
+class Record(object):
+    """
+    Base class of lightweight records
+
+    Subclasses list the names of their fields in __slots__. Subclasses
+    describing Docker objects list the corresponding keys in the JSON
+    output of the Docker command line client in json_keys.
+    """
+
+    __slots__ = ()
+    json_keys = ()
+
+
+    def __init__(self,
+            *values):
+        assert len(values) == len(self.__slots__), values
+
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+
+    @classmethod
+    def from_json(cls,
+            record):
+        return cls(*[record.get(key, "") for key in cls.json_keys])
+
+
+    def __repr__(self):
+        return "{}({})".format(type(self).__name__, ", ".join(
+            repr(getattr(self, name)) for name in self.__slots__))
+
+
+    def as_dict(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+
+class Host(Record):
+    """
+    Docker Machine host that is part of a Swarm
+    """
+
+    __slots__ = ("name", "role", "idx", "state")
+
+
+class Node(Record):
+    """
+    Node in a Swarm, as reported by a manager
+    """
+
+    __slots__ = ("id", "hostname", "status", "availability",
+        "manager_status")
+    json_keys = ("ID", "Hostname", "Status", "Availability",
+        "ManagerStatus")
+
+
+    @classmethod
+    def from_json(cls,
+            record):
+        # Status values are capitalized in the output of docker node ls.
+        node = super(Node, cls).from_json(record)
+        node.status = node.status.lower()
+        node.availability = node.availability.lower()
+        node.manager_status = node.manager_status.lower()
+
+        return node
+
+
+    def is_manager(self):
+        return bool(self.manager_status)
+
+
+class Service(Record):
+    """
+    Service running in a Swarm
+    """
+
+    __slots__ = ("id", "name", "mode", "replicas", "image", "ports")
+    json_keys = ("ID", "Name", "Mode", "Replicas", "Image", "Ports")
+
+
+class Task(Record):
+    """
+    Task of a service running in a Swarm
+    """
+
+    __slots__ = ("id", "name", "image", "node", "desired_state",
+        "current_state", "error", "ports")
+    json_keys = ("ID", "Name", "Image", "Node", "DesiredState",
+        "CurrentState", "Error", "Ports")
+
+
+class Network(Record):
+    """
+    Network in a Swarm
+    """
+
+    __slots__ = ("id", "name", "driver", "scope")
+    json_keys = ("ID", "Name", "Driver", "Scope")
@@ -0,0 +1,229 @@
+import os
+import threading
+import time
+from .connection import machine_storage_path
+from .records import Host
+
+
+def store_pathname(
+        host_prefix):
+    return os.path.join(os.path.expanduser("~"), ".docker_base",
+        "{}.db".format(host_prefix))
+
+
+class Store(object):
+    """
+    Record of what is known about the hosts of a Swarm, shared by all
+    processes managing it
+
+    Recorded are the hosts (name, role, index, state), the LAN IP address
+    of running hosts and the join tokens. Each kind of information
+    expires after its own time to live (in seconds). Expired or missing
+    information is reported as None, and must be obtained again by the
+    caller.
+
+    Everything is forgotten when the store is used with a different
+    Docker Machine storage path than before.
+    """
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS setting (
+            name TEXT PRIMARY KEY,
+            value TEXT);
+        CREATE TABLE IF NOT EXISTS host (
+            name TEXT PRIMARY KEY,
+            role TEXT,
+            idx INTEGER,
+            state TEXT);
+        CREATE TABLE IF NOT EXISTS address (
+            name TEXT PRIMARY KEY,
+            address TEXT,
+            updated_at REAL);
+        CREATE TABLE IF NOT EXISTS join_token (
+            node_type TEXT PRIMARY KEY,
+            token TEXT,
+            updated_at REAL);
+    """
+
+
+    def __init__(self,
+            pathname,
+            inventory_ttl=60,
+            address_ttl=3600,
+            join_token_ttl=3600):
+        self.pathname = pathname
+        self.inventory_ttl = inventory_ttl
+        self.address_ttl = address_ttl
+        self.join_token_ttl = join_token_ttl
+
+        # Connection to the database, opened on first use. Shared by all
+        # threads.
+        self._connection = None
+        self._lock = threading.Lock()
+
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+    def _execute(self,
+            statements,
+            *parameters):
+        """
+        Execute statements, separated by semicolons, in a single
+        transaction and return the rows selected by the last one
+
+        Each statement is passed its own tuple of parameters.
+        """
+
+        with self._lock:
+            if self._connection is None:
+                self._connection = self._open()
+
+            with self._connection:
+                cursor = None
+
+                for statement, parameters_ in zip(statements.split(";"),
+                        parameters or [()] * len(statements.split(";"))):
+                    cursor = self._connection.execute(statement,
+                        parameters_)
+
+                return cursor.fetchall()
+
+
+    def _open(self):
+        # Imported here. Commands that never touch the store don't pay for
+        # importing it.
+        import sqlite3
+
+        # The store contains the join tokens. Only the current user may
+        # read it. SQLite creates its journal with the same permissions as
+        # the database.
+        directory = os.path.dirname(self.pathname)
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        os.chmod(directory, 0o700)
+        os.close(os.open(self.pathname, os.O_RDWR | os.O_CREAT, 0o600))
+        os.chmod(self.pathname, 0o600)
+
+        # Other processes may be writing to the store at the same time.
+        connection = sqlite3.connect(self.pathname, timeout=10,
+            check_same_thread=False)
+
+        with connection:
+            connection.executescript(self.schema)
+            rows = connection.execute("SELECT value FROM setting WHERE "
+                "name = 'machine_storage_path'").fetchall()
+
+            if rows != [(machine_storage_path(),)]:
+                for table in ["setting", "host", "address", "join_token"]:
+                    connection.execute("DELETE FROM {}".format(table))
+
+                connection.execute("INSERT INTO setting VALUES "
+                    "('machine_storage_path', ?)", (machine_storage_path(),))
+
+        return connection
+
+
+    def clear(self):
+        self._execute("DELETE FROM setting WHERE name = 'inventory_time'; "
+            "DELETE FROM host; DELETE FROM address; DELETE FROM join_token")
+
+
+    def inventory(self):
+        """
+        Return the hosts, by hostname, or None if the inventory has
+        expired
+        """
+
+        rows = self._execute("SELECT value FROM setting WHERE "
+            "name = 'inventory_time'")
+
+        if not rows or float(rows[0][0]) < time.time() - self.inventory_ttl:
+            return None
+
+        return {name: Host(name, role, idx, state) for name, role, idx,
+            state in self._execute("SELECT name, role, idx, state FROM host")}
+
+
+    def set_inventory(self,
+            inventory):
+        """
+        Replace the recorded hosts by those in inventory
+        """
+
+        statements = ["DELETE FROM host",
+            "INSERT OR REPLACE INTO setting VALUES ('inventory_time', ?)"]
+        parameters = [(), (repr(time.time()),)]
+
+        for host in inventory.values():
+            statements.append("INSERT INTO host VALUES (?, ?, ?, ?)")
+            parameters.append((host.name, host.role, host.idx, host.state))
+
+        self._execute(";".join(statements), *parameters)
+
+
+    def invalidate_inventory(self):
+        self._execute("DELETE FROM setting WHERE name = 'inventory_time'")
+
+
+    def update_host(self,
+            host):
+        """
+        Record the new state or role of a host
+
+        The address of a host whose state changed is forgotten. It may get
+        a different address when it is started again.
+        """
+
+        self._execute("DELETE FROM address WHERE name IN (SELECT name FROM "
+            "host WHERE name = ? AND state != ?); "
+            "INSERT OR REPLACE INTO host VALUES (?, ?, ?, ?)",
+            (host.name, host.state),
+            (host.name, host.role, host.idx, host.state))
+
+
+    def remove_host(self,
+            hostname):
+        self._execute("DELETE FROM host WHERE name = ?; "
+            "DELETE FROM address WHERE name = ?", (hostname,), (hostname,))
+
+
+    def addresses(self):
+        """
+        Return the addresses of hosts that have not expired, by hostname
+        """
+
+        return dict(self._execute("SELECT name, address FROM address WHERE "
+            "updated_at >= ?", (time.time() - self.address_ttl,)))
+
+
+    def set_addresses(self,
+            addresses):
+        if addresses:
+            now = time.time()
+            self._execute(";".join(["INSERT OR REPLACE INTO address VALUES "
+                "(?, ?, ?)"] * len(addresses)), *[(hostname, address, now) for
+                    hostname, address in addresses.items()])
+
+
+    def join_token(self,
+            node_type):
+        rows = self._execute("SELECT token FROM join_token WHERE "
+            "node_type = ? AND updated_at >= ?", (node_type,
+                time.time() - self.join_token_ttl))
+
+        return rows[0][0] if rows else None
+
+
+    def set_join_token(self,
+            node_type,
+            token):
+        self._execute("INSERT OR REPLACE INTO join_token VALUES (?, ?, ?)",
+            (node_type, token, time.time()))
+
+
+    def clear_join_tokens(self):
+        self._execute("DELETE FROM join_token")
@@ -1,105 +1,236 @@
-from fabric.tasks import execute
-from . import swarm_fabfile as fabfile
+import os
+from . import daemon
+
+
+# swarm_fabfile is imported when a function needs it, not when this module
+# is imported. Scripts parse their command line and print help without
+# loading it.
+#
+# Operations the daemon can perform are passed to it, if it is running.
 
 
 def create(
         driver,
         host_prefix,
         nr_managers,
-        nr_workers):
+        nr_workers,
+        nr_parallel=1,
+        use_template=False,
+        registry_mirror=None):
+    from . import swarm_fabfile
 
-    return execute(fabfile.create,
-        driver=driver, host_prefix=host_prefix,
-        nr_managers=nr_managers, nr_workers=nr_workers)
+    return swarm_fabfile.create(driver, host_prefix, nr_managers, nr_workers,
+        nr_parallel, use_template, registry_mirror)
 
 
 def start_nodes(
         driver,
         host_prefix,
-        nodes):
-    return execute(fabfile.start_nodes,
-        driver=driver, host_prefix=host_prefix,
-        nodes=nodes)
+        nodes,
+        nr_parallel=1):
+    if daemon.request(driver, host_prefix, "start", nodes=nodes,
+            nr_parallel=nr_parallel):
+        return
+
+    from . import swarm_fabfile
+
+    return swarm_fabfile.start_nodes(driver, host_prefix, nodes, nr_parallel)
 
 
 def stop_nodes(
         driver,
         host_prefix,
-        nodes):
-    return execute(fabfile.stop_nodes,
-        driver=driver, host_prefix=host_prefix,
-        nodes=nodes)
+        nodes,
+        nr_parallel=1):
+    if daemon.request(driver, host_prefix, "stop", nodes=nodes,
+            nr_parallel=nr_parallel):
+        return
+
+    from . import swarm_fabfile
+
+    return swarm_fabfile.stop_nodes(driver, host_prefix, nodes, nr_parallel)
 
 
 def pause_nodes(
         driver,
         host_prefix,
         nodes):
-    return execute(fabfile.pause_nodes,
-        driver=driver, host_prefix=host_prefix,
-        nodes=nodes)
+    from . import swarm_fabfile
+
+    return swarm_fabfile.pause_nodes(driver, host_prefix, nodes)
 
 
 def resume_nodes(
         driver,
         host_prefix,
-        nodes):
-    return execute(fabfile.resume_nodes,
-        driver=driver, host_prefix=host_prefix,
-        nodes=nodes)
+        nodes,
+        nr_parallel=1):
+    from . import swarm_fabfile
+
+    return swarm_fabfile.resume_nodes(driver, host_prefix, nodes, nr_parallel)
 
 
 def remove_nodes(
         driver,
         host_prefix,
-        nodes):
-    return execute(fabfile.remove_nodes,
-        driver=driver, host_prefix=host_prefix,
-        nodes=nodes)
+        nodes,
+        nr_parallel=1):
+    from . import swarm_fabfile
+
+    return swarm_fabfile.remove_nodes(driver, host_prefix, nodes, nr_parallel)
 
 
 def add_manager_nodes(
         driver,
         host_prefix,
-        nr_nodes):
-    return execute(fabfile.add_manager_nodes,
-        driver=driver, host_prefix=host_prefix,
-        nr_nodes=nr_nodes)
+        nr_nodes,
+        nr_parallel=1,
+        use_template=False,
+        images=None,
+        registry_mirror=None):
+    from . import swarm_fabfile
+
+    return swarm_fabfile.add_manager_nodes(driver, host_prefix, nr_nodes,
+        nr_parallel, use_template, images, registry_mirror)
 
 
 def add_worker_nodes(
         driver,
         host_prefix,
-        nr_nodes):
-    return execute(fabfile.add_worker_nodes,
-        driver=driver, host_prefix=host_prefix,
-        nr_nodes=nr_nodes)
+        nr_nodes,
+        nr_parallel=1,
+        use_template=False,
+        images=None,
+        registry_mirror=None):
+    from . import swarm_fabfile
+
+    return swarm_fabfile.add_worker_nodes(driver, host_prefix, nr_nodes,
+        nr_parallel, use_template, images, registry_mirror)
 
 
 def status_of_swarm(
+        driver,
+        host_prefix,
+        as_json=False):
+    if "," in host_prefix:
+        from . import multi_swarm
+
+        return multi_swarm.status_of_swarms(driver, host_prefix, as_json)
+
+    if daemon.request(driver, host_prefix, "status", as_json=as_json):
+        return
+
+    from . import swarm_fabfile
+
+    return swarm_fabfile.status_of_swarm(driver, host_prefix, as_json)
+
+
+def fill_pool(
+        driver,
+        host_prefix,
+        nr_spares,
+        nr_parallel=1,
+        use_template=False,
+        registry_mirror=None):
+    from . import swarm_fabfile
+
+    return swarm_fabfile.fill_pool(driver, host_prefix, nr_spares, nr_parallel,
+        use_template, registry_mirror)
+
+
+def status_of_pool(
+        driver,
+        host_prefix):
+    from . import swarm_fabfile
+
+    return swarm_fabfile.status_of_pool(driver, host_prefix)
+
+
+def refresh_inventory(
+        driver,
+        host_prefix,
+        nr_parallel=1):
+    from . import swarm_fabfile
+
+    return swarm_fabfile.refresh_inventory(driver, host_prefix, nr_parallel)
+
+
+def serve(
         driver,
         host_prefix):
-    return execute(fabfile.status_of_swarm,
-        driver=driver, host_prefix=host_prefix)
+    return daemon.serve(driver, host_prefix.split(","))
+
+
+def drain_pool(
+        driver,
+        host_prefix,
+        nr_parallel=1):
+    from . import swarm_fabfile
+
+    return swarm_fabfile.drain_pool(driver, host_prefix, nr_parallel)
+
+
+def reconcile(
+        driver,
+        host_prefix,
+        nr_managers,
+        nr_workers,
+        remove=False,
+        dry_run=False,
+        nr_parallel=1):
+    from . import swarm_fabfile
+
+    return swarm_fabfile.reconcile(driver, host_prefix, nr_managers,
+        nr_workers, remove, dry_run, nr_parallel)
+
+
+def prefetch_images(
+        driver,
+        host_prefix,
+        images,
+        nodes,
+        nr_parallel=1):
+    from . import swarm_fabfile
+
+    return swarm_fabfile.prefetch_images(driver, host_prefix, images, nodes,
+        nr_parallel)
 
 
 def create_network(
         driver,
         host_prefix,
         name):
-    return execute(fabfile.create_network,
-        driver=driver, host_prefix=host_prefix,
-        name=name)
+    from . import swarm_fabfile
+
+    return swarm_fabfile.create_network(driver, host_prefix, name)
 
 
 def execute_command(
         driver,
         host_prefix,
         command,
-        nodes):
-    return execute(fabfile.execute_command,
-        driver=driver, host_prefix=host_prefix,
-        command=command, nodes=nodes)
+        nodes,
+        nr_parallel=1,
+        spool_directory=None):
+    # The daemon runs in another directory.
+    if spool_directory is not None:
+        spool_directory = os.path.abspath(spool_directory)
+
+    if "," in host_prefix:
+        from . import multi_swarm
+
+        return multi_swarm.execute_on_swarms(driver, host_prefix, command,
+            nodes, nr_parallel, spool_directory)
+
+    if daemon.request(driver, host_prefix, "execute", command=command,
+            nodes=nodes, nr_parallel=nr_parallel,
+            spool_directory=spool_directory):
+        return
+
+    from . import swarm_fabfile
+
+    return swarm_fabfile.execute_command(driver, host_prefix, command, nodes,
+        nr_parallel, spool_directory)
 
 
 def execute_on_nodes(
@@ -107,25 +238,61 @@ def execute_on_nodes(
         host_prefix,
         nodes,
         command,
-        arguments):
-    return execute(fabfile.execute_on_nodes,
-        driver=driver, host_prefix=host_prefix,
-        nodes=nodes, command=command, arguments=arguments)
+        arguments,
+        nr_parallel=1):
+    command = "{} {}".format(command, " ".join(arguments))
+
+    return execute_command(driver, host_prefix, command, nodes, nr_parallel)
 
 
 def status_of_services(
         driver,
         host_prefix,
-        services):
-    return execute(fabfile.status_of_services,
-        driver=driver, host_prefix=host_prefix,
-        services=services)
+        services,
+        as_json=False):
+    if daemon.request(driver, host_prefix, "status_of_services",
+            services=services, as_json=as_json):
+        return
+
+    from . import swarm_fabfile
+
+    return swarm_fabfile.status_of_services(driver, host_prefix, services,
+        as_json)
 
 
 def remove_services(
         driver,
         host_prefix,
-        services):
-    return execute(fabfile.remove_services,
-        driver=driver, host_prefix=host_prefix,
-        services=services)
+        services,
+        regex=False):
+    if daemon.request(driver, host_prefix, "remove_services",
+            services=services, regex=regex):
+        return
+
+    from . import swarm_fabfile
+
+    return swarm_fabfile.remove_services(driver, host_prefix, services, regex)
+
+
+def scale_services(
+        driver,
+        host_prefix,
+        services,
+        nr_replicas,
+        regex=False):
+    from . import swarm_fabfile
+
+    return swarm_fabfile.scale_services(driver, host_prefix, services,
+        nr_replicas, regex)
+
+
+def update_service_images(
+        driver,
+        host_prefix,
+        services,
+        image,
+        regex=False):
+    from . import swarm_fabfile
+
+    return swarm_fabfile.update_service_images(driver, host_prefix, services,
+        image, regex)
@@ -1,24 +1,131 @@
+import collections
+import contextlib
 import json
 import os
+import re
+import shlex
+import subprocess
 import sys
+import threading
 import time
-from fabric.api import *
+from . import parallel, profiling
+from .capture import Tail, read_tail, tail
+from .connection import ConnectionPool, machine_configuration, \
+    machine_directory, machine_storage_path
+from .records import Host, Network, Node, Service, Task
+from .store import Store, store_pathname
 
 
 class Swarm(object):
 
+    # Lists all Docker Machine hosts, with their state and URL. The URL
+    # of a running host contains its IP address.
+    inventory_command = \
+        "docker-machine ls --format \"{{.Name}} {{.State}} {{.URL}}\""
+
+    # Prints the source address of packets sent over the default route,
+    # which is the LAN IP address of the node. Executed on nodes.
+    lan_ip_address_command = "ip -4 -o route get 1.1.1.1"
+
 
     def __init__(self,
             driver,
-            host_prefix):
+            host_prefix,
+            nr_parallel=1,
+            use_template=False,
+            registry_mirror=None):
         self.driver = driver
         self.host_prefix = host_prefix
 
+        if "," in self.host_prefix:
+            raise RuntimeError("Only status and execute support operating "
+                "on multiple Swarms at the same time...")
+
+        # Maximum number of hosts to work on concurrently.
+        self.nr_parallel = int(nr_parallel)
+        assert self.nr_parallel >= 1, self.nr_parallel
+
+        # Whether to create hosts as linked clones of a template host.
+        self.use_template = use_template
+
+        if self.use_template and self.driver != "virtualbox":
+            raise RuntimeError("Hosts can only be cloned from a template "
+                "using the virtualbox driver...")
+
+        self._template_lock = threading.Lock()
+
+        # URL of the registry to mirror, if hosts must pull images through
+        # a registry mirror running in the Swarm. The address of the
+        # mirror is looked up, or the mirror deployed, on first use.
+        self.registry_mirror = registry_mirror
+        self._registry_mirror_address = None
+        self._registry_mirror_lock = threading.Lock()
+
+        self._image_cache_lock = threading.Lock()
+
+        # Hosts in the Swarm, by hostname. Populated on first use.
+        self._inventory = None
+        self._inventory_lock = threading.Lock()
+
+        # LAN IP addresses of running hosts, by hostname. See addresses().
+        self._addresses = {}
+        self._addresses_lock = threading.Lock()
+
+        # What is known about the Swarm by all processes managing it. The
+        # inventory, LAN IP addresses and join tokens are looked up here
+        # first, and recorded here once obtained.
+        self.store = Store(store_pathname(host_prefix))
+
+        # SSH connections to nodes, opened on first use.
+        self.connections = ConnectionPool()
+
+        # Number of characters of the output of a failed command to report
+        # in the error raised. Output of commands like docker logs can be
+        # huge.
+        self.tail_size = 64 * 1024
+
+        # Serializes output written by multiple threads.
+        self._output_lock = threading.Lock()
+
+        # Stream to write output about the Swarm to, instead of standard
+        # output. Used to group the output of operations on multiple
+        # Swarms.
+        self.output = None
+
+        # Credentials for joining the Swarm: join tokens by node type, and
+        # the hostname and LAN IP address of the manager to join through.
+        # Obtained on first use.
+        self._join_tokens = {}
+        self._join_address = None
+        self._join_info_lock = threading.Lock()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self,
+            exception_type,
+            exception_value,
+            traceback):
+        self.close()
+
+
+    def close(self):
+        self.connections.close()
+        self.store.close()
+
+
+    def write_output(self,
+            text):
+        output = self.output or sys.stdout
+        output.write(text)
+        output.flush()
+
 
     def print_status(self,
             message):
-        sys.stdout.write("{}\n".format(message))
-        sys.stdout.flush()
+        self.write_output("{}\n".format(message))
 
 
     def host_basename(self,
@@ -36,6 +143,10 @@ class Swarm(object):
         return self.host_basename("worker")
 
 
+    def spare_basename(self):
+        return self.host_basename("spare")
+
+
     def hostname(self,
             basename,
             idx):
@@ -49,56 +160,509 @@ class Swarm(object):
 
     def is_worker(self,
             node):
-        return node.startswith(self.worker_basename())
+        return node.startswith(self.worker_basename()) or \
+            self.is_promoted_spare(node)
+
+
+    def is_spare(self,
+            node):
+        return node.startswith(self.spare_basename()) and \
+            not self.is_promoted_spare(node)
+
+
+    def role_pathname(self,
+            hostname):
+        return os.path.join(machine_directory(hostname), "docker_base-role")
+
+
+    def is_promoted_spare(self,
+            node):
+        """
+        Return whether node is a spare host that has been taken from the
+        pool and is a worker now
+
+        Spare hosts keep their hostname. Their new role is recorded in a
+        file in the Docker Machine directory of the host, which is removed
+        together with the host.
+        """
+        return node.startswith(self.spare_basename()) and \
+            os.path.exists(self.role_pathname(node))
 
 
     def local(self,
             command,
-            capture):
+            capture,
+            node=None):
+        """
+        Execute a command on the local host
+
+        The command is either a string, which is executed by the shell,
+        or a list of arguments, which is executed as is. If the command
+        executes something on a node, pass its name for profiling
+        purposes.
+        """
+
+        # Commands are run using subprocess instead of Fabric's local().
+        # The latter changes process-wide settings (quiet(), warn_only),
+        # which is not safe when commands run in multiple threads at the
+        # same time.
+        shell = not isinstance(command, list)
+        command_line = command if shell else \
+            " ".join(shlex.quote(argument) for argument in command)
+        start_time = time.time()
 
         if capture:
             # We want the output of the command in a variable.
-            with quiet():
-                result = local(command, capture=capture)
-
-            if not result.succeeded:
+            process = subprocess.Popen(command, shell=shell,
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                universal_newlines=True)
+            stdout, stderr = process.communicate()
+            profiling.record_command(command_line, node, start_time,
+                time.time() - start_time, process.returncode,
+                len(stdout) + len(stderr))
+
+            if process.returncode != 0:
                 messages = [
                     "failed to execute command:",
-                    command,
+                    command_line,
                     "stdout:",
-                    result.stdout,
+                    tail(stdout.strip(), self.tail_size),
                     "stderr:",
-                    result.stderr,
+                    tail(stderr.strip(), self.tail_size),
                 ]
                 raise RuntimeError("\n".join(messages))
+
+            result = stdout.strip()
         else:
             # We want the output of the command printed to the terminal.
             # We want the result code of the command in a variable.
-            result = local(command, capture=capture).return_code
+            result = subprocess.call(command, shell=shell)
+            profiling.record_command(command_line, node, start_time,
+                time.time() - start_time, result, None)
+
+            if result != 0:
+                messages = [
+                    "failed to execute command:",
+                    command_line,
+                ]
+                raise RuntimeError("\n".join(messages))
 
         return result
 
 
+    def local_prefixed(self,
+            command,
+            prefix,
+            node=None):
+        """
+        Execute a command on the local host, printing each line of its
+        output prefixed by prefix
+
+        Standard output and standard error are merged. Lines of commands
+        running concurrently in other threads are not mixed up. The
+        exit code of the command is returned.
+        """
+        shell = not isinstance(command, list)
+        command_line = command if shell else \
+            " ".join(shlex.quote(argument) for argument in command)
+        start_time = time.time()
+        nr_bytes = 0
+        process = subprocess.Popen(command, shell=shell,
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            universal_newlines=True, errors="replace")
+
+        for line in process.stdout:
+            nr_bytes += len(line)
+
+            if not line.endswith("\n"):
+                line += "\n"
+
+            with self._output_lock:
+                self.write_output("{}{}".format(prefix, line))
+
+        exit_code = process.wait()
+        profiling.record_command(command_line, node, start_time,
+            time.time() - start_time, exit_code, nr_bytes)
+
+        return exit_code
+
+
+    def local_stream(self,
+            command,
+            node=None,
+            spool_pathname=None,
+            chunk_size=64 * 1024):
+        """
+        Execute a command on the local host, yielding its standard output
+        while it runs
+
+        Output is yielded line by line. Lines longer than chunk_size
+        characters are yielded in pieces. If spool_pathname is passed, all
+        output is written to that file as well. Only the last tail_size
+        characters of standard output and standard error are kept, to
+        report in the error raised when the command fails. Its exit code
+        is stored in the exit_code attribute of the error.
+
+        The command is started when the first line is requested, and
+        killed when the generator is closed before the command finished.
+        """
+
+        shell = not isinstance(command, list)
+        command_line = command if shell else \
+            " ".join(shlex.quote(argument) for argument in command)
+        stdout_tail = Tail(self.tail_size)
+
+        # Imported here, importing it takes relatively long.
+        import tempfile
+
+        with contextlib.ExitStack() as stack:
+            # Standard error is written to disk, not kept in memory.
+            error_file = stack.enter_context(tempfile.TemporaryFile())
+            spool_file = stack.enter_context(open(spool_pathname, "w")) if \
+                spool_pathname else None
+            start_time = time.time()
+            process = subprocess.Popen(command, shell=shell,
+                stdout=subprocess.PIPE, stderr=error_file,
+                universal_newlines=True, errors="replace")
+
+            try:
+                for line in iter(lambda: process.stdout.readline(chunk_size),
+                        ""):
+                    stdout_tail.write(line)
+
+                    if spool_file is not None:
+                        spool_file.write(line)
+
+                    yield line
+            except:
+                # The generator was closed early, or spooling failed. The
+                # command may still be writing output nobody reads.
+                process.kill()
+                raise
+            finally:
+                process.stdout.close()
+                process.wait()
+                profiling.record_command(command_line, node, start_time,
+                    time.time() - start_time, process.returncode,
+                    stdout_tail.nr_characters +
+                        os.fstat(error_file.fileno()).st_size)
+
+            if process.returncode != 0:
+                messages = [
+                    "failed to execute command:",
+                    command_line,
+                    "stdout:",
+                    stdout_tail.text().strip(),
+                    "stderr:",
+                    read_tail(error_file, self.tail_size).strip(),
+                ]
+                error = RuntimeError("\n".join(messages))
+                error.exit_code = process.returncode
+                raise error
+
+
+    def local_pipeline(self,
+            commands,
+            stdin=None,
+            stdout=None,
+            node=None):
+        """
+        Execute commands on the local host, with the standard output of
+        each command connected to the standard input of the next one
+
+        Each command is a list of arguments. Standard input of the first
+        command and standard output of the last command are read from and
+        written to the files passed in, or to /dev/null. Data flows
+        between the commands without passing through this process.
+
+        This function fails if any of the commands fails.
+        """
+
+        command_line = " | ".join(" ".join(shlex.quote(argument) for
+            argument in command) for command in commands)
+
+        # Imported here, importing it takes relatively long.
+        import tempfile
+
+        start_time = time.time()
+        processes = []
+        error_files = []
+
+        with open(os.devnull, "r+b") as devnull:
+            for idx, command in enumerate(commands):
+                is_last = idx == len(commands) - 1
+                error_files.append(tempfile.TemporaryFile())
+                processes.append(subprocess.Popen(command,
+                    stdin=processes[-1].stdout if processes else
+                        (stdin or devnull),
+                    stdout=(stdout or devnull) if is_last else
+                        subprocess.PIPE,
+                    stderr=error_files[-1]))
+
+                if len(processes) > 1:
+                    # Only the next command reads from the pipe.
+                    processes[-2].stdout.close()
+
+            exit_codes = [process.wait() for process in processes]
+
+        profiling.record_command(command_line, node, start_time,
+            time.time() - start_time, max(exit_codes), None)
+        messages = []
+
+        for command, exit_code, error_file in zip(commands, exit_codes,
+                error_files):
+            if exit_code != 0:
+                messages += [
+                    " ".join(shlex.quote(argument) for argument in command),
+                    "stderr:",
+                    read_tail(error_file, self.tail_size).strip(),
+                ]
+
+            error_file.close()
+
+        if messages:
+            raise RuntimeError("\n".join(["failed to execute command:",
+                command_line] + messages))
+
+
+    def role(self,
+            hostname):
+        if self.is_manager(hostname):
+            return "manager"
+        elif self.is_worker(hostname):
+            return "worker"
+        elif self.is_spare(hostname):
+            return "spare"
+
+        return None
+
+
+    def index(self,
+            hostname):
+        if self.is_manager(hostname):
+            basename = self.manager_basename()
+        elif hostname.startswith(self.spare_basename()):
+            basename = self.spare_basename()
+        else:
+            basename = self.worker_basename()
+
+        idx = hostname[len(basename):]
+
+        return int(idx) if idx.isdigit() else None
+
+
+    def inventory(self):
+        """
+        Return the hosts in the Swarm, by hostname
+
+        The hosts are obtained from the store, or else using a single
+        call to docker-machine, and cached. Operations that change the
+        state of a host must call update_inventory() or
+        invalidate_inventory().
+        """
+
+        with self._inventory_lock:
+            if self._inventory is None:
+                self._inventory = self.store.inventory()
+
+            if self._inventory is None:
+                output = self.local(self.inventory_command, capture=True)
+                self._inventory = self.parse_inventory(output)
+                self.store.set_inventory(self._inventory)
+
+                if self.driver == "virtualbox":
+                    self.set_addresses(self.parse_addresses(output))
+
+            # Return a copy. The cached inventory may be updated by other
+            # threads while the caller iterates over it.
+            return dict(self._inventory)
+
+
+    def parse_inventory(self,
+            output):
+        """
+        Return the hosts in the Swarm, by hostname, given the output of
+        inventory_command
+        """
+
+        lines = str(output).strip()
+        lines = lines.split("\n") if lines else []
+        inventory = {}
+
+        for line in lines:
+            name, state = (line.split() + [""])[:2]
+            role = self.role(name)
+
+            # Skip hosts that are not part of this Swarm.
+            if role is not None:
+                inventory[name] = Host(name, role, self.index(name), state)
+
+        return inventory
+
+
+    def parse_addresses(self,
+            output):
+        """
+        Return the IP addresses of running hosts in the Swarm, by
+        hostname, given the output of inventory_command
+
+        The URL of a host contains the address docker-machine ip reports.
+        For the virtualbox driver, that is its LAN IP address.
+        """
+
+        lines = str(output).strip()
+        lines = lines.split("\n") if lines else []
+        addresses = {}
+
+        for line in lines:
+            fields = line.split()
+            match = re.match(r"tcp://([^:/]+)", fields[2]) if \
+                len(fields) >= 3 else None
+
+            if match and self.role(fields[0]) is not None:
+                addresses[fields[0]] = match.group(1)
+
+        return addresses
+
+
+    def load_stored_inventory(self):
+        """
+        Cache the inventory recorded in the store, unless it has expired
+
+        Returns whether an inventory is cached.
+        """
+
+        with self._inventory_lock:
+            if self._inventory is None:
+                self._inventory = self.store.inventory()
+
+            return self._inventory is not None
+
+
+    def set_inventory(self,
+            inventory):
+        with self._inventory_lock:
+            if self._inventory is None:
+                self._inventory = inventory
+                self.store.set_inventory(inventory)
+
+
+    def set_inventory_listing(self,
+            output):
+        """
+        Cache the inventory, and the addresses it contains, given the
+        output of inventory_command
+        """
+
+        self.set_inventory(self.parse_inventory(output))
+
+        if self.driver == "virtualbox":
+            self.set_addresses(self.parse_addresses(output))
+
+
+    def update_inventory(self,
+            hostname,
+            state):
+        """
+        Record the new state of a host in the cached inventory
+
+        Pass None as state when the host has been removed. Any connection
+        to the host is closed. Its connection details are read again when
+        the host is used again.
+        """
+
+        self.connections.close(hostname)
+
+        # A host may get a different address when it is started again.
+        with self._addresses_lock:
+            self._addresses.pop(hostname, None)
+
+        with self._join_info_lock:
+            if self._join_address is not None and \
+                    self._join_address[0] == hostname and state != "Running":
+                self._join_address = None
+
+        with self._inventory_lock:
+            if self._inventory is not None:
+                if state is None:
+                    self._inventory.pop(hostname, None)
+                elif hostname in self._inventory:
+                    self._inventory[hostname].state = state
+                elif self.role(hostname) is not None:
+                    self._inventory[hostname] = Host(hostname,
+                        self.role(hostname), self.index(hostname), state)
+
+        if state is None:
+            self.store.remove_host(hostname)
+        elif self.role(hostname) is not None:
+            self.store.update_host(Host(hostname, self.role(hostname),
+                self.index(hostname), state))
+
+
+    def forget_inventory(self):
+        """
+        Forget the cached inventory and addresses, without forgetting
+        what is recorded in the store
+
+        They are read from the store again when needed, including changes
+        recorded by other processes in the meantime.
+        """
+
+        with self._inventory_lock:
+            self._inventory = None
+
+        with self._addresses_lock:
+            self._addresses = {}
+
+
+    def invalidate_inventory(self):
+        with self._inventory_lock:
+            self._inventory = None
+
+        self.store.invalidate_inventory()
+
+
+    @profiling.operation
+    def refresh_store(self):
+        """
+        Record the current state of the Swarm in the store
+
+        Everything recorded is forgotten first. Then the inventory, the
+        LAN IP addresses of running hosts and, if a manager is running,
+        the join tokens are obtained and recorded.
+        """
+
+        self.store.clear()
+        self.invalidate_inventory()
+        self.refresh_join_info()
+        inventory = self.inventory()
+        addresses = self.addresses()
+
+        if self.manager_hostnames(state="Running"):
+            self.join_info("manager")
+            self.join_info("worker")
+
+        hosts = sorted(inventory)
+        width = max([len("HOST")] + [len(hostname) for hostname in hosts])
+        lines = ["{}  {:<8}  {:<8}  {}".format("HOST".ljust(width), "ROLE",
+            "STATE", "ADDRESS")]
+        lines += ["{}  {:<8}  {:<8}  {}".format(hostname.ljust(width),
+            inventory[hostname].role, inventory[hostname].state,
+            addresses.get(hostname, "")) for hostname in hosts]
+        self.write_output("--- hosts ---\n{}\n\n".format("\n".join(lines)))
+
+
     def swarm_hostnames(self,
             state=None):
 
-        filters = []
-        if state:
-            filters.append("state={}".format(state))
-        filters = " ".join(["--filter \"{}\"".format(filter) for filter in
-            filters])
-
-        hosts = str(self.local("docker-machine ls --quiet {}".format(
-            filters), capture=True)).strip()
-        hosts = hosts.split("\n") if hosts else []
+        hosts = [host.name for host in self.inventory().values() if
+            state is None or host.state == state]
 
         # Sort hostnames. Put worker nodes in front of manager nodes. When
         # nodes are stopped / removed this is relevant. A manager node must
         # be stopped / removed last.
-        worker_nodes = [node for node in hosts if
-            node.startswith(self.worker_basename())]
-        manager_nodes = [node for node in hosts if
-            node.startswith(self.manager_basename())]
+        worker_nodes = sorted(node for node in hosts if self.is_worker(node))
+        manager_nodes = [node for node in hosts if self.is_manager(node)]
         # This assumes that the manager with the lowest index is the leader.
         # Everything should work if this isn't the case though.
         manager_nodes.sort()
@@ -117,49 +681,121 @@ class Swarm(object):
         return self.hostname(self.worker_basename(), idx)
 
 
+    def spare_hostname(self,
+            idx):
+        return self.hostname(self.spare_basename(), idx)
+
+
     def manager_hostnames(self,
             state=None):
         return [hostname for hostname in self.swarm_hostnames(state) if
-            not hostname.startswith(self.worker_basename())]
+            self.is_manager(hostname)]
 
 
     def worker_hostnames(self,
             state=None):
+        # Includes spare hosts that have been promoted to workers.
         return [hostname for hostname in self.swarm_hostnames(state) if
-            not hostname.startswith(self.manager_basename())]
+            self.is_worker(hostname)]
 
 
-    def new_manager_hostname(self):
-        hostnames = self.manager_hostnames()
+    def new_hostnames(self,
+            hostname,
+            hostnames,
+            nr_hostnames):
+        """
+        Return nr_hostnames hostnames that are not in hostnames yet
+
+        The hostnames are allocated up front, so hosts can be created
+        concurrently without them ending up with the same name.
+        """
+        hostnames = set(hostnames)
         idx = len(hostnames) + 1
+        result = []
+
+        for n in range(nr_hostnames):
+            while hostname(idx) in hostnames:
+                idx += 1
+
+            hostnames.add(hostname(idx))
+            result.append(hostname(idx))
+
+        return result
+
+
+    def new_manager_hostnames(self,
+            nr_hostnames):
+        return self.new_hostnames(self.manager_hostname,
+            self.manager_hostnames(), nr_hostnames)
+
+
+    def new_worker_hostnames(self,
+            nr_hostnames):
+        # Promoted spare hosts are workers, but keep their name. They don't
+        # take up an index.
+        return self.new_hostnames(self.worker_hostname,
+            [hostname for hostname in self.worker_hostnames() if
+                hostname.startswith(self.worker_basename())], nr_hostnames)
+
+
+    def new_spare_hostnames(self,
+            nr_hostnames):
+        # Promoted spare hosts keep their name.
+        return self.new_hostnames(self.spare_hostname,
+            [hostname for hostname in self.inventory() if
+                hostname.startswith(self.spare_basename())], nr_hostnames)
 
-        while self.manager_hostname(idx) in hostnames:
-            idx += 1
 
-        return self.manager_hostname(idx)
+    def new_manager_hostname(self):
+        return self.new_manager_hostnames(1)[0]
 
 
     def new_worker_hostname(self):
-        hostnames = self.worker_hostnames()
-        idx = len(hostnames) + 1
+        return self.new_worker_hostnames(1)[0]
+
+
+    @profiling.operation
+    def nodes(self):
+        """
+        Return the nodes in the Swarm, by hostname, using a single call
 
-        while self.worker_hostname(idx) in hostnames:
-            idx += 1
+        If no manager node is running, no node is ready, and an empty
+        collection is returned.
+        """
 
-        return self.worker_hostname(idx)
+        if not self.manager_hostnames(state="Running"):
+            return {}
 
+        nodes = {}
 
-    def status_of_node(self,
-            node):
+        for node in self.query_on_manager(Node, "sudo docker node ls"):
+            # A host that left the Swarm and joined it again without its old
+            # node having been removed is listed twice. The ready one is the
+            # current one.
+            if node.hostname not in nodes or node.status == "ready":
+                nodes[node.hostname] = node
+
+        return nodes
+
+
+    def status_of_nodes(self,
+            nodes):
         """
-        This function assumes a manager node is running
+        Return the status of nodes, by hostname, using a single call
+
+        The status of a node that is not part of the Swarm is "down".
         """
 
-        command = "sudo docker node inspect " \
-            "--format='{{{{.Status.State}}}}' {}".format(node)
-        status = self.run_on_manager(command, capture=True).strip()
-        assert status in ["ready", "down"], status
-        return status
+        swarm_nodes = self.nodes()
+
+        return {node: swarm_nodes[node].status if node in swarm_nodes else
+            "down" for node in nodes}
+
+
+    def status_of_node(self,
+            node):
+
+        return self.status_of_nodes([node])[node]
 
 
     def assert_no_swarm_exists(self):
@@ -216,8 +852,10 @@ class Swarm(object):
         #     assert False, self.driver
 
 
-    def create_host(self,
-            hostname):
+    def create_options(self):
+        """
+        Return the options to pass to docker-machine create
+        """
 
         options = [
             "--driver {}".format(self.driver),
@@ -233,77 +871,343 @@ class Swarm(object):
                 "--engine-opt log-driver=syslog",
             )
 
-        self.local("docker-machine create {} {}".format(" ".join(options),
-            hostname), capture=False)
+        if self._registry_mirror_address is not None:
+            options += [
+                "--engine-registry-mirror http://{}".format(
+                    self._registry_mirror_address),
+                "--engine-insecure-registry {}".format(
+                    self._registry_mirror_address),
+            ]
 
-        # self.update_os(hostname)
+        return options
 
 
-    def lan_ip_address(self,
+    @profiling.operation
+    def create_host(self,
             hostname):
 
-        if self.driver == "virtualbox":
-            command = "docker-machine ip {}".format(hostname)
-            result = str(self.local(command, capture=True))
-        else:
-            command = "ifconfig eth0 | " \
-                "grep 'inet ' | cut -d ':' -f 2 | cut -d ' ' -f 1".format(hostname)
-            result = str(self.run_on_node(hostname, command, capture=True))
+        try:
+            if self.use_template:
+                self.clone_host(hostname)
+            else:
+                self.local("docker-machine create {} {}".format(
+                    " ".join(self.create_options()), hostname),
+                    capture=False)
+        except:
+            # A failed create may leave a host behind, or not.
+            self.invalidate_inventory()
+            raise
 
-        assert result, command
+        self.update_inventory(hostname, "Running")
 
-        return result
+        # self.update_os(hostname)
 
 
-    def run_on_node(self,
-            node,
-            command,
-            capture):
+    def template_hostname(self):
+        return self.host_basename("template")
 
-        # if self.driver == "virtualbox":
-        #     with settings(
-        #             host_string=self.ip_address(node),
-        #             user="docker",
-        #             password="tcuser",
-        #             shell="/bin/sh -c"):
-        #         result = run(command)
-        # elif self.driver == "amazonec2":
-        #     with settings(
-        #             host_string=self.ip_address(node),
-        #             # TODO Actually, this depends on the AMI, not the driver.
-        #             user="ubuntu",
-        #             key_filename=[
-        #                 os.path.join(os.environ["HOME"],
-        #                     ".docker/machine/machines/{}/id_rsa".format(node))
-        #             ],
-        #             shell="/bin/sh -c"):
-        #         result = run(command)
-        # else:
-        #     assert False, self.driver
 
-        command = "docker-machine ssh {} {}".format(node, command)
+    @profiling.operation
+    def create_template(self):
+        """
+        Create the host that other hosts are cloned from, if it does not
+        exist yet
 
-        result = self.local(command, capture=capture)
+        The template is a regular Docker Machine host. It is stopped, and
+        a snapshot of it is taken, which linked clones are based on. The
+        template must not be removed as long as clones of it exist.
+        """
 
-        return result
+        template = self.template_hostname()
+        marker_pathname = os.path.join(machine_directory(template),
+            "docker_base-template")
 
+        with self._template_lock:
+            if os.path.exists(marker_pathname):
+                return template
 
-    def run_on_manager(self,
-            command,
-            capture):
-        """
-        This function assumes a manager node is running
-        """
+            if machine_configuration(template) is not None:
+                # Left behind by an earlier attempt that failed.
+                self.local("docker-machine rm -f {}".format(template),
+                    capture=False)
 
-        # Just pick one of the managers.
-        # TODO Detect which one is running and active.
-        manager_hostname = self.manager_hostnames(state="Running")[-1]
+            self.local("docker-machine create {} {}".format(
+                " ".join(self.create_options()), template), capture=False)
+            self.local("docker-machine stop {}".format(template),
+                capture=False)
+            self.local("VBoxManage snapshot {} take docker_base".format(
+                template), capture=False)
 
-        return self.run_on_node(manager_hostname, command, capture)
+            with open(marker_pathname, "w") as file:
+                file.write("{}\n".format(template))
 
+            return template
 
-    def configure_aws_security_group(self):
-        # The default security group on AWS is named 'docker-machine'.
+
+    def free_port(self):
+        """
+        Return a TCP port on the loopback interface that is not in use
+        """
+
+        # Imported here, importing it takes relatively long.
+        import socket
+
+        with contextlib.closing(socket.socket()) as socket_:
+            socket_.bind(("127.0.0.1", 0))
+
+            return socket_.getsockname()[1]
+
+
+    @profiling.operation
+    def clone_host(self,
+            hostname):
+        """
+        Create a host as a linked clone of the template host
+
+        The Docker Machine directory of the template is copied, without
+        its disks, and adjusted to the new host. The clone gets its own
+        SSH port. Once it has started, it is provisioned again, which sets
+        its hostname and generates new certificates.
+        """
+
+        # Imported here, importing it takes relatively long.
+        import shutil
+
+        template = self.create_template()
+        template_directory = machine_directory(template)
+        directory = machine_directory(hostname)
+        port = self.free_port()
+
+        os.makedirs(directory)
+
+        for name in os.listdir(template_directory):
+            pathname = os.path.join(template_directory, name)
+
+            if os.path.isfile(pathname) and name not in [
+                    "config.json", "docker_base-template"] and \
+                    not name.endswith((".vmdk", ".iso")):
+                shutil.copy2(pathname, directory)
+
+        with open(os.path.join(template_directory, "config.json")) as file:
+            configuration = json.loads(file.read().replace(
+                template_directory, directory))
+
+        configuration["Name"] = hostname
+        configuration["Driver"]["MachineName"] = hostname
+        configuration["Driver"]["SSHPort"] = port
+        configuration["Driver"]["IPAddress"] = ""
+
+        if self._registry_mirror_address is not None:
+            # Applied to the engine when the clone is provisioned.
+            engine_options = configuration.setdefault("HostOptions",
+                {}).setdefault("EngineOptions", {})
+            engine_options["RegistryMirror"] = ["http://{}".format(
+                self._registry_mirror_address)]
+            engine_options["InsecureRegistry"] = [
+                self._registry_mirror_address]
+
+        with open(os.path.join(directory, "config.json"), "w") as file:
+            json.dump(configuration, file, indent=4)
+
+        self.local("VBoxManage clonevm {} --snapshot docker_base "
+            "--options link --name {} --basefolder {} --register".format(
+                template, hostname, shlex.quote(directory)), capture=False)
+        self.local("VBoxManage modifyvm {} --natpf1 delete ssh".format(
+            hostname), capture=False)
+        self.local("VBoxManage modifyvm {} --natpf1 "
+            "ssh,tcp,127.0.0.1,{},,22".format(hostname, port),
+            capture=False)
+        self.local("docker-machine start {}".format(hostname), capture=False)
+        self.local("docker-machine provision {}".format(hostname),
+            capture=False)
+
+
+    def known_addresses(self,
+            hostnames):
+        """
+        Return the addresses of hosts that are cached or recorded in the
+        store, by hostname
+        """
+
+        with self._addresses_lock:
+            addresses = {hostname: self._addresses[hostname] for hostname in
+                hostnames if hostname in self._addresses}
+
+        if len(addresses) < len(hostnames):
+            stored_addresses = self.store.addresses()
+            stored_addresses = {hostname: stored_addresses[hostname] for
+                hostname in hostnames if hostname not in addresses and
+                hostname in stored_addresses}
+
+            with self._addresses_lock:
+                self._addresses.update(stored_addresses)
+
+            addresses.update(stored_addresses)
+
+        return addresses
+
+
+    def set_addresses(self,
+            addresses):
+        with self._addresses_lock:
+            self._addresses.update(addresses)
+
+        self.store.set_addresses(addresses)
+
+
+    def parse_lan_ip_address(self,
+            hostname,
+            output):
+        """
+        Return the address in the output of lan_ip_address_command
+        """
+
+        fields = str(output).split()
+
+        if "src" not in fields[:-1]:
+            raise RuntimeError("Cannot determine the address of {} from: "
+                "{}".format(hostname, output))
+
+        return fields[fields.index("src") + 1]
+
+
+    @profiling.operation
+    def addresses(self,
+            hostnames=None):
+        """
+        Return the LAN IP addresses of hosts, by hostname
+
+        By default, the addresses of all running hosts in the Swarm are
+        returned. Addresses are cached and recorded in the store. Those
+        not known yet are obtained in bulk. For the virtualbox driver,
+        they are part of the output of a single call to docker-machine
+        ls. For other drivers, ip is executed on the hosts concurrently.
+        """
+
+        if hostnames is None:
+            hostnames = self.swarm_hostnames(state="Running")
+
+        addresses = self.known_addresses(hostnames)
+        missing_hostnames = [hostname for hostname in hostnames if hostname
+            not in addresses]
+
+        if missing_hostnames:
+            if self.driver == "virtualbox":
+                new_addresses = self.parse_addresses(self.local(
+                    self.inventory_command, capture=True))
+            else:
+                def lan_ip_address(
+                        hostname):
+                    return self.parse_lan_ip_address(hostname,
+                        self.run_on_node(hostname,
+                            self.lan_ip_address_command, capture=True))
+
+                new_addresses = dict(parallel.map_unordered(lan_ip_address,
+                    missing_hostnames, self.nr_parallel))
+
+            self.set_addresses(new_addresses)
+            addresses.update(new_addresses)
+
+        for hostname in hostnames:
+            if hostname not in addresses:
+                raise RuntimeError("Host {} has no address, is it "
+                    "running?".format(hostname))
+
+        return {hostname: addresses[hostname] for hostname in hostnames}
+
+
+    def lan_ip_address(self,
+            hostname):
+        return self.addresses([hostname])[hostname]
+
+
+    def run_on_node(self,
+            node,
+            command,
+            capture):
+
+        # The command is executed by the shell on the node, over a
+        # connection that is shared with other commands on the same node.
+        command = self.connections.command(node, command)
+
+        result = self.local(command, capture=capture, node=node)
+
+        return result
+
+
+    @profiling.operation
+    def run_on_node_prefixed(self,
+            node,
+            command,
+            prefix):
+        """
+        Execute command on node, printing each line of its output
+        prefixed by prefix
+
+        The exit code of the command is returned.
+        """
+
+        command = self.connections.command(node, command)
+
+        return self.local_prefixed(command, prefix, node=node)
+
+
+    def stream_on_node(self,
+            node,
+            command,
+            spool_pathname=None):
+        """
+        Execute command on node, returning a generator yielding its
+        standard output while it runs
+
+        See local_stream().
+        """
+
+        command = self.connections.command(node, command)
+
+        return self.local_stream(command, node=node,
+            spool_pathname=spool_pathname)
+
+
+    def stream_on_nodes(self,
+            command,
+            nodes,
+            spool_directory=None):
+        """
+        Execute command on nodes, returning a generator per node yielding
+        the standard output of the command executed on it
+
+        A command is started when its first line of output is requested.
+        To execute them concurrently, consume the generators in multiple
+        threads. If spool_directory is passed, the output of each node is
+        written to <node>.log in that directory as well.
+        """
+
+        if spool_directory is not None:
+            os.makedirs(spool_directory, exist_ok=True)
+
+        return {node: self.stream_on_node(node, command,
+            spool_pathname=None if spool_directory is None else
+                os.path.join(spool_directory, "{}.log".format(node))) for
+            node in nodes}
+
+
+    def run_on_manager(self,
+            command,
+            capture):
+        """
+        This function assumes a manager node is running
+        """
+
+        # Just pick one of the managers.
+        # TODO Detect which one is running and active.
+        manager_hostname = self.manager_hostnames(state="Running")[-1]
+
+        return self.run_on_node(manager_hostname, command, capture)
+
+
+    def configure_aws_security_group(self):
+        # The default security group on AWS is named 'docker-machine'.
         # To configure it, we need the group-id.
 
         command = "aws ec2 describe-security-groups --query " \
@@ -379,6 +1283,7 @@ class Swarm(object):
                 self.local(command, capture=False)
 
 
+    @profiling.operation
     def init_swarm(self,
             manager_hostname):
 
@@ -386,6 +1291,7 @@ class Swarm(object):
         command = "sudo docker swarm init --advertise-addr {}:2377".format(
             manager_ip_address)
         self.run_on_node(manager_hostname, command, capture=False)
+        self.refresh_join_info()
 
         if self.driver == "amazonec2":
             self.configure_aws_security_group()
@@ -393,14 +1299,58 @@ class Swarm(object):
 
     def join_info(self,
             node_type):
+        """
+        Return the join token for node_type and the LAN IP address of the
+        manager to join through
+
+        These are obtained from the store, or else from a manager, and
+        cached. Call refresh_join_info() when they may have changed
+        outside of this instance.
+        """
+
+        with self._join_info_lock:
+            if node_type not in self._join_tokens:
+                token = self.store.join_token(node_type)
+
+                if token is None:
+                    command = "sudo docker swarm join-token --quiet " \
+                        "{}".format(node_type)
+                    token = self.run_on_manager(command, capture=True).strip()
+                    assert token
+                    self.store.set_join_token(node_type, token)
+
+                self._join_tokens[node_type] = token
+
+            if self._join_address is None:
+                manager_hostname = self.manager_hostnames(
+                    state="Running")[-1]
+                self._join_address = (manager_hostname,
+                    self.lan_ip_address(manager_hostname))
+
+            return self._join_tokens[node_type], self._join_address[1]
+
+
+    def refresh_join_info(self):
+        with self._join_info_lock:
+            self._join_tokens = {}
+            self._join_address = None
+            self.store.clear_join_tokens()
+
+
+    def rotate_join_token(self,
+            node_type):
+        """
+        Replace the join token for node_type by a new one
+        """
 
-        command = "sudo docker swarm join-token --quiet {}".format(node_type)
+        command = "sudo docker swarm join-token --quiet --rotate {}".format(
+            node_type)
         token = self.run_on_manager(command, capture=True).strip()
         assert token
-        manager_ip_address = self.lan_ip_address(self.manager_hostnames(
-            state="Running")[-1])
 
-        return token, manager_ip_address
+        with self._join_info_lock:
+            self._join_tokens[node_type] = token
+            self.store.set_join_token(node_type, token)
 
 
     def manager_join_info(self):
@@ -411,6 +1361,7 @@ class Swarm(object):
         return self.join_info("worker")
 
 
+    @profiling.operation
     def add_node_to_swarm(self,
             hostname,
             join_token,
@@ -434,57 +1385,285 @@ class Swarm(object):
         self.add_node_to_swarm(hostname, *self.worker_join_info())
 
 
+    @profiling.operation
+    def provision_nodes(self,
+            manager_hostnames,
+            worker_hostnames,
+            init_swarm=False):
+        """
+        Create hosts and add them to the Swarm
+
+        At most nr_parallel hosts are created at the same time. Hosts are
+        added to the Swarm as soon as possible:
+
+        - If init_swarm is True, the first manager initializes the Swarm
+          and nothing joins before that has happened.
+        - Managers join one at a time, in the order passed in. Each new
+          manager must be part of the Raft quorum before the next one
+          joins.
+        - Workers join as soon as their host has been created.
+        """
+        managers_to_join = list(manager_hostnames)
+        workers_to_join = []
+        created_hostnames = set()
+        swarm_exists = not init_swarm
+
+        for hostname, _ in parallel.map_unordered(self.create_host,
+                list(manager_hostnames) + list(worker_hostnames),
+                self.nr_parallel):
+
+            created_hostnames.add(hostname)
+
+            if self.is_worker(hostname):
+                workers_to_join.append(hostname)
+
+            if not swarm_exists:
+                if managers_to_join[0] not in created_hostnames:
+                    continue
+
+                self.init_swarm(managers_to_join.pop(0))
+                swarm_exists = True
+
+            while managers_to_join and \
+                    managers_to_join[0] in created_hostnames:
+                self.add_manager_to_swarm(managers_to_join.pop(0))
+
+            while workers_to_join:
+                self.add_worker_to_swarm(workers_to_join.pop(0))
+
+        assert not managers_to_join, managers_to_join
+        assert not workers_to_join, workers_to_join
+
+
     def add_manager_nodes(self,
-            nr_nodes):
+            nr_nodes,
+            images=None):
+        """
+        Add nr_nodes manager nodes to the Swarm
+
+        Once all of them have joined, the images passed in are copied to
+        them, see prefetch_images().
+        """
 
         self.assert_swarm_exists()
 
+        if self.registry_mirror:
+            self.ensure_registry_mirror()
+
         nr_nodes = int(nr_nodes)
+        hostnames = self.new_manager_hostnames(nr_nodes)
+        self.provision_nodes(hostnames, [])
 
-        for m in range(nr_nodes):
-            manager_hostname = self.new_manager_hostname()
-            self.create_host(manager_hostname)
-            self.add_manager_to_swarm(manager_hostname)
+        if images:
+            self.prefetch_images(images, hostnames)
 
 
     def add_worker_nodes(self,
-            nr_nodes):
+            nr_nodes,
+            images=None):
+        """
+        Add nr_nodes worker nodes to the Swarm
+
+        Hosts are taken from the pool of spare hosts first. Once all of
+        them have joined, the images passed in are copied to them, see
+        prefetch_images().
+        """
 
         self.assert_swarm_exists()
 
+        if self.registry_mirror:
+            self.ensure_registry_mirror()
+
         nr_nodes = int(nr_nodes)
 
-        for n in range(nr_nodes):
-            worker_hostname = self.new_worker_hostname()
-            self.create_host(worker_hostname)
-            self.add_worker_to_swarm(worker_hostname)
+        # Take hosts from the pool of spare hosts first, if any. Only
+        # the remaining hosts are created.
+        nr_spares = len(self.spare_hostnames())
+        spares = self.take_spares(nr_nodes)
+        hostnames = self.new_worker_hostnames(nr_nodes - len(spares))
+        self.provision_nodes([], hostnames)
+
+        if images:
+            self.prefetch_images(images, spares + hostnames)
+
+        if spares:
+            self.fill_pool_in_background(nr_spares)
+
+
+    def spare_hostnames(self,
+            state=None):
+        """
+        Return the hostnames of the hosts in the pool of spare hosts
+        """
+
+        return self.sort_by_index([host.name for host in
+            self.inventory().values() if host.role == "spare" and
+                (state is None or host.state == state)])
+
+
+    @profiling.operation
+    def create_spare(self,
+            hostname):
+
+        self.create_host(hostname)
+        self.local("docker-machine stop {}".format(hostname), capture=False)
+        self.update_inventory(hostname, "Stopped")
+
+
+    @profiling.operation
+    def fill_pool(self,
+            nr_spares):
+        """
+        Create spare hosts until the pool contains nr_spares hosts
+
+        Spare hosts are fully provisioned and then stopped. They are not
+        part of the Swarm. At most nr_parallel hosts are created at the
+        same time.
+        """
+
+        nr_spares = int(nr_spares)
+        assert nr_spares >= 0, nr_spares
+
+        if self.registry_mirror:
+            self.ensure_registry_mirror()
+
+        hostnames = self.new_spare_hostnames(
+            max(nr_spares - len(self.spare_hostnames()), 0))
+        parallel.run_phases(self.create_spare, [hostnames], self.nr_parallel)
+
+
+    def fill_pool_in_background(self,
+            nr_spares):
+        """
+        Fill the pool of spare hosts up to nr_spares hosts, in a process
+        that keeps running after this one has finished
+
+        Output is appended to a log file in the Docker Machine storage
+        directory.
+        """
+
+        log_pathname = os.path.join(machine_storage_path(),
+            "docker_base-{}-pool.log".format(self.host_prefix))
+        package_directory = os.path.dirname(os.path.dirname(
+            os.path.abspath(__file__)))
+        environment = dict(os.environ)
+        environment["PYTHONPATH"] = os.pathsep.join([package_directory] +
+            ([environment["PYTHONPATH"]] if "PYTHONPATH" in environment else
+                []))
+        command = [sys.executable, "-c",
+            "import sys; from docker_base import swarm_fabfile; "
+            "swarm_fabfile.fill_pool(*sys.argv[1:5], "
+            "use_template=sys.argv[5] == 'True', "
+            "registry_mirror=sys.argv[6] or None)",
+            self.driver, self.host_prefix, str(nr_spares),
+            str(self.nr_parallel), str(self.use_template),
+            self.registry_mirror or ""]
+
+        self.print_status("refilling pool of spare hosts in the "
+            "background, see {}".format(log_pathname))
+
+        with open(log_pathname, "a") as log_file, \
+                open(os.devnull) as devnull:
+            subprocess.Popen(command, env=environment, stdin=devnull,
+                stdout=log_file, stderr=subprocess.STDOUT,
+                start_new_session=True)
+
+
+    def promote_spare(self,
+            hostname):
+        """
+        Turn a spare host into a worker
+        """
+
+        with open(self.role_pathname(hostname), "w") as file:
+            file.write("worker\n")
+
+        with self._inventory_lock:
+            if self._inventory is not None and hostname in self._inventory:
+                self._inventory[hostname].role = "worker"
+                self.store.update_host(self._inventory[hostname])
+
+
+    @profiling.operation
+    def take_spares(self,
+            nr_spares):
+        """
+        Take at most nr_spares hosts from the pool of spare hosts, start
+        them and add them to the Swarm as workers
+
+        Returns the hostnames of the hosts taken.
+        """
+
+        hostnames = self.spare_hostnames(state="Stopped")[:int(nr_spares)]
+
+        for hostname in hostnames:
+            self.promote_spare(hostname)
+
+        parallel.run_phases(self.start_node, [hostnames], self.nr_parallel)
+        self.join_swarm_nodes(hostnames)
+
+        return hostnames
+
+
+    def status_of_pool(self):
+        hostnames = self.spare_hostnames()
+        inventory = self.inventory()
+        width = max([len("HOST")] + [len(hostname) for hostname in
+            hostnames])
+        lines = ["{}  {}".format("HOST".ljust(width), "STATE")]
+        lines += ["{}  {}".format(hostname.ljust(width),
+            inventory[hostname].state) for hostname in hostnames]
+        self.write_output("--- spare hosts ---\n{}\n\n".format(
+            "\n".join(lines)))
+
+
+    def drain_pool(self):
+        """
+        Remove all hosts from the pool of spare hosts
+        """
+
+        parallel.run_phases(self.remove_node, [self.spare_hostnames()],
+            self.nr_parallel)
+
+
+    def assert_nodes_have_status(self,
+            nodes,
+            status):
+
+        status_of_nodes = self.status_of_nodes(nodes)
+
+        for node in nodes:
+            if status_of_nodes[node] != status:
+                raise RuntimeError("Node {} is not {}...".format(node, status))
 
 
     def assert_node_has_status(self,
             node,
             status):
-        """
-        This function assumes a manager node is running
-        """
 
-        if self.status_of_node(node) != status:
-            raise RuntimeError("Node {} is not {}...".format(node, status))
+        self.assert_nodes_have_status([node], status)
+
+
+    def assert_nodes_are_ready(self,
+            nodes):
+
+        self.assert_nodes_have_status(nodes, "ready")
+
+
+    def assert_nodes_are_down(self,
+            nodes):
+
+        self.assert_nodes_have_status(nodes, "down")
 
 
     def assert_node_is_ready(self,
             node):
-        """
-        This function assumes a manager node is running
-        """
 
         self.assert_node_has_status(node, "ready")
 
 
     def assert_node_is_down(self,
             node):
-        """
-        This function assumes a manager node is running
-        """
 
         self.assert_node_has_status(node, "down")
 
@@ -505,11 +1684,41 @@ class Swarm(object):
 
     def node_is_down(self,
             node):
+
+        return self.status_of_node(node) == "down"
+
+
+    @profiling.operation
+    def wait_until_nodes_are_down(self,
+            nodes,
+            timeout=300):
         """
-        This function assumes a manager node is running
+        Wait until the Swarm managers have noticed that nodes are down
+
+        The status of all nodes is checked using a single call per
+        attempt. The first attempts follow each other quickly. The time
+        between attempts grows exponentially, up to 10 seconds.
+
+        This function fails if not all nodes are down within timeout
+        seconds.
         """
 
-        return self.status_of_node(node) == "down"
+        deadline = time.time() + timeout
+        interval = 0.5
+        nodes = list(nodes)
+
+        while nodes:
+            status = self.status_of_nodes(nodes)
+            nodes = [node for node in nodes if status[node] != "down"]
+
+            if nodes:
+                if time.time() >= deadline:
+                    raise RuntimeError(
+                        "Nodes {} are not down after {} seconds...".format(
+                            ", ".join(nodes), timeout))
+
+                time.sleep(min(interval, max(deadline - time.time(), 0)))
+                interval = min(2 * interval, 10)
 
 
     def join_swarm(self,
@@ -520,107 +1729,543 @@ class Swarm(object):
             self.add_worker_to_swarm(node)
 
 
-    def leave_swarm(self,
-            node):
-        if self.is_manager(node):
-            command = "sudo docker swarm leave --force"
-        elif self.is_worker(node):
-            command = "sudo docker swarm leave"
+    def join_swarm_nodes(self,
+            nodes):
+        """
+        Add started nodes to the Swarm
+
+        Join credentials are looked up once for the whole batch. Managers
+        join one at a time, in the order passed in. After that, at most
+        nr_parallel workers join at the same time.
+        """
+
+        managers = [node for node in nodes if self.is_manager(node)]
+        workers = [node for node in nodes if self.is_worker(node)]
+
+        if managers:
+            join_info = self.manager_join_info()
+
+            for node in managers:
+                self.add_node_to_swarm(node, *join_info)
+
+        if workers:
+            join_info = self.worker_join_info()
+
+            for _ in parallel.map_unordered(
+                    lambda node: self.add_node_to_swarm(node, *join_info),
+                    workers, self.nr_parallel):
+                pass
+
+
+    def leave_swarm(self,
+            node):
+        if self.is_manager(node):
+            command = "sudo docker swarm leave --force"
+        elif self.is_worker(node):
+            command = "sudo docker swarm leave"
+
+        self.run_on_node(node, command, capture=False)
+
+
+    @profiling.operation
+    def create(self,
+            nr_managers,
+            nr_workers):
+        """
+        Create a Swarm with one or more manager nodes and zero or more
+        worker nodes
+
+        First a manager node is created which is used to initialize the
+        Swarm. After that, the other manager nodes are created and added to
+        the Swarm. Then the worker nodes are created and added to the Swarm.
+        At most nr_parallel hosts are created at the same time, see
+        provision_nodes().
+
+        This function fails if a Swarm already exists.
+        """
+
+        self.assert_no_swarm_exists()
+
+        nr_managers = int(nr_managers)
+        assert nr_managers >= 1
+        nr_workers = int(nr_workers)
+
+        manager_hostnames = self.new_manager_hostnames(nr_managers)
+        worker_hostnames = self.new_worker_hostnames(nr_workers)
+
+        if self.registry_mirror:
+            # The other hosts are configured to use the registry mirror,
+            # which runs on the first manager. It must exist first.
+            self.provision_nodes(manager_hostnames[:1], [], init_swarm=True)
+            self.ensure_registry_mirror()
+            self.provision_nodes(manager_hostnames[1:], worker_hostnames)
+        else:
+            # Create all hosts. The first Swarm manager initializes the
+            # Swarm. The other manager and worker nodes are added to it.
+            self.provision_nodes(manager_hostnames, worker_hostnames,
+                init_swarm=True)
+
+
+        # sys.stdout.write("Use this command to connect to the Swarm:\n\n{}\n".format(
+        #     "    eval $(docker-machine env {})".format(manager_hostname_)))
+
+
+    def registry_mirror_address(self):
+        """
+        Return the address (host:port) of the registry mirror running in
+        the Swarm, or None if it is not running
+
+        This function assumes a manager node is running
+        """
+
+        # Tasks that have been shut down are listed too, possibly on nodes
+        # that have been removed.
+        command = "sudo docker service ps --filter desired-state=running " \
+            "--format '{{.Node}}' registry-mirror"
+
+        try:
+            hostnames = self.run_on_manager(command, capture=True).split()
+        except RuntimeError as exception:
+            # Other errors don't mean there is no mirror. Creating the
+            # service would fail on the existing name.
+            if "no such service" not in str(exception).lower():
+                raise
+
+            return None
+
+        if not hostnames:
+            return None
+
+        return "{}:5000".format(self.lan_ip_address(hostnames[0]))
+
+
+    @profiling.operation
+    def ensure_registry_mirror(self):
+        """
+        Make sure a registry mirror runs in the Swarm and return its
+        address (host:port)
+
+        The mirror is a pull-through cache of the registry at the URL in
+        registry_mirror. It runs as a service named registry-mirror, on
+        the first manager, publishing port 5000 on that host. Hosts
+        created afterwards use it as their registry mirror. Then, each
+        image is downloaded from the upstream registry only once.
+
+        This function assumes a manager node is running
+        """
+
+        with self._registry_mirror_lock:
+            if self._registry_mirror_address is None:
+                address = self.registry_mirror_address()
+
+                if address is None:
+                    manager_hostname = self.sort_by_index(
+                        self.manager_hostnames(state="Running"))[0]
+                    command = "sudo docker service create --detach " \
+                        "--name registry-mirror " \
+                        "--constraint node.hostname=={} " \
+                        "--publish mode=host,target=5000,published=5000 " \
+                        "--env REGISTRY_PROXY_REMOTEURL={} " \
+                        "registry:2".format(manager_hostname,
+                            shlex.quote(self.registry_mirror))
+                    self.run_on_manager(command, capture=False)
+                    address = "{}:5000".format(
+                        self.lan_ip_address(manager_hostname))
+
+                self._registry_mirror_address = address
+
+            return self._registry_mirror_address
+
+
+    def query_on_manager(self,
+            record_type,
+            command):
+        """
+        Execute a Docker command that lists objects on a manager, and
+        return the objects as records of type record_type
+
+        The command is made to format each object as JSON, on a line of
+        its own.
+
+        This function assumes a manager node is running
+        """
+
+        command = "{} --format '{{{{json .}}}}'".format(command)
+        lines = self.run_on_manager(command, capture=True).strip()
+        lines = lines.split("\n") if lines else []
+
+        return [record_type.from_json(json.loads(line)) for line in lines]
+
+
+    def services(self):
+        """
+        This function assumes a manager node is running
+        """
+
+        return self.query_on_manager(Service, "sudo docker service ls")
+
+
+    def tasks(self,
+            service_name):
+        """
+        This function assumes a manager node is running
+        """
+
+        return self.query_on_manager(Task,
+            "sudo docker service ps {}".format(service_name))
+
+
+    def networks(self):
+        """
+        This function assumes a manager node is running
+        """
+
+        return self.query_on_manager(Network, "sudo docker network ls")
+
+
+    def run_for_services_on_manager(self,
+            command,
+            service_names=None,
+            prologue=None):
+        """
+        Execute command for each service, using a single call to a manager
+
+        The command is executed by the shell on the manager, with the name
+        of the current service stored in $name. If no service names are
+        passed, the command is executed for all services. If a prologue
+        command is passed, it is executed once, before the others.
+
+        Returns the output of the prologue command and, by service name, a
+        tuple of the exit code and the output (standard output and
+        standard error) of the command.
+
+        This function assumes a manager node is running
+        """
+
+        # Imported here, importing it takes relatively long.
+        import uuid
+
+        # Lines starting with this marker separate the output per service.
+        marker = "--- {} ---".format(uuid.uuid4().hex)
+
+        if service_names is None:
+            names = "$(sudo docker service ls --format '{{.Name}}')"
+        else:
+            names = " ".join(shlex.quote(name) for name in service_names)
+
+        script = "for name in {names}; do " \
+            "echo \"{marker} begin $name\"; " \
+            "{command} 2>&1; " \
+            "echo \"{marker} end $name $?\"; " \
+            "done".format(names=names, marker=marker, command=command)
+
+        if prologue is not None:
+            script = "{} && {}".format(prologue, script)
+
+        lines = self.run_on_manager(script, capture=True).split("\n")
+        prologue_lines = []
+        service_name = None
+        output = []
+        results = collections.OrderedDict()
+
+        for line in lines:
+            if line.startswith(marker):
+                words = line[len(marker):].split()
+
+                if words[0] == "begin":
+                    service_name = words[1]
+                    output = []
+                else:
+                    assert words[0] == "end", line
+                    assert words[1] == service_name, line
+                    results[service_name] = (int(words[2]),
+                        "\n".join(output))
+                    service_name = None
+            elif service_name is not None:
+                output.append(line)
+            elif not results:
+                prologue_lines.append(line)
+
+        return "\n".join(prologue_lines), results
+
+
+    def write_json(self,
+            object):
+        self.write_output("{}\n".format(json.dumps(object, indent=4,
+            sort_keys=True)))
+
+
+    @profiling.operation
+    def status(self,
+            as_json=False):
+        self.assert_swarm_is_running()
+
+        # The listings of nodes and networks are obtained concurrently.
+        if as_json:
+            nodes, networks = [result for _, result in parallel.map_ordered(
+                lambda query: query(), [self.nodes, self.networks], 2)]
+            self.write_json({
+                "nodes": [node.as_dict() for node in nodes.values()],
+                "networks": [network.as_dict() for network in networks],
+            })
+            return
+
+        nodes, networks = [result for _, result in parallel.map_ordered(
+            lambda command: self.run_on_manager(command, capture=True),
+            ["sudo docker node ls", "sudo docker network ls"], 2)]
+        self.write_output("--- nodes ---\n{}\n\n".format(nodes))
+        self.write_output("--- networkѕ ---\n{}\n\n".format(networks))
+
+
+    def service_names(self):
+        return [service.name for service in self.services()]
+
+
+    @profiling.operation
+    def status_of_services(self,
+            service_names,
+            as_json=False):
+        """
+        Print information about services and their tasks
+
+        All information is obtained using a single call to a manager.
+        If no service names are passed, all services are inspected.
+        """
+
+        self.assert_swarm_is_running()
+
+        if as_json:
+            listing, results = self.run_for_services_on_manager(
+                "sudo docker service ps --format '{{json .}}' \"$name\"",
+                service_names or None,
+                prologue="sudo docker service ls --format '{{json .}}'")
+        else:
+            listing, results = self.run_for_services_on_manager(
+                "sudo docker service ps \"$name\"",
+                service_names or None,
+                prologue=None if service_names else "sudo docker service ls")
+
+        failed_names = [name for name in results if results[name][0] != 0]
+
+        if failed_names:
+            raise RuntimeError("\n".join(["failed to inspect services:"] +
+                [results[name][1] for name in failed_names]))
+
+        if as_json:
+            services = [Service.from_json(json.loads(line)) for line in
+                listing.split("\n") if line]
+            services = [service for service in services if
+                service.name in results]
+            tasks = dict((name, [Task.from_json(json.loads(line)).as_dict()
+                for line in results[name][1].split("\n") if line]) for
+                name in results)
+
+            self.write_json({
+                "services": [service.as_dict() for service in services],
+                "tasks": tasks,
+            })
+        else:
+            if not service_names:
+                self.write_output("--- services ---\n{}\n\n".format(listing))
+
+            for service_name in results:
+                self.write_output("--- {} ---\n{}\n\n".format(service_name,
+                    results[service_name][1]))
+
+
+    def select_services(self,
+            selectors,
+            regex=False):
+        """
+        Return the names of the services selected by selectors
+
+        Selectors are glob patterns, or regular expressions if regex is
+        True. Services are listed at most once. Selectors without
+        wildcards are names of services and are used as is.
+
+        This function assumes a manager node is running
+        """
+
+        if regex:
+            patterns = [re.compile(selector) for selector in selectors]
+            is_selected = lambda name: \
+                any(pattern.fullmatch(name) for pattern in patterns)
+        else:
+            # Imported here, importing it takes relatively long.
+            import fnmatch
+
+            is_selected = lambda name: \
+                any(fnmatch.fnmatchcase(name, selector) for selector in
+                    selectors)
+
+        if not regex and not any(set("*?[") & set(selector) for selector in
+                selectors):
+            names = []
+        else:
+            names = self.service_names()
+
+        selected_names = [name for name in names if is_selected(name)]
+
+        if not regex:
+            for selector in selectors:
+                if not set("*?[") & set(selector) and \
+                        selector not in selected_names:
+                    selected_names.append(selector)
+
+        return selected_names
+
+
+    @profiling.operation
+    def run_service_operation(self,
+            command,
+            service_names):
+        """
+        Execute command for each service, using a single call to a manager
+
+        A summary of the result per service is printed. This function
+        fails if the command failed for any of the services.
+
+        This function assumes a manager node is running
+        """
+
+        if not service_names:
+            return
+
+        _, results = self.run_for_services_on_manager(command, service_names)
+
+        width = max([len("SERVICE")] + [len(name) for name in results])
+        lines = ["{}  {}".format("SERVICE".ljust(width), "RESULT")]
+
+        for name in results:
+            exit_code, output = results[name]
+            lines.append("{}  {}".format(name.ljust(width), "ok" if
+                exit_code == 0 else "failed: {}".format(
+                    " ".join(output.split()))))
+
+        self.write_output("--- summary ---\n{}\n\n".format("\n".join(lines)))
+
+        failed_names = [name for name in results if results[name][0] != 0]
+
+        if failed_names:
+            raise RuntimeError(
+                "Operation failed for {} of {} services: {}".format(
+                    len(failed_names), len(results), ", ".join(failed_names)))
 
-        self.run_on_node(node, command, capture=False)
 
+    def remove_services(self,
+            service_names,
+            regex=False):
+        self.assert_swarm_is_running()
 
-    def create(self,
-            nr_managers,
-            nr_workers):
-        """
-        Create a Swarm with one or more manager nodes and zero or more
-        worker nodes
+        service_names = self.select_services(service_names, regex)
+        self.run_service_operation("sudo docker service rm \"$name\"",
+            service_names)
 
-        First a manager node is created which is used to initialize the
-        Swarm. After that, the other manager nodes are created and added to
-        the Swarm. Then the worker nodes are created and added to the Swarm.
 
-        This function fails if a Swarm already exists.
-        """
+    def scale_services(self,
+            service_names,
+            nr_replicas,
+            regex=False):
+        self.assert_swarm_is_running()
 
-        self.assert_no_swarm_exists()
+        nr_replicas = int(nr_replicas)
+        assert nr_replicas >= 0, nr_replicas
 
-        nr_managers = int(nr_managers)
-        assert nr_managers >= 1
-        nr_workers = int(nr_workers)
+        service_names = self.select_services(service_names, regex)
+        self.run_service_operation(
+            "sudo docker service scale \"$name\"={}".format(nr_replicas),
+            service_names)
 
 
-        # Create and configure the first Swarm manager. Initialize the Swarm.
-        manager_hostname_ = self.new_manager_hostname()
-        self.create_host(manager_hostname_)
-        self.init_swarm(manager_hostname_)
+    def update_service_images(self,
+            service_names,
+            image,
+            regex=False):
+        self.assert_swarm_is_running()
 
+        service_names = self.select_services(service_names, regex)
+        self.run_service_operation(
+            "sudo docker service update --image {} \"$name\"".format(
+                shlex.quote(image)),
+            service_names)
 
-        # Add manager and worker nodes. Add them to the Swarm.
-        self.add_manager_nodes(nr_managers - 1)
-        self.add_worker_nodes(nr_workers)
 
+    @profiling.operation
+    def remove_nodes_from_swarm(self,
+            nodes):
+        """
+        Remove nodes that have left the Swarm from the list of nodes
 
-        # sys.stdout.write("Use this command to connect to the Swarm:\n\n{}\n".format(
-        #     "    eval $(docker-machine env {})".format(manager_hostname_)))
+        This function waits until the Swarm managers have noticed that
+        the nodes are down. Managers are demoted first.
+        """
 
+        if nodes:
+            self.wait_until_nodes_are_down(nodes)
 
-    def status(self):
-        self.assert_swarm_is_running()
+            managers = [node for node in nodes if self.is_manager(node)]
 
-        command = "sudo docker node ls"
-        result = self.run_on_manager(command, capture=True)
-        sys.stdout.write("--- nodes ---\n{}\n\n".format(result))
+            if managers:
+                command = "sudo docker node demote {}".format(
+                    " ".join(managers))
+                self.run_on_manager(command, capture=False)
 
-        command = "sudo docker network ls"
-        result = self.run_on_manager(command, capture=True)
-        sys.stdout.write("--- networkѕ ---\n{}\n\n".format(result))
+            command = "sudo docker node rm {}".format(" ".join(nodes))
+            self.run_on_manager(command, capture=False)
 
 
-    def service_names(self):
-        command = "sudo docker service ls"
+    @profiling.operation
+    def stop_node(self,
+            node):
 
-        # Example output:
-        #
-        # ID            NAME     REPLICAS  IMAGE   COMMAND
-        # cmxx7hguy4j6  pinger   2/2       alpine  ping docker.com
-        # dhh7v9efigqo  pinger2  2/2       alpine  ping docker.com
+        self.leave_swarm(node)
+        self.local("docker-machine stop {}".format(node), capture=False)
+        self.update_inventory(node, "Stopped")
 
-        lines = str(self.run_on_manager(command, capture=True)).split("\n")[1:]
-        lines = [line.strip() for line in lines]
-        names = [line.split()[1] for line in lines]
-        return names
 
+    @profiling.operation
+    def start_node(self,
+            node):
 
-    def status_of_services(self,
-            service_names):
-        self.assert_swarm_is_running()
+        self.local("docker-machine start {}".format(node), capture=False)
+        self.update_inventory(node, "Running")
 
-        if not service_names:
-            command = "sudo docker service ls"
-            result = self.run_on_manager(command, capture=True)
-            sys.stdout.write("--- services ---\n{}\n\n".format(result))
 
-            service_names = self.service_names()
+    @profiling.operation
+    def remove_node(self,
+            node):
 
-        for service_name in service_names:
-            command = "sudo docker service ps {}".format(service_name)
-            result = self.run_on_manager(command, capture=True)
-            sys.stdout.write("--- {} ---\n{}\n\n".format(service_name, result))
+        self.local("docker-machine rm -f {}".format(node), capture=False)
+        self.update_inventory(node, None)
 
 
-    def remove_services(self,
-            service_names):
-        self.assert_swarm_is_running()
+    def swarm_state(self,
+            node):
+        """
+        Return the state of the Swarm on node, as seen by the node itself
+
+        This is "active" if the node is part of a Swarm, and "inactive" if
+        not.
+        """
+
+        command = "sudo docker info --format '{{.Swarm.LocalNodeState}}'"
+        return self.run_on_node(node, command, capture=True).strip()
 
-        for service_name in service_names:
-            command = "sudo docker service rm {}".format(service_name)
-            self.run_on_manager(command, capture=False)
+
+    def sort_by_index(self,
+            nodes):
+        return sorted(nodes, key=lambda node: (self.index(node) or 0, node))
 
 
+    @profiling.operation
     def stop(self,
             nodes):
+        """
+        Stop nodes
+
+        All workers are stopped concurrently, at most nr_parallel at the
+        same time. After that, managers are stopped one at a time.
+        """
 
         self.assert_swarm_exists()
 
@@ -629,28 +2274,39 @@ class Swarm(object):
         else:
             nodes = [self.host_basename(node) for node in nodes]
 
-        for node in nodes:
-            self.assert_node_is_ready(node)
-            is_last_running_manager = self.is_manager(node) and \
-                len(self.swarm_hostnames(state="Running")) == 1
-            self.leave_swarm(node)
-            self.local("docker-machine stop {}".format(node),
-                capture=False)
+        self.assert_nodes_are_ready(nodes)
 
-            if not is_last_running_manager:
-                while not self.node_is_down(node):
-                    time.sleep(10)
+        # Stop all workers before waiting until the Swarm has noticed
+        # they are down. That way, the waits overlap.
+        workers = [node for node in nodes if self.is_worker(node)]
 
-                if self.is_manager(node):
-                    command = "sudo docker node demote {}".format(node)
-                    self.run_on_manager(command, capture=False)
+        parallel.run_phases(self.stop_node, [workers], self.nr_parallel)
+        self.remove_nodes_from_swarm(workers)
 
-                command = "sudo docker node rm {}".format(node)
-                self.run_on_manager(command, capture=False)
+        # Stop managers one at a time, keeping the Raft quorum intact for
+        # as long as possible.
+        managers = [node for node in nodes if self.is_manager(node)]
+
+        for node in managers:
+            is_last_running_manager = \
+                len(self.manager_hostnames(state="Running")) == 1
+            self.stop_node(node)
+
+            if not is_last_running_manager:
+                self.remove_nodes_from_swarm([node])
 
 
+    @profiling.operation
     def start(self,
             nodes):
+        """
+        Start nodes and add them to the Swarm
+
+        Managers are started and join the Swarm first, one at a time, in
+        order of their index. If no manager is running, the first one
+        initializes a new Swarm. After that, all workers are started and
+        join the Swarm concurrently, at most nr_parallel at the same time.
+        """
 
         self.assert_swarm_exists()
 
@@ -659,12 +2315,34 @@ class Swarm(object):
         else:
             nodes = [self.host_basename(node) for node in nodes]
 
-        for node in nodes:
-            self.assert_node_is_down(node)
-            self.local("docker-machine start {}".format(node), capture=False)
-            self.join_swarm(node)
+        self.assert_nodes_are_down(nodes)
+
+        managers = self.sort_by_index(
+            [node for node in nodes if self.is_manager(node)])
+        workers = [node for node in nodes if self.is_worker(node)]
+
+        if not self.manager_hostnames(state="Running"):
+            if not managers:
+                raise RuntimeError(
+                    "No manager is running, start one first...")
+
+            # The last manager to leave a Swarm destroys it. Unless the host
+            # was stopped some other way, a new Swarm must be initialized.
+            node = managers.pop(0)
+            self.start_node(node)
 
+            if self.swarm_state(node) != "active":
+                self.init_swarm(node)
 
+        for node in managers:
+            self.start_node(node)
+            self.join_swarm_nodes([node])
+
+        parallel.run_phases(self.start_node, [workers], self.nr_parallel)
+        self.join_swarm_nodes(workers)
+
+
+    @profiling.operation
     def pause(self,
             nodes):
 
@@ -675,17 +2353,25 @@ class Swarm(object):
         else:
             nodes = [self.host_basename(node) for node in nodes]
 
-        for node in nodes:
-            self.assert_node_is_ready(node)
+        self.assert_nodes_are_ready(nodes)
 
+        for node in nodes:
             assert self.driver == "virtualbox", self.driver
             command = "VBoxManage controlvm {} savestate".format(node)
 
             self.local(command, capture=False)
+            self.update_inventory(node, "Saved")
 
 
+    @profiling.operation
     def resume(self,
             nodes):
+        """
+        Resume paused nodes
+
+        First all managers are resumed, then all workers. At most
+        nr_parallel nodes are resumed at the same time.
+        """
 
         self.assert_swarm_exists()
 
@@ -696,11 +2382,22 @@ class Swarm(object):
 
         for node in nodes:
             self.assert_node_is_paused(node)
-            self.local("docker-machine start {}".format(node), capture=False)
 
+        parallel.run_phases(self.start_node, [
+                [node for node in nodes if self.is_manager(node)],
+                [node for node in nodes if self.is_worker(node)],
+            ], self.nr_parallel)
 
+
+    @profiling.operation
     def remove(self,
             nodes):
+        """
+        Remove stopped nodes
+
+        First all workers are removed, then all managers. At most
+        nr_parallel nodes are removed at the same time.
+        """
 
         self.assert_swarm_exists()
 
@@ -712,9 +2409,155 @@ class Swarm(object):
         for node in nodes:
             self.assert_node_is_stopped(node)
 
-            self.local("docker-machine rm -f {}".format(node), capture=False)
+        parallel.run_phases(self.remove_node, [
+                [node for node in nodes if self.is_worker(node)],
+                [node for node in nodes if self.is_manager(node)],
+            ], self.nr_parallel)
+
+
+    def node_name(self,
+            hostname):
+        """
+        Return the name of a node as passed to the operations on nodes,
+        given its hostname (the reverse of host_basename())
+        """
+        return hostname if len(self.host_prefix) == 0 else \
+            hostname[len(self.host_prefix) + 1:]
+
+
+    def reconcile_plan(self,
+            nr_managers,
+            nr_workers,
+            remove=False):
+        """
+        Return the actions needed to end up with nr_managers running
+        managers and nr_workers running workers
+
+        The plan is an ordered dictionary of hostnames, by action
+        ("resume", "start", "take", "create", "stop", "remove"). Missing
+        nodes are obtained by resuming paused hosts first, then by
+        starting stopped hosts, then, for workers, by taking hosts from
+        the pool of spare hosts and only then by creating new hosts.
+        Surplus nodes with the highest indices are stopped. If remove is
+        True, all stopped hosts that are not needed are removed as well.
+        """
+
+        nr_managers = int(nr_managers)
+        assert nr_managers >= 1, nr_managers
+        nr_workers = int(nr_workers)
+        assert nr_workers >= 0, nr_workers
+
+        inventory = self.inventory()
+        plan = collections.OrderedDict((action, []) for action in
+            ["resume", "start", "take", "create", "stop", "remove"])
+
+        for role, nr_nodes, new_hostnames in [
+                ("manager", nr_managers, self.new_manager_hostnames),
+                ("worker", nr_workers, self.new_worker_hostnames)]:
+
+            hosts = self.sort_by_index([host.name for host in
+                inventory.values() if host.role == role])
+            running = [host for host in hosts if
+                inventory[host].state == "Running"]
+            paused = [host for host in hosts if
+                inventory[host].state == "Saved"]
+            stopped = [host for host in hosts if
+                inventory[host].state == "Stopped"]
+
+            nr_missing = max(nr_nodes - len(running), 0)
+            plan["resume"] += paused[:nr_missing]
+            nr_missing -= len(paused[:nr_missing])
+            plan["start"] += stopped[:nr_missing]
+            nr_missing -= len(stopped[:nr_missing])
+
+            if role == "worker":
+                # These are the hosts take_spares() takes.
+                spares = self.spare_hostnames(state="Stopped")[:nr_missing]
+                plan["take"] += spares
+                nr_missing -= len(spares)
+
+            plan["create"] += new_hostnames(nr_missing)
+
+            surplus = running[nr_nodes:]
+            plan["stop"] += surplus
+
+            if remove:
+                plan["remove"] += surplus + [host for host in stopped if
+                    host not in plan["start"]]
+
+        return plan
+
+
+    def print_plan(self,
+            plan):
+        lines = ["{}  {}".format(action.ljust(6), hostname) for action in
+            plan for hostname in plan[action]]
+
+        if lines:
+            self.print_status("--- plan ---\n{}\n".format(
+                "\n".join(lines)))
+        else:
+            self.print_status("Swarm is up to date")
+
+
+    @profiling.operation
+    def reconcile(self,
+            nr_managers,
+            nr_workers,
+            remove=False,
+            dry_run=False):
+        """
+        Converge the Swarm to nr_managers running managers and nr_workers
+        running workers
+
+        The plan (see reconcile_plan()) is printed and, unless dry_run is
+        True, executed. If no Swarm exists, it is created. Nodes are
+        resumed, started, taken from the pool of spare hosts, created,
+        stopped and removed in phases, at most nr_parallel at the same
+        time. The pool is refilled in the background afterwards. Running
+        the same command again does nothing.
+        """
+
+        plan = self.reconcile_plan(nr_managers, nr_workers, remove)
+        self.print_plan(plan)
+
+        if dry_run:
+            return
+
+        if not self.swarm_hostnames():
+            self.create(nr_managers, nr_workers)
+            return
+
+        names = lambda hostnames: [self.node_name(hostname) for hostname in
+            hostnames]
 
+        # The operations on nodes act on all nodes if no nodes are passed.
+        if plan["resume"]:
+            self.resume(names(plan["resume"]))
 
+        if plan["start"]:
+            self.start(names(plan["start"]))
+
+        if plan["take"]:
+            nr_spares = len(self.spare_hostnames())
+            self.take_spares(len(plan["take"]))
+
+        if plan["create"]:
+            self.provision_nodes(
+                [host for host in plan["create"] if self.is_manager(host)],
+                [host for host in plan["create"] if self.is_worker(host)])
+
+        if plan["take"]:
+            self.fill_pool_in_background(nr_spares)
+
+        if plan["stop"]:
+            self.stop(names(plan["stop"]))
+
+        if plan["remove"]:
+            self.remove(names(plan["remove"]))
+
+
+    @profiling.operation
     def create_network(self,
             name):
 
@@ -725,9 +2568,30 @@ class Swarm(object):
         self.run_on_manager(command, capture=False)
 
 
+    @profiling.operation
     def execute_command(self,
             command,
-            nodes):
+            nodes,
+            spool_directory=None):
+        """
+        Execute command on nodes
+
+        If nr_parallel is 1, the command is executed on one node after
+        the other, and execution stops at the first node on which the
+        command fails.
+
+        Otherwise, the command is executed on at most nr_parallel nodes at
+        the same time. Each line of output is prefixed by the name of the
+        node. Afterwards, a summary of the exit codes is printed. This
+        function fails if the command failed on any of the nodes.
+
+        If a spool_directory is passed, the output of each node is
+        written to <node>.log in that directory instead, see
+        stream_on_nodes(). Only the last tail_size characters of it are
+        kept in memory, and printed if the command failed on the node.
+        The command is executed on at most nr_parallel nodes at the same
+        time, and a summary of the exit codes is printed.
+        """
 
         self.assert_swarm_exists()
 
@@ -736,10 +2600,69 @@ class Swarm(object):
         else:
             nodes = [self.host_basename(node) for node in nodes]
 
-        for node in nodes:
-            self.assert_node_is_ready(node)
-
-            self.run_on_node(node, command, capture=False)
+        self.assert_nodes_are_ready(nodes)
+
+        if self.nr_parallel == 1 and spool_directory is None:
+            for node in nodes:
+                # Output of commands printed to the terminal directly
+                # cannot be redirected to the output stream of the Swarm.
+                # Otherwise, it is copied to it as is.
+                if self.output is None:
+                    self.run_on_node(node, command, capture=False)
+                else:
+                    exit_code = self.run_on_node_prefixed(node, command, "")
+
+                    if exit_code != 0:
+                        raise RuntimeError(
+                            "Command failed on node {} with exit code "
+                            "{}".format(node, exit_code))
+        else:
+            if spool_directory is None:
+                width = max(len(node) for node in nodes) if nodes else 0
+
+                def execute(
+                        node):
+                    return self.run_on_node_prefixed(node, command,
+                        "{}: ".format(node.ljust(width)))
+            else:
+                # Standard error is spooled along with standard output.
+                streams = self.stream_on_nodes("({}) 2>&1".format(command),
+                    nodes, spool_directory)
+
+                def execute(
+                        node):
+                    try:
+                        for _ in streams[node]:
+                            pass
+                    except RuntimeError as error:
+                        with self._output_lock:
+                            self.write_output("--- {} ---\n{}\n\n".format(
+                                node, error))
+
+                        return error.exit_code
+
+                    return 0
+
+            exit_codes = dict(parallel.map_unordered(execute, nodes,
+                self.nr_parallel))
+            self.print_exit_codes(nodes, exit_codes)
+            failed_nodes = [node for node in nodes if exit_codes[node] != 0]
+
+            if failed_nodes:
+                raise RuntimeError(
+                    "Command failed on {} of {} nodes: {}".format(
+                        len(failed_nodes), len(nodes),
+                        ", ".join(failed_nodes)))
+
+
+    def print_exit_codes(self,
+            nodes,
+            exit_codes):
+        width = max([len("NODE")] + [len(node) for node in nodes])
+        lines = ["{}  {}".format("NODE".ljust(width), "EXIT CODE")]
+        lines += ["{}  {}".format(node.ljust(width), exit_codes[node]) for
+            node in nodes]
+        self.write_output("--- summary ---\n{}\n\n".format("\n".join(lines)))
 
 
     def execute_on_nodes(self,
@@ -747,25 +2670,203 @@ class Swarm(object):
             command,
             arguments):
 
-        self.assert_swarm_exists()
+        command = "{} {}".format(command, " ".join(arguments))
+        self.execute_command(command, nodes)
+
+
+    def image_cache_directory(self):
+        return os.path.join(os.path.expanduser("~"), ".docker_base", "images")
+
+
+    def image_ids(self,
+            images,
+            hostnames):
+        """
+        Return, by hostname, the IDs of the images present on each node,
+        by image name
+
+        Each node is queried once, at most nr_parallel at the same time.
+        """
+
+        command = "for image in {}; do echo \"$image $(sudo docker image " \
+            "inspect --format '{{{{.Id}}}}' \"$image\" 2>/dev/null)\"; " \
+            "done".format(" ".join(shlex.quote(image) for image in images))
+
+        def image_ids_on_node(
+                hostname):
+            lines = self.run_on_node(hostname, command, capture=True)
+            pairs = [(line.split() + [None])[:2] for line in
+                lines.split("\n") if line.strip()]
+
+            return dict((image, image_id) for image, image_id in pairs if
+                image_id)
+
+        return dict(parallel.map_unordered(image_ids_on_node, hostnames,
+            self.nr_parallel))
+
+
+    def cached_image(self,
+            image,
+            hostnames):
+        """
+        Return the pathname of a tarball of image in the local image cache,
+        the ID of the image, and the hostname of the node the image was
+        pulled on, if any
+
+        The name of an image, like alpine:latest, may refer to another
+        image over time. The image is pulled on a running manager first,
+        which looks up its current ID and only downloads what changed. If
+        it cannot be pulled, for example because it was built on the
+        nodes, the image on the first node in hostnames is used. These
+        nodes must have an image by that name. Tarballs are stored by image
+        ID, a digest of the image. A tarball that is not cached yet is
+        saved from the node the ID was looked up on.
+        """
+
+        # Imported here, importing it takes relatively long.
+        import uuid
+
+        directory = self.image_cache_directory()
+
+        with self._image_cache_lock:
+            hostname = pulled_on = self.manager_hostnames(
+                state="Running")[-1]
+
+            try:
+                self.run_on_node(hostname, "sudo docker pull {}".format(
+                    shlex.quote(image)), capture=True)
+            except RuntimeError:
+                if not hostnames:
+                    raise
+
+                hostname = hostnames[0]
+                pulled_on = None
+
+            image_id = self.image_ids([image], [hostname])[hostname][image]
+            pathname = os.path.join(directory, "{}.tar".format(
+                image_id.split(":")[-1]))
+
+            if os.path.exists(pathname):
+                return pathname, image_id, pulled_on
+
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+
+            temporary_pathname = "{}.{}".format(pathname, uuid.uuid4().hex)
+
+            try:
+                with open(temporary_pathname, "wb") as file:
+                    self.local_pipeline([self.connections.command(hostname,
+                        "sudo docker save {}".format(shlex.quote(image)))],
+                        stdout=file, node=hostname)
+
+                os.rename(temporary_pathname, pathname)
+            finally:
+                if os.path.exists(temporary_pathname):
+                    os.remove(temporary_pathname)
+
+            return pathname, image_id, pulled_on
+
+
+    def copy_image(self,
+            image,
+            source,
+            target,
+            pathname):
+        """
+        Copy image to node target, from node source, or from the tarball
+        at pathname if source is None
+        """
+
+        load = self.connections.command(target, "sudo docker load")
+
+        if source is None:
+            with open(pathname, "rb") as file:
+                self.local_pipeline([load], stdin=file, node=target)
+        else:
+            save = self.connections.command(source, "sudo docker save {}"
+                .format(shlex.quote(image)))
+            self.local_pipeline([save, load], node=target)
+
+
+    @profiling.operation
+    def prefetch_images(self,
+            images,
+            hostnames):
+        """
+        Make sure images are present on nodes
+
+        Each image is pulled on a manager, which resolves its name to the
+        current image, and stored in the local image cache (see
+        cached_image()). It is then copied to the nodes that lack it, or
+        have an older image by the same name, in a tree-like fashion: in
+        each round, the local cache and every node that has the image copy
+        it to a node that doesn't, using docker save | docker load. The
+        number of nodes that have the image doubles each round. At most
+        nr_parallel copies run at the same time.
+        """
+
+        image_ids = self.image_ids(images, hostnames)
+
+        for image in images:
+            pathname, image_id, pulled_on = self.cached_image(image,
+                [hostname for hostname in hostnames if
+                    image in image_ids[hostname]])
+            holders = [hostname for hostname in hostnames if
+                image_ids[hostname].get(image) == image_id]
+            targets = [hostname for hostname in hostnames if
+                image_ids[hostname].get(image) != image_id]
+
+            if pulled_on in targets:
+                targets.remove(pulled_on)
+                holders.append(pulled_on)
+
+            if not targets:
+                continue
+
+            nr_targets = len(targets)
+
+            # None stands for the local image cache.
+            holders = [None] + holders
+
+            while targets:
+                pairs = list(zip(holders, targets))
+
+                for _ in parallel.map_unordered(
+                        lambda pair: self.copy_image(image, pair[0], pair[1],
+                            pathname),
+                        pairs, self.nr_parallel):
+                    pass
+
+                holders += targets[:len(pairs)]
+                targets = targets[len(pairs):]
+
+            self.print_status("image {} copied to {} of {} nodes".format(
+                image, nr_targets, len(hostnames)))
+
+
+    def prefetch_images_on_nodes(self,
+            images,
+            nodes):
+
+        self.assert_swarm_is_running()
 
         if not nodes:
-            nodes = swarm_hostnames(state="Running")
+            nodes = self.swarm_hostnames(state="Running")
         else:
             nodes = [self.host_basename(node) for node in nodes]
 
-        for node in nodes:
-            self.assert_node_is_ready(node)
-
-            command = "{} {}".format(command, " ".join(arguments))
-            result = self.run_on_node(node, command, capture=False)
+        self.prefetch_images(images, nodes)
 
 
 def create(
         driver,
         host_prefix,
         nr_managers,
-        nr_workers):
+        nr_workers,
+        nr_parallel=1,
+        use_template=False,
+        registry_mirror=None):
     """
     Create a Swarm with one or more manager nodes and zero or more
     worker nodes
@@ -773,25 +2874,33 @@ def create(
     First a manager node is created which is used to initialize the
     Swarm. After that, the other manager nodes are created and added to
     the Swarm. Then the worker nodes are created and added to the Swarm.
+    At most nr_parallel hosts are created at the same time. If
+    use_template is True, hosts are created as linked clones of a
+    template host (virtualbox only). If the URL of a registry_mirror is
+    passed, a mirror of that registry is deployed on the first manager,
+    and used by all other hosts.
 
     This function fails if a Swarm already exists.
     """
-    swarm = Swarm(driver, host_prefix)
-    swarm.create(nr_managers, nr_workers)
+    with Swarm(driver, host_prefix, nr_parallel, use_template,
+            registry_mirror) as swarm:
+        swarm.create(nr_managers, nr_workers)
 
 
 def status_of_swarm(
         driver,
-        host_prefix):
+        host_prefix,
+        as_json=False):
 
-    swarm = Swarm(driver, host_prefix)
-    swarm.status()
+    with Swarm(driver, host_prefix) as swarm:
+        swarm.status(as_json)
 
 
 def stop_nodes(
         driver,
         host_prefix,
-        nodes):
+        nodes,
+        nr_parallel=1):
     """
     Stop zero or more Swarm nodes
 
@@ -803,14 +2912,15 @@ def stop_nodes(
     - if no Swarm exists
     - if one of the nodes passed is not a started node in the Swarm
     """
-    swarm = Swarm(driver, host_prefix)
-    swarm.stop(nodes)
+    with Swarm(driver, host_prefix, nr_parallel) as swarm:
+        swarm.stop(nodes)
 
 
 def remove_nodes(
         driver,
         host_prefix,
-        nodes):
+        nodes,
+        nr_parallel=1):
     """
     Remove zero or more Swarm nodes
 
@@ -821,14 +2931,15 @@ def remove_nodes(
     - if no Swarm exists
     - if one of the nodes passed is not a stopped node in the Swarm
     """
-    swarm = Swarm(driver, host_prefix)
-    swarm.remove(nodes)
+    with Swarm(driver, host_prefix, nr_parallel) as swarm:
+        swarm.remove(nodes)
 
 
 def start_nodes(
         driver,
         host_prefix,
-        nodes):
+        nodes,
+        nr_parallel=1):
     """
     Start zero or more Swarm nodes
 
@@ -840,8 +2951,8 @@ def start_nodes(
     - if no Swarm exists
     - if one of the nodes passed is not a stopped node in the Swarm
     """
-    swarm = Swarm(driver, host_prefix)
-    swarm.start(nodes)
+    with Swarm(driver, host_prefix, nr_parallel) as swarm:
+        swarm.start(nodes)
 
 
 def pause_nodes(
@@ -859,14 +2970,15 @@ def pause_nodes(
     - if no Swarm exists
     - if one of the nodes passed is not a started node in the Swarm
     """
-    swarm = Swarm(driver, host_prefix)
-    swarm.pause(nodes)
+    with Swarm(driver, host_prefix) as swarm:
+        swarm.pause(nodes)
 
 
 def resume_nodes(
         driver,
         host_prefix,
-        nodes):
+        nodes,
+        nr_parallel=1):
     """
     Resume zero or more paused Swarm nodes
 
@@ -877,26 +2989,134 @@ def resume_nodes(
     - if no Swarm exists
     - if one of the nodes passed is not a paused node in the Swarm
     """
-    swarm = Swarm(driver, host_prefix)
-    swarm.resume(nodes)
+    with Swarm(driver, host_prefix, nr_parallel) as swarm:
+        swarm.resume(nodes)
 
 
 def add_manager_nodes(
         driver,
         host_prefix,
-        nr_nodes):
+        nr_nodes,
+        nr_parallel=1,
+        use_template=False,
+        images=None,
+        registry_mirror=None):
+    """
+    Add manager nodes to the Swarm
 
-    swarm = Swarm(driver, host_prefix)
-    swarm.add_manager_nodes(nr_nodes)
+    Images passed in are copied to the new nodes once all of them have
+    joined, see prefetch_images(). If the URL of a registry_mirror is
+    passed, the new hosts use the registry mirror in the Swarm, which is
+    deployed first if needed.
+    """
+    with Swarm(driver, host_prefix, nr_parallel, use_template,
+            registry_mirror) as swarm:
+        swarm.add_manager_nodes(nr_nodes, images)
 
 
 def add_worker_nodes(
         driver,
         host_prefix,
-        nr_nodes):
+        nr_nodes,
+        nr_parallel=1,
+        use_template=False,
+        images=None,
+        registry_mirror=None):
+    """
+    Add worker nodes to the Swarm
+
+    Images passed in are copied to the new nodes once all of them have
+    joined, see prefetch_images(). If the URL of a registry_mirror is
+    passed, the new hosts use the registry mirror in the Swarm, which is
+    deployed first if needed.
+    """
+    with Swarm(driver, host_prefix, nr_parallel, use_template,
+            registry_mirror) as swarm:
+        swarm.add_worker_nodes(nr_nodes, images)
+
+
+def prefetch_images(
+        driver,
+        host_prefix,
+        images,
+        nodes,
+        nr_parallel=1):
+    """
+    Make sure images are present on nodes
+
+    If no nodes are passed, images are copied to all running nodes. Each
+    image is pulled on a manager, and cached locally in
+    ~/.docker_base/images, by image ID.
+    """
+    with Swarm(driver, host_prefix, nr_parallel) as swarm:
+        swarm.prefetch_images_on_nodes(images, nodes)
+
+
+def fill_pool(
+        driver,
+        host_prefix,
+        nr_spares,
+        nr_parallel=1,
+        use_template=False,
+        registry_mirror=None):
+    """
+    Create spare hosts until the pool contains nr_spares hosts
+
+    Spare hosts are named <host_prefix>-spare<idx>. They are created like
+    other hosts and stopped afterwards. Adding workers takes hosts from
+    the pool first, and refills the pool in the background. If the URL of
+    a registry_mirror is passed, the spare hosts use the registry mirror
+    in the Swarm, which is deployed first if needed.
+    """
+    with Swarm(driver, host_prefix, nr_parallel, use_template,
+            registry_mirror) as swarm:
+        swarm.fill_pool(nr_spares)
+
+
+def status_of_pool(
+        driver,
+        host_prefix):
+
+    with Swarm(driver, host_prefix) as swarm:
+        swarm.status_of_pool()
+
+
+def refresh_inventory(
+        driver,
+        host_prefix,
+        nr_parallel=1):
+
+    with Swarm(driver, host_prefix, nr_parallel) as swarm:
+        swarm.refresh_store()
+
+
+def drain_pool(
+        driver,
+        host_prefix,
+        nr_parallel=1):
+
+    with Swarm(driver, host_prefix, nr_parallel) as swarm:
+        swarm.drain_pool()
+
+
+def reconcile(
+        driver,
+        host_prefix,
+        nr_managers,
+        nr_workers,
+        remove=False,
+        dry_run=False,
+        nr_parallel=1):
+    """
+    Converge a Swarm to nr_managers running managers and nr_workers
+    running workers
 
-    swarm = Swarm(driver, host_prefix)
-    swarm.add_worker_nodes(nr_nodes)
+    The current state is read once. Paused and stopped hosts are reused
+    before new hosts are created. Surplus nodes are stopped, and removed
+    if remove is True. If dry_run is True, the plan is only printed.
+    """
+    with Swarm(driver, host_prefix, nr_parallel) as swarm:
+        swarm.reconcile(nr_managers, nr_workers, remove, dry_run)
 
 
 def create_network(
@@ -904,17 +3124,19 @@ def create_network(
         host_prefix,
         name):
 
-    swarm = Swarm(driver, host_prefix)
-    swarm.create_network(name)
+    with Swarm(driver, host_prefix) as swarm:
+        swarm.create_network(name)
 
 
 def execute_command(
         driver,
         host_prefix,
         command,
-        nodes):
-    swarm = Swarm(driver, host_prefix)
-    swarm.execute_command(command, nodes)
+        nodes,
+        nr_parallel=1,
+        spool_directory=None):
+    with Swarm(driver, host_prefix, nr_parallel) as swarm:
+        swarm.execute_command(command, nodes, spool_directory)
 
 
 def execute_on_nodes(
@@ -922,24 +3144,49 @@ def execute_on_nodes(
         host_prefix,
         nodes,
         command,
-        arguments):
-    swarm = Swarm(driver, host_prefix)
-    swarm.execute_on_nodes(nodes, command, arguments)
+        arguments,
+        nr_parallel=1):
+    with Swarm(driver, host_prefix, nr_parallel) as swarm:
+        swarm.execute_on_nodes(nodes, command, arguments)
 
 
 def status_of_services(
         driver,
         host_prefix,
-        services):
+        services,
+        as_json=False):
 
-    swarm = Swarm(driver, host_prefix)
-    swarm.status_of_services(services)
+    with Swarm(driver, host_prefix) as swarm:
+        swarm.status_of_services(services, as_json)
 
 
 def remove_services(
         driver,
         host_prefix,
-        services):
+        services,
+        regex=False):
+
+    with Swarm(driver, host_prefix) as swarm:
+        swarm.remove_services(services, regex)
+
+
+def scale_services(
+        driver,
+        host_prefix,
+        services,
+        nr_replicas,
+        regex=False):
+
+    with Swarm(driver, host_prefix) as swarm:
+        swarm.scale_services(services, nr_replicas, regex)
+
+
+def update_service_images(
+        driver,
+        host_prefix,
+        services,
+        image,
+        regex=False):
 
-    swarm = Swarm(driver, host_prefix)
-    swarm.remove_services(services)
+    with Swarm(driver, host_prefix) as swarm:
+        swarm.update_service_images(services, image, regex)
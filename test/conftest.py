@@ -0,0 +1,54 @@
+import contextlib
+import io
+import os
+import sys
+import pytest
+
+
+test_directory = os.path.dirname(os.path.abspath(__file__))
+root_directory = os.path.dirname(test_directory)
+fake_directory = os.path.join(root_directory, "benchmark", "fake")
+sys.path.insert(0, os.path.join(root_directory, "source"))
+
+from docker_base import swarm_fabfile
+
+
+@pytest.fixture
+def fake_environment(
+        tmp_path,
+        monkeypatch):
+    """
+    Point the environment to a fresh fake state store
+
+    The simulated docker-machine, docker and ssh of the benchmark are put
+    in front of $PATH. The home directory is redirected as well.
+    """
+
+    state_directory = str(tmp_path)
+    monkeypatch.setenv("FAKE_DOCKER_STATE", state_directory)
+    monkeypatch.setenv("HOME", state_directory)
+    monkeypatch.setenv("MACHINE_STORAGE_PATH", os.path.join(state_directory,
+        "machine"))
+    monkeypatch.setenv("PATH", "{}:{}".format(fake_directory,
+        os.environ["PATH"]))
+
+    yield state_directory
+
+
+@pytest.fixture
+def open_swarm(
+        fake_environment):
+    """
+    Return a function opening the Swarm of the fake environment
+
+    Status messages of the Swarm are kept in its output.
+    """
+
+    @contextlib.contextmanager
+    def open_swarm_(
+            nr_parallel=4):
+        with swarm_fabfile.Swarm("virtualbox", "t", nr_parallel) as swarm:
+            swarm.output = io.StringIO()
+            yield swarm
+
+    return open_swarm_
@@ -0,0 +1,53 @@
+import tempfile
+from docker_base.capture import Tail, read_tail, tail, truncated
+
+
+def test_truncated():
+    assert truncated("abc", 0) == "abc"
+    assert truncated("abc", 5) == "[5 characters omitted]\nabc"
+
+
+def test_tail():
+    assert tail("abcdef", 10) == "abcdef"
+    assert tail("abcdef", 6) == "abcdef"
+    assert tail("abcdef", 2) == "[4 characters omitted]\nef"
+    assert tail("abcdef", 0) == "[6 characters omitted]\n"
+
+
+def test_read_tail():
+    with tempfile.TemporaryFile() as file:
+        assert read_tail(file, 4) == ""
+
+        file.write(b"abcdef")
+        assert read_tail(file, 10) == "abcdef"
+        assert read_tail(file, 4) == "[2 characters omitted]\ncdef"
+
+
+def test_tail_keeps_last_characters():
+    tail_ = Tail(5)
+
+    for chunk in ["ab", "cdefg", "", "h", "ijklmnopq", "r"]:
+        tail_.write(chunk)
+
+    assert tail_.nr_characters == 18
+    assert tail_.text() == "[13 characters omitted]\nnopqr"
+
+
+def test_tail_is_bounded():
+    tail_ = Tail(10)
+
+    for idx in range(10000):
+        tail_.write("{}\n".format(idx))
+
+    # Only whole chunks are dropped.
+    assert sum(len(chunk) for chunk in tail_._chunks) < 10 + len("9999\n")
+    assert tail_.text().endswith("\n9998\n9999\n")
+    assert tail_.text().startswith("[{} characters omitted]\n".format(
+        tail_.nr_characters - 10))
+
+
+def test_empty_tail():
+    tail_ = Tail(0)
+    tail_.write("abc")
+
+    assert tail_.text() == "[3 characters omitted]\n"
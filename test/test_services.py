@@ -0,0 +1,87 @@
+import pytest
+from docker_base import swarm_fabfile
+
+
+@pytest.fixture
+def services(
+        open_swarm):
+    """
+    Create a Swarm running the services api, web1 and web2
+    """
+
+    with open_swarm() as swarm:
+        swarm.create(1, 0)
+
+        for name in ["api", "web1", "web2"]:
+            swarm.run_on_manager("sudo docker service create --detach "
+                "--name {} nginx".format(name), capture=True)
+
+    return ["api", "web1", "web2"]
+
+
+def test_select_services_passes_names_through(
+        open_swarm,
+        monkeypatch):
+    def service_names(
+            swarm):
+        raise AssertionError("services must not be listed")
+
+    monkeypatch.setattr(swarm_fabfile.Swarm, "service_names", service_names)
+
+    with open_swarm() as swarm:
+        # Names of services that don't exist are passed through as well.
+        assert swarm.select_services(["web1", "other", "web1"]) == [
+            "web1", "other"]
+
+
+def test_select_services_by_glob(
+        open_swarm,
+        services):
+    with open_swarm() as swarm:
+        assert swarm.select_services(["web*"]) == ["web1", "web2"]
+        assert swarm.select_services(["web?", "*1"]) == ["web1", "web2"]
+        assert swarm.select_services(["web[2]", "api"]) == ["api", "web2"]
+        assert swarm.select_services(["db*"]) == []
+
+
+def test_select_services_by_regex(
+        open_swarm,
+        services):
+    with open_swarm() as swarm:
+        # Regular expressions must match the whole name.
+        assert swarm.select_services(["web"], regex=True) == []
+        assert swarm.select_services(["web\\d"], regex=True) == [
+            "web1", "web2"]
+        assert swarm.select_services(["web1|api", "a.*"], regex=True) == [
+            "api", "web1"]
+
+
+def test_run_for_services_on_manager(
+        open_swarm,
+        services):
+    command = "sh -c 'echo output of $0; echo error of $0 >&2; " \
+        "test $0 != web1' \"$name\""
+
+    with open_swarm() as swarm:
+        prologue_output, results = swarm.run_for_services_on_manager(
+            command, services, prologue="echo first && echo second")
+
+    assert prologue_output == "first\nsecond"
+    assert list(results) == services
+    assert results["api"] == (0, "output of api\nerror of api")
+    assert results["web1"] == (1, "output of web1\nerror of web1")
+    assert results["web2"] == (0, "output of web2\nerror of web2")
+
+
+def test_run_for_all_services_on_manager(
+        open_swarm,
+        services):
+    with open_swarm() as swarm:
+        prologue_output, results = swarm.run_for_services_on_manager(
+            "echo \"$name\"")
+
+    assert prologue_output == ""
+    assert sorted(results) == services
+
+    for name in services:
+        assert results[name] == (0, name)
@@ -0,0 +1,105 @@
+import os
+import time
+import pytest
+
+
+def test_local_stream(
+        open_swarm):
+    with open_swarm() as swarm:
+        lines = list(swarm.local_stream("seq 1 3; echo 12345678",
+            chunk_size=4))
+
+    assert lines == ["1\n", "2\n", "3\n", "1234", "5678", "\n"]
+
+
+def test_local_stream_keeps_tail_of_failing_command(
+        open_swarm):
+    with open_swarm() as swarm:
+        swarm.tail_size = 100
+
+        with pytest.raises(RuntimeError) as error:
+            for _ in swarm.local_stream("seq 1 10000; seq 1 5000 >&2; "
+                    "exit 3"):
+                pass
+
+    stdout = "".join("{}\n".format(idx) for idx in range(1, 10001))
+    stderr = "".join("{}\n".format(idx) for idx in range(1, 5001))
+
+    assert error.value.exit_code == 3
+    assert "[{} characters omitted]\n{}".format(len(stdout) - 100,
+        stdout[-100:].strip()) in str(error.value)
+    assert "[{} characters omitted]\n{}".format(len(stderr) - 100,
+        stderr[-100:].strip()) in str(error.value)
+    assert len(str(error.value)) < 400
+
+
+def test_closing_local_stream_kills_command(
+        open_swarm):
+    with open_swarm() as swarm:
+        start_time = time.time()
+        lines = swarm.local_stream("echo first; sleep 30; echo second")
+
+        assert next(lines) == "first\n"
+        lines.close()
+
+    assert time.time() - start_time < 10
+
+
+def test_local_stream_is_started_lazily(
+        open_swarm,
+        tmp_path):
+    pathname = tmp_path / "started"
+
+    with open_swarm() as swarm:
+        lines = swarm.local_stream("touch {}".format(pathname))
+        assert not pathname.exists()
+
+        assert list(lines) == []
+        assert pathname.exists()
+
+
+def test_stream_on_nodes_spools_output(
+        open_swarm,
+        tmp_path):
+    spool_directory = str(tmp_path / "spool")
+
+    with open_swarm() as swarm:
+        swarm.create(1, 1)
+        streams = swarm.stream_on_nodes("seq 1 1000", ["t-manager1",
+            "t-worker1"], spool_directory)
+
+        for node in streams:
+            assert len(list(streams[node])) == 1000
+
+    assert sorted(os.listdir(spool_directory)) == [
+        "t-manager1.log", "t-worker1.log"]
+
+    for name in os.listdir(spool_directory):
+        with open(os.path.join(spool_directory, name)) as file:
+            assert file.read() == "".join("{}\n".format(idx) for idx in
+                range(1, 1001))
+
+
+def test_execute_command_spools_output(
+        open_swarm,
+        tmp_path):
+    spool_directory = str(tmp_path / "spool")
+
+    with open_swarm() as swarm:
+        swarm.create(1, 1)
+        swarm.tail_size = 100
+
+        with pytest.raises(RuntimeError) as error:
+            swarm.execute_command("seq 1 1000; echo error >&2; exit 3",
+                ["worker1"], spool_directory)
+
+        output = swarm.output.getvalue()
+
+    assert str(error.value) == "Command failed on 1 of 1 nodes: t-worker1"
+    assert "--- t-worker1 ---\nfailed to execute command:" in output
+    assert "omitted]\n" in output
+    assert "NODE       EXIT CODE\nt-worker1  3\n" in output
+
+    with open(os.path.join(spool_directory, "t-worker1.log")) as file:
+        assert file.read() == "".join("{}\n".format(idx) for idx in
+            range(1, 1001)) + "error\n"
@@ -0,0 +1,181 @@
+import pytest
+from docker_base import swarm_fabfile
+
+
+@pytest.fixture
+def plan_of(
+        open_swarm):
+    """
+    Return a function returning the non-empty actions of a reconcile plan
+    """
+
+    def plan_of_(
+            nr_managers,
+            nr_workers,
+            remove=False):
+        with open_swarm() as swarm:
+            plan = swarm.reconcile_plan(nr_managers, nr_workers, remove)
+
+        return {action: hostnames for action, hostnames in plan.items() if
+            hostnames}
+
+    return plan_of_
+
+
+def test_reconcile_creates_swarm(
+        open_swarm,
+        plan_of):
+    assert plan_of(1, 2) == {
+        "create": ["t-manager1", "t-worker1", "t-worker2"]}
+
+    with open_swarm() as swarm:
+        swarm.reconcile(1, 2)
+
+    with open_swarm() as swarm:
+        assert swarm.manager_hostnames(state="Running") == ["t-manager1"]
+        assert swarm.worker_hostnames(state="Running") == [
+            "t-worker1", "t-worker2"]
+
+
+def test_reconcile_is_idempotent(
+        open_swarm,
+        plan_of):
+    with open_swarm() as swarm:
+        swarm.reconcile(1, 2)
+
+    assert plan_of(1, 2) == {}
+
+    with open_swarm() as swarm:
+        swarm.reconcile(1, 2)
+        assert "Swarm is up to date" in swarm.output.getvalue()
+
+    assert plan_of(1, 1) == {"stop": ["t-worker2"]}
+
+    with open_swarm() as swarm:
+        swarm.reconcile(1, 1)
+
+    assert plan_of(1, 1) == {}
+    assert plan_of(1, 1, remove=True) == {"remove": ["t-worker2"]}
+    assert plan_of(1, 2) == {"start": ["t-worker2"]}
+
+    with open_swarm() as swarm:
+        swarm.reconcile(1, 2)
+
+    assert plan_of(1, 2) == {}
+
+
+def test_reconcile_uses_existing_hosts_first(
+        open_swarm,
+        plan_of):
+    with open_swarm() as swarm:
+        swarm.reconcile(1, 2)
+        swarm.stop(["worker1"])
+        swarm.pause(["worker2"])
+
+    assert plan_of(1, 3) == {
+        "resume": ["t-worker2"],
+        "start": ["t-worker1"],
+        "create": ["t-worker3"],
+    }
+
+
+def test_stop_and_start_last_manager(
+        open_swarm,
+        plan_of):
+    with open_swarm() as swarm:
+        swarm.create(1, 1)
+        swarm.stop([])
+
+    with open_swarm() as swarm:
+        assert sorted(swarm.swarm_hostnames(state="Stopped")) == [
+            "t-manager1", "t-worker1"]
+        swarm.start([])
+
+    with open_swarm() as swarm:
+        hostnames = sorted(swarm.swarm_hostnames(state="Running"))
+        assert hostnames == ["t-manager1", "t-worker1"]
+        assert swarm.status_of_nodes(hostnames) == {
+            "t-manager1": "ready", "t-worker1": "ready"}
+
+    assert plan_of(1, 1) == {}
+
+
+def test_spare_promotion(
+        open_swarm,
+        plan_of,
+        monkeypatch):
+    pool_sizes = []
+    monkeypatch.setattr(swarm_fabfile.Swarm, "fill_pool_in_background",
+        lambda swarm, nr_spares: pool_sizes.append(nr_spares))
+
+    with open_swarm() as swarm:
+        swarm.create(1, 0)
+        swarm.fill_pool(2)
+
+    with open_swarm() as swarm:
+        swarm.add_worker_nodes(1)
+
+    assert pool_sizes == [2]
+
+    with open_swarm() as swarm:
+        assert swarm.spare_hostnames() == ["t-spare2"]
+        assert swarm.worker_hostnames(state="Running") == ["t-spare1"]
+        assert swarm.status_of_node("t-spare1") == "ready"
+
+        # A promoted spare host is a worker, not a manager.
+        assert swarm.manager_hostnames() == ["t-manager1"]
+        assert swarm.new_manager_hostname() == "t-manager2"
+
+    assert plan_of(1, 3) == {
+        "take": ["t-spare2"],
+        "create": ["t-worker1"],
+    }
+
+    with open_swarm() as swarm:
+        swarm.reconcile(1, 3)
+
+    assert pool_sizes == [2, 1]
+    assert plan_of(1, 3) == {}
+
+    with open_swarm() as swarm:
+        assert swarm.spare_hostnames() == []
+        assert len(swarm.worker_hostnames(state="Running")) == 3
+
+
+def test_images_are_prefetched_once_per_batch(
+        open_swarm,
+        monkeypatch):
+    monkeypatch.setattr(swarm_fabfile.Swarm, "fill_pool_in_background",
+        lambda swarm, nr_spares: None)
+    prefetch_images = swarm_fabfile.Swarm.prefetch_images
+    calls = []
+
+    def prefetch_images_(
+            swarm,
+            images,
+            hostnames):
+        calls.append((images, hostnames))
+        prefetch_images(swarm, images, hostnames)
+
+    monkeypatch.setattr(swarm_fabfile.Swarm, "prefetch_images",
+        prefetch_images_)
+
+    with open_swarm() as swarm:
+        swarm.create(1, 0)
+        swarm.fill_pool(1)
+        swarm.add_worker_nodes(3, ["alpine"])
+        swarm.add_manager_nodes(2, ["alpine"])
+
+    assert calls == [
+        (["alpine"], ["t-spare1", "t-worker1", "t-worker2"]),
+        (["alpine"], ["t-manager2", "t-manager3"]),
+    ]
+
+    with open_swarm() as swarm:
+        hostnames = swarm.swarm_hostnames()
+        image_ids = swarm.image_ids(["alpine"], hostnames)
+
+    assert len(hostnames) == 6
+
+    for hostname in hostnames:
+        assert "alpine" in image_ids[hostname]